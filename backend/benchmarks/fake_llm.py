@@ -0,0 +1,138 @@
+"""Local OpenAI-compatible chat server for benchmarks (no Groq quota spent).
+
+Run it and point the API at it:
+
+    python -m benchmarks.fake_llm --port 9100 --latency-ms 400 --tokens-per-s 250
+    LLM_BASE_URL=http://127.0.0.1:9100/v1 GROQ_API_KEY=fake uvicorn main:app
+
+Supports /v1/chat/completions with and without stream=true. Every reply is a
+valid ICFES item in the JSON shape build_prompts asks for.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import argparse
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Time to first token, and generation speed after it
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "300"))
+FAKE_LLM_TOKENS_PER_S = float(os.getenv("FAKE_LLM_TOKENS_PER_S", "200"))
+# Fraction of requests answered with HTTP 500
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+# Rough chars per token, used to size stream chunks and usage counts
+CHARS_PER_TOKEN = 4
+
+app = FastAPI(title="Fake LLM")
+app.state.latency_ms = FAKE_LLM_LATENCY_MS
+app.state.tokens_per_s = FAKE_LLM_TOKENS_PER_S
+app.state.error_rate = FAKE_LLM_ERROR_RATE
+app.state.requests = 0
+
+
+def fake_item(seed: int) -> str:
+    return json.dumps({
+        "stimulus": f"En el municipio {seed}, el concejo debate la construcción de una represa que abastecería de agua a la ciudad pero inundaría tierras de comunidades campesinas.",
+        "question_stem": "¿Cuál de los siguientes argumentos defiende los derechos de las comunidades afectadas?",
+        "options": {
+            "A": "La represa beneficia a más personas, por lo que debe construirse sin consulta.",
+            "B": "Las comunidades deben ser consultadas y compensadas antes de cualquier decisión.",
+            "C": "El agua es un recurso que solo el gobierno nacional puede administrar.",
+            "D": "Los campesinos pueden trasladarse a la ciudad para acceder al agua."
+        },
+        "correct_option": "B",
+        "rationale": "La consulta previa y la compensación protegen los derechos de las comunidades.",
+        "distractor_rationales": {
+            "A": "Prioriza la mayoría sin considerar derechos.",
+            "C": "Confunde competencias territoriales.",
+            "D": "Traslada el costo a los afectados."
+        }
+    }, ensure_ascii=False)
+
+
+def _usage(prompt_chars, completion):
+    prompt_tokens = prompt_chars // CHARS_PER_TOKEN
+    completion_tokens = len(completion) // CHARS_PER_TOKEN
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    app.state.requests += 1
+    seed = app.state.requests
+    if app.state.error_rate and (seed * 7919) % 1000 < app.state.error_rate * 1000:
+        return JSONResponse({"error": {"message": "fake upstream error", "type": "server_error"}}, status_code=500)
+
+    prompt_chars = sum(len(m.get("content") or "") for m in body.get("messages", []))
+    completion = fake_item(seed)
+    model = body.get("model", "fake")
+    created = int(time.time())
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    seconds_per_token = 1.0 / app.state.tokens_per_s if app.state.tokens_per_s > 0 else 0.0
+
+    await asyncio.sleep(app.state.latency_ms / 1000)
+
+    if not body.get("stream"):
+        await asyncio.sleep(len(completion) / CHARS_PER_TOKEN * seconds_per_token)
+        return {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": completion}}],
+            "usage": _usage(prompt_chars, completion),
+        }
+
+    async def events():
+        def chunk(delta, finish=None, usage=None):
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                       "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            if usage:
+                payload["usage"] = usage
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        yield chunk({"role": "assistant", "content": ""})
+        for i in range(0, len(completion), CHARS_PER_TOKEN):
+            yield chunk({"content": completion[i:i + CHARS_PER_TOKEN]})
+            await asyncio.sleep(seconds_per_token)
+        yield chunk({}, finish="stop", usage=_usage(prompt_chars, completion))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def serve_in_thread(port: int, latency_ms: float = None, tokens_per_s: float = None, error_rate: float = None):
+    """Starts the fake server on a daemon thread; returns the uvicorn Server (call .should_exit = True to stop)."""
+    import threading
+    import uvicorn
+
+    if latency_ms is not None:
+        app.state.latency_ms = latency_ms
+    if tokens_per_s is not None:
+        app.state.tokens_per_s = tokens_per_s
+    if error_rate is not None:
+        app.state.error_rate = error_rate
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="fake-llm", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=FAKE_LLM_LATENCY_MS)
+    parser.add_argument("--tokens-per-s", type=float, default=FAKE_LLM_TOKENS_PER_S)
+    parser.add_argument("--error-rate", type=float, default=FAKE_LLM_ERROR_RATE)
+    args = parser.parse_args()
+    app.state.latency_ms = args.latency_ms
+    app.state.tokens_per_s = args.tokens_per_s
+    app.state.error_rate = args.error_rate
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,379 @@
+"""Benchmark runner. Needs the Postgres from docker-compose; never calls Groq.
+Extra dependencies: pip install -r requirements-dev.txt (httpx).
+
+    python -m benchmarks.run                       # every scenario
+    python -m benchmarks.run etl generate --rows 20000 --concurrency 1 8 32
+    python -m benchmarks.run retrieval --compare benchmarks/results/baseline.json
+    python -m benchmarks.run startup               # import time + time to /readyz of a fresh worker
+
+Generation goes to benchmarks/fake_llm.py (started in-process) through
+LLM_BASE_URL. Results are written as JSON (--output) so runs can be diffed.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import resource
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("etl", "generate", "retrieval", "startup")
+FIRST_PARTY = ("main", "core", "routers", "etl")
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _latency_summary(samples_s):
+    if not samples_s:
+        return {"n": 0}
+    ms = np.array(samples_s) * 1000
+    return {
+        "n": len(ms),
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def bench_etl(args):
+    from benchmarks.synthetic_csv import write_csv
+    from etl.etl_rag_builder import process_csv_stream
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.csv")
+        start = time.perf_counter()
+        write_csv(path, rows=args.rows, n_skills=args.skills, n_patterns=args.patterns)
+        csv_seconds = time.perf_counter() - start
+
+        rss_before = _rss_mb()
+        start = time.perf_counter()
+        # Unique source file per run, so the upserts really insert
+        result = process_csv_stream(path, source_filename=f"benchmark_{int(time.time())}.csv")
+        elapsed = time.perf_counter() - start
+
+    details = result.get("details", {})
+    return {
+        "status": result.get("status"),
+        "rows": args.rows,
+        "csv_generation_seconds": round(csv_seconds, 3),
+        "seconds": round(elapsed, 3),
+        "rows_per_s": round(args.rows / elapsed, 1) if elapsed else None,
+        "stages": details.get("stages"),
+        "rss_before_mb": rss_before,
+        "rss_after_mb": _rss_mb(),
+    }
+
+
+def _start_api(port):
+    import uvicorn
+    from main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="bench-api", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def bench_generate(args):
+    import httpx
+
+    api = _start_api(args.api_port)
+    base = f"http://127.0.0.1:{args.api_port}"
+    payload = {"exam": args.exam, "skill": args.skill, "difficulty": "Media", "fresh": True}
+    results = {"fake_llm": {"latency_ms": args.llm_latency_ms, "tokens_per_s": args.llm_tokens_per_s}, "levels": []}
+
+    try:
+        with httpx.Client(base_url=base, timeout=120) as client:
+            client.post("/generation/generate", json=payload)  # warm-up (caches, pool connections)
+
+            for concurrency in args.concurrency:
+                latencies, errors = [], 0
+
+                def one(_):
+                    start = time.perf_counter()
+                    response = client.post("/generation/generate", json=payload)
+                    elapsed = time.perf_counter() - start
+                    body = response.json() if response.status_code == 200 else {}
+                    return elapsed, response.status_code != 200 or body.get("mock_fallback", False)
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    for elapsed, failed in pool.map(one, range(args.requests)):
+                        latencies.append(elapsed)
+                        errors += failed
+                wall = time.perf_counter() - start
+                results["levels"].append({
+                    "concurrency": concurrency,
+                    "requests": args.requests,
+                    "errors": int(errors),
+                    "throughput_rps": round(args.requests / wall, 2),
+                    **_latency_summary(latencies),
+                })
+
+            # Time to first byte of the SSE variant
+            ttfb, total = [], []
+            for _ in range(min(args.requests, 20)):
+                start = time.perf_counter()
+                with client.stream("POST", "/generation/generate/stream", json=payload) as response:
+                    first = None
+                    for _chunk in response.iter_bytes():
+                        if first is None:
+                            first = time.perf_counter() - start
+                ttfb.append(first or 0.0)
+                total.append(time.perf_counter() - start)
+            results["stream"] = {"ttfb": _latency_summary(ttfb), "total": _latency_summary(total)}
+    finally:
+        api.should_exit = True
+    results["rss_mb"] = _rss_mb()
+    return results
+
+
+def bench_retrieval(args):
+    from core.database import SessionLocal
+    from core.skill_index import skill_index
+    from core.vector_index import similarity_index
+    from core.embeddings import embed_texts
+    from core.generation_service import GenerationService
+
+    start = time.perf_counter()
+    skill_index.refresh(SessionLocal)
+    refresh_s = time.perf_counter() - start
+    skills = [e["skill"] for e in skill_index.entries] or [args.skill]
+    queries = [skills[i % len(skills)] for i in range(args.requests)]
+
+    lookups = []
+    for q in queries:
+        start = time.perf_counter()
+        skill_index.search(q[: max(4, len(q) // 2)])
+        lookups.append(time.perf_counter() - start)
+
+    db = SessionLocal()
+    try:
+        # Cold: first lookup of a skill (distractor cache miss); warm: repeats
+        cold, warm, seen = [], [], set()
+        for q in queries:
+            start = time.perf_counter()
+            GenerationService(db).retrieve_context(args.exam, q)
+            (warm if q in seen else cold).append(time.perf_counter() - start)
+            seen.add(q)
+    finally:
+        db.close()
+
+    start = time.perf_counter()
+    similarity_index.load_or_build(SessionLocal)
+    index_load_s = time.perf_counter() - start
+    vectors = embed_texts([f"consulta de similitud {i}" for i in range(args.requests)])
+    searches = []
+    for vec in vectors:
+        start = time.perf_counter()
+        similarity_index.search(vec[None, :], k=5)
+        searches.append(time.perf_counter() - start)
+
+    return {
+        "skill_cards": len(skill_index.entries),
+        "skill_index_refresh_s": round(refresh_s, 4),
+        "skill_search": _latency_summary(lookups),
+        "retrieve_context_cold": _latency_summary(cold),
+        "retrieve_context_warm": _latency_summary(warm),
+        "similarity_index": {"load_s": round(index_load_s, 3), **similarity_index.stats()},
+        "similarity_search": _latency_summary(searches),
+        "rss_mb": _rss_mb(),
+    }
+
+
+def _import_profile(env):
+    """`python -X importtime -c "import main"` in a fresh interpreter: wall time and cumulative us per module."""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR, env=env,
+                          capture_output=True, text=True, timeout=300)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"import main failed: {proc.stderr.strip().splitlines()[-1:]}")
+    modules = {}
+    for line in proc.stderr.splitlines():
+        parts = line.partition("import time:")[2].split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            modules[parts[2].strip()] = int(parts[1])
+    return wall, modules
+
+
+def _slowest(modules, keep, top):
+    ranked = sorted(((name, us) for name, us in modules.items() if keep(name)), key=lambda m: -m[1])[:top]
+    return {name: round(us / 1e6, 4) for name, us in ranked}
+
+
+def bench_startup(args):
+    import httpx
+
+    env = {**os.environ, "POOL_ENABLED": "false"}
+    walls, main_s, profiles = [], [], []
+    for _ in range(args.startup_runs):
+        wall, modules = _import_profile(env)
+        walls.append(wall)
+        main_s.append(modules.get("main", 0) / 1e6)
+        profiles.append(modules)
+    modules = profiles[-1]
+
+    # Cold start of a real worker: first answer (any status) and first 200 from /readyz
+    port = args.api_port + 1
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=BACKEND_DIR, env=env)
+    first_response = ready = report = None
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5) as client:
+            while time.perf_counter() - start < args.startup_timeout:
+                try:
+                    response = client.get("/readyz")
+                except httpx.TransportError:
+                    time.sleep(0.05)
+                    continue
+                first_response = first_response or time.perf_counter() - start
+                report = response.json()
+                if response.status_code == 200:
+                    ready = time.perf_counter() - start
+                    break
+                time.sleep(0.1)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+    return {
+        "runs": args.startup_runs,
+        "interpreter_wall_s": round(float(np.median(walls)), 4),
+        "import_main_s": round(float(np.median(main_s)), 4),
+        # Cumulative import time (includes what each module pulls in)
+        "slowest_first_party": _slowest(modules, lambda m: m.split(".")[0] in FIRST_PARTY, args.startup_top),
+        "slowest_packages": _slowest(modules, lambda m: "." not in m and m not in FIRST_PARTY, args.startup_top),
+        "worker": {
+            "first_response_s": round(first_response, 4) if first_response else None,
+            "ready_s": round(ready, 4) if ready else None,
+            "readyz": report,
+        },
+    }
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}.{k}" if prefix else str(k), v, out)
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            _flatten(f"{prefix}[{i}]", v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+
+def compare(current, baseline_path):
+    """Prints the relative change of every numeric metric against a previous result file."""
+    with open(baseline_path) as f:
+        baseline = _flatten("", json.load(f)["scenarios"], {})
+    now = _flatten("", current["scenarios"], {})
+    for key in sorted(set(now) & set(baseline)):
+        before, after = baseline[key], now[key]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{key:60s} {before:>12} -> {after:>12}  {change}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ICFES generator benchmarks")
+    parser.add_argument("scenarios", nargs="*", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--rows", type=int, default=10000, help="synthetic CSV rows (etl)")
+    parser.add_argument("--skills", type=int, default=100)
+    parser.add_argument("--patterns", type=int, default=30)
+    parser.add_argument("--requests", type=int, default=100, help="requests per level / queries")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--exam", default="Sociales y Ciudadanas")
+    parser.add_argument("--skill", default="Argumentación")
+    parser.add_argument("--llm-port", type=int, default=9100)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-tokens-per-s", type=float, default=200)
+    parser.add_argument("--api-port", type=int, default=8100)
+    parser.add_argument("--startup-runs", type=int, default=3, help="fresh interpreters timed (startup)")
+    parser.add_argument("--startup-top", type=int, default=10, help="slowest modules listed (startup)")
+    parser.add_argument("--startup-timeout", type=float, default=120, help="seconds to wait for /readyz (startup)")
+    parser.add_argument("--output", default=None, help="result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="previous result file to diff against")
+    args = parser.parse_args(argv)
+
+    # Must be set before core.generation_service is imported
+    os.environ.setdefault("LLM_BASE_URL", f"http://127.0.0.1:{args.llm_port}/v1")
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    os.environ.setdefault("POOL_ENABLED", "false")  # measure the LLM path, not pre-generated items
+
+    fake_llm = None
+    if "generate" in args.scenarios:
+        from benchmarks.fake_llm import serve_in_thread
+        fake_llm = serve_in_thread(args.llm_port, args.llm_latency_ms, args.llm_tokens_per_s)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "scenarios": {},
+    }
+    runners = {"etl": bench_etl, "generate": bench_generate, "retrieval": bench_retrieval, "startup": bench_startup}
+    try:
+        for name in args.scenarios:
+            print(f"Running {name}...", flush=True)
+            try:
+                report["scenarios"][name] = runners[name](args)
+            except Exception as e:
+                report["scenarios"][name] = {"error": str(e)}
+                print(f"  {name} failed: {e}", flush=True)
+    finally:
+        if fake_llm is not None:
+            fake_llm.should_exit = True
+    report["meta"]["peak_rss_mb"] = _peak_rss_mb()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Synthetic ICFES item matrix with the columns etl_rag_builder reads.
+
+    python -m benchmarks.synthetic_csv data/bench.csv --rows 50000 --skills 200 --patterns 40
+"""
+import argparse
+import random
+
+import numpy as np
+import pandas as pd
+
+DIFFICULTIES = ["Baja", "Media", "Alta"]
+TOPICS = ["Constitución", "Derechos humanos", "Economía", "Geografía", "Historia de Colombia",
+          "Conflicto armado", "Participación ciudadana", "Medio ambiente"]
+WORDS = ("ciudadanía comunidad gobierno territorio conflicto derechos participación economía "
+         "recursos población política social cultural historia región acuerdo norma estado "
+         "decisión intereses argumento evidencia fuente contexto consecuencia").split()
+
+
+def _sentences(rng, n, words):
+    # Vectorized pseudo-text: n sentences of `words` random words each
+    picks = rng.integers(0, len(WORDS), size=(n, words))
+    vocab = np.array(WORDS)
+    return [" ".join(row).capitalize() + "." for row in vocab[picks]]
+
+
+def generate(rows: int = 10000, n_skills: int = 100, n_patterns: int = 30, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    skills = [f"Habilidad sintética {i:04d}: analizar {random.choice(WORDS)} y {random.choice(WORDS)}" for i in range(n_skills)]
+    patterns = [f"Patrón {i:03d}: confunde {random.choice(WORDS)} con {random.choice(WORDS)}" for i in range(n_patterns)]
+
+    skill_ids = rng.integers(0, n_skills, size=rows)
+    df = pd.DataFrame({
+        "item_id": [f"SYN-{i:07d}" for i in range(rows)],
+        "skill": np.array(skills)[skill_ids],
+        "topic": np.array(TOPICS)[rng.integers(0, len(TOPICS), size=rows)],
+        "difficulty": np.array(DIFFICULTIES)[rng.integers(0, len(DIFFICULTIES), size=rows)],
+        "required_steps": [f"Paso {s % 5 + 1}: identificar la postura" for s in skill_ids],
+        "common_misconception": [f"Confusión frecuente {s % 7}" for s in skill_ids],
+        "stimulus": _sentences(rng, rows, 40),
+        "question_stem": _sentences(rng, rows, 12),
+        "correct_option": np.array(list("ABCD"))[rng.integers(0, 4, size=rows)],
+    })
+    for slot in "abcd":
+        df[f"option_{slot}"] = _sentences(rng, rows, 10)
+        df[f"distractor_pattern_{slot}"] = np.array(patterns)[rng.integers(0, n_patterns, size=rows)]
+        df[f"distractor_rationale_{slot}"] = _sentences(rng, rows, 8)
+    return df
+
+
+def write_csv(path: str, rows: int = 10000, n_skills: int = 100, n_patterns: int = 30, seed: int = 42) -> str:
+    generate(rows, n_skills, n_patterns, seed).to_csv(path, index=False)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes a synthetic ICFES item CSV.")
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--skills", type=int, default=100)
+    parser.add_argument("--patterns", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    write_csv(args.path, args.rows, args.skills, args.patterns, args.seed)
+    print(f"Wrote {args.rows} rows to {args.path}")
@@ -0,0 +1,237 @@
+import os
+import re
+import math
+import threading
+from collections import OrderedDict
+
+from core.skill_index import normalize_skill
+
+# Tokens allowed for the retrieved context (skill card + distractor patterns);
+# the fixed template around it is counted separately
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+MAX_EXAMPLES_PER_PATTERN = int(os.getenv("CONTEXT_MAX_EXAMPLES_PER_PATTERN", "3"))
+# Items at or above this word-set Jaccard with a kept item are dropped as repeats
+NEAR_DUPLICATE_JACCARD = 0.8
+PACK_CACHE_SIZE = 1024
+CHARS_PER_TOKEN = 4
+
+# Resolved on first use (or by the warm-up): loading the vocabulary may download it
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def load_encoding():
+    """The tiktoken encoding, or None when tiktoken (or its cached vocabulary) is unavailable."""
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("cl100k_base")  # close to the Llama 3 tokenizer
+            except Exception:  # optional dependency (or no cached vocabulary)
+                _encoding = None
+            _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count of `text` (tiktoken when installed, ~4 chars/token otherwise)."""
+    if not text:
+        return 0
+    encoding = load_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+_SECTION = re.compile(r"^(Topics|Common Misconceptions|Required Steps|Examples of Logic):\s*(.*)$")
+
+
+def parse_card(content: str):
+    """Splits a skill card / distractor pattern document (etl_rag_builder layout) into fields."""
+    parsed = {"title": None, "topics": [], "misconceptions": [], "steps": [], "examples": []}
+    target = None
+    for line in (content or "").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if parsed["title"] is None and (line.startswith("Skill:") or line.startswith("Distractor Pattern:")):
+            parsed["title"] = line.split(":", 1)[1].strip()
+            continue
+        match = _SECTION.match(line)
+        if match:
+            name, rest = match.groups()
+            if name == "Topics":
+                parsed["topics"] = [t.strip() for t in rest.split(",") if t.strip()]
+                target = None
+            else:
+                target = {"Common Misconceptions": "misconceptions", "Required Steps": "steps",
+                          "Examples of Logic": "examples"}[name]
+            continue
+        if target and line.startswith("- "):
+            parsed[target].append(line[2:].strip())
+    return parsed
+
+
+def _words(text):
+    return set(normalize_skill(text).split())
+
+
+def rank(items, counts=None, query_words=frozenset()):
+    """Dedupes (exact and near-duplicate) and orders items: frequent, on-topic, earlier first."""
+    counts = counts or {}
+    kept, kept_words, seen = [], [], set()
+    for position, item in enumerate(items):
+        norm = normalize_skill(item)
+        if not norm or norm in seen:
+            continue
+        seen.add(norm)
+        words = set(norm.split())
+        if any(len(words & other) / len(words | other) >= NEAR_DUPLICATE_JACCARD for other in kept_words):
+            continue
+        kept_words.append(words)
+        relevance = len(words & query_words) / len(words) if words else 0.0
+        kept.append((-counts.get(item, 1), -relevance, position, item))
+    kept.sort()
+    return [item for *_, item in kept]
+
+
+class ContextPacker:
+    """Builds the prompt context within a token budget.
+
+    Misconceptions and required steps come from the skill card (ranked by how
+    many source rows mention them, then by overlap with the skill/topic), and
+    distractor patterns keep the retrieval order with up to
+    MAX_EXAMPLES_PER_PATTERN examples each. Sections are filled round-robin so
+    none starves the others, and anything that does not fit is dropped
+    (counted in `dropped`). Packed blocks are cached per card and budget.
+    """
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET):
+        self.budget = budget
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def pack(self, skill_card: dict, distractors: list, topic: str = None, budget: int = None, cache_key=None):
+        """skill_card: {"content", "metadata"} or None; distractors: [{"content"}].
+
+        Returns {"skill_card": str, "distractors": str, "tokens": int, "dropped": {...}}.
+        """
+        budget = budget or self.budget
+        key = (cache_key, topic, budget) if cache_key else None
+        if key:
+            with self._lock:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    return cached
+
+        packed = self._pack(skill_card, distractors, topic, budget)
+        if key:
+            with self._lock:
+                self._cache[key] = packed
+                if len(self._cache) > PACK_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return packed
+
+    def _pack(self, skill_card, distractors, topic, budget):
+        card = parse_card(skill_card["content"]) if skill_card else parse_card("")
+        meta = (skill_card or {}).get("metadata") or {}
+        title = card["title"] or (skill_card or {}).get("skill") or ""
+        query_words = _words(f"{title} {topic or ''}")
+
+        header = f"Skill: {title}"
+        topics = rank(card["topics"], query_words=query_words)
+        if topic:
+            topics = [topic] + [t for t in topics if normalize_skill(t) != normalize_skill(topic)]
+        used = count_tokens(header)
+
+        sections = {
+            "topics": [(t, count_tokens(t) + 1) for t in topics],
+            "misconceptions": [(m, count_tokens(m) + 2) for m in rank(card["misconceptions"], meta.get("misconception_counts"), query_words)],
+            "steps": [(s, count_tokens(s) + 2) for s in rank(card["steps"], meta.get("step_counts"), query_words)],
+        }
+        patterns = []
+        for doc in distractors or []:
+            parsed = parse_card(doc.get("content"))
+            name = parsed["title"] or doc.get("content", "")[:80]
+            examples = rank(parsed["examples"], query_words=query_words)
+            patterns.append((name, examples))
+        sections["patterns"] = [(i, count_tokens(name) + 2) for i, (name, _) in enumerate(patterns)]
+        # Best example of every pattern first, then the second ones, ...
+        sections["examples"] = [
+            ((i, examples[j]), count_tokens(examples[j]) + 3)
+            for j in range(MAX_EXAMPLES_PER_PATTERN)
+            for i, (_, examples) in enumerate(patterns)
+            if j < len(examples)
+        ]
+
+        chosen = {name: [] for name in sections}
+        dropped = {name: 0 for name in sections}
+        cursors = {name: 0 for name in sections}
+        # Round-robin over sections, best-ranked first; skip what does not fit
+        while any(cursors[name] < len(items) for name, items in sections.items()):
+            for name, items in sections.items():
+                if cursors[name] >= len(items):
+                    continue
+                value, cost = items[cursors[name]]
+                if name == "examples":
+                    if value[0] >= cursors["patterns"]:
+                        continue  # its pattern has not been considered yet
+                    if value[0] not in chosen["patterns"]:
+                        cursors[name] += 1
+                        dropped[name] += 1
+                        continue
+                cursors[name] += 1
+                if used + cost > budget:
+                    dropped[name] += 1
+                    continue
+                used += cost
+                chosen[name].append(value)
+        return self._render(header, chosen, patterns, dropped, used)
+
+    def _render(self, header, chosen, patterns, dropped, used):
+        lines = [header]
+        if chosen["topics"]:
+            lines.append("Topics: " + ", ".join(chosen["topics"]))
+        if chosen["misconceptions"]:
+            lines.append("Common Misconceptions:\n" + "\n".join(f"- {m}" for m in chosen["misconceptions"]))
+        if chosen["steps"]:
+            lines.append("Required Steps:\n" + "\n".join(f"- {s}" for s in chosen["steps"]))
+
+        examples_by_pattern = {}
+        for i, ex in chosen["examples"]:
+            examples_by_pattern.setdefault(i, []).append(ex)
+        blocks = []
+        for i, (name, _) in enumerate(patterns):
+            if i not in chosen["patterns"]:
+                continue
+            block = f"Pattern: {name}"
+            if examples_by_pattern.get(i):
+                block += "\n" + "\n".join(f"  - {ex}" for ex in examples_by_pattern[i])
+            blocks.append(block)
+
+        return {
+            "skill_card": "\n\n".join(lines),
+            "distractors": "\n".join(blocks),
+            "tokens": used,
+            "dropped": {k: v for k, v in dropped.items() if v},
+        }
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def on_etl_commit(self, documents_changed=True, **_):
+        """events.ETL_COMMITTED listener: skill cards are updated in place, so cached packs go stale."""
+        if documents_changed:
+            self.clear()
+
+    def stats(self):
+        return {"budget": self.budget, "cached_packs": len(self._cache), "tokenizer": ("tiktoken" if _encoding else "chars/4") if _encoding_loaded else "not loaded"}
+
+
+context_packer = ContextPacker()
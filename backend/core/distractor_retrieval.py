@@ -0,0 +1,235 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import text
+
+from core.embeddings import embed_text, from_pgvector_binary, to_pgvector
+from core.pgvector_indexes import vector_index_manager
+
+logger = logging.getLogger("DistractorRetrieval")
+
+DISTRACTOR_K = int(os.getenv("DISTRACTOR_K", "3"))
+# Candidates pulled from the ANN index before MMR re-ranking
+DISTRACTOR_FETCH_K = int(os.getenv("DISTRACTOR_FETCH_K", "20"))
+# 0 = sqrt(lists) of the current ivfflat index (see core/pgvector_indexes.py)
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "0"))
+# 1.0 = pure relevance, 0.0 = pure diversity
+MMR_LAMBDA = float(os.getenv("DISTRACTOR_MMR_LAMBDA", "0.7"))
+# LRU bound on cached rankings (skill cards plus free-text skills without a card)
+DISTRACTOR_CACHE_SIZE = int(os.getenv("DISTRACTOR_CACHE_SIZE", "4096"))
+# Skill cards ranked per rank_many query during precompute
+PRECOMPUTE_BATCH = 200
+
+
+def mmr(query_scores, vectors, k, lambda_=MMR_LAMBDA):
+    """Maximal Marginal Relevance: indices of `k` items, relevant but not redundant.
+
+    query_scores: (n,) cosine similarity to the query; vectors: (n, dim) L2-normalised.
+    """
+    n = len(query_scores)
+    if n == 0:
+        return []
+    pairwise = vectors @ vectors.T
+    selected = [int(np.argmax(query_scores))]
+    while len(selected) < min(k, n):
+        redundancy = pairwise[:, selected].max(axis=1)
+        marginal = lambda_ * query_scores - (1 - lambda_) * redundancy
+        marginal[selected] = -np.inf
+        selected.append(int(np.argmax(marginal)))
+    return selected
+
+
+class DistractorRetriever:
+    """Ranks distractor patterns by vector similarity to a skill card.
+
+    Candidates come from the pgvector index on distractor patterns (ivfflat or
+    HNSW, optionally quantized and re-ranked; see core.pgvector_indexes), then
+    MMR picks `k` that do not repeat each other. Results are cached per skill
+    card (LRU, `cache_size` entries) and precomputed for every known skill
+    after each ETL commit, so the generation hot path is a dict lookup.
+    """
+
+    def __init__(self, k=DISTRACTOR_K, fetch_k=DISTRACTOR_FETCH_K, probes=IVFFLAT_PROBES, lambda_=MMR_LAMBDA, indexes=vector_index_manager,
+                 cache_size=DISTRACTOR_CACHE_SIZE):
+        self.k = k
+        self.indexes = indexes
+        self.fetch_k = fetch_k
+        self.probes = probes
+        self.lambda_ = lambda_
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def rank(self, db, query_text: str, k=None, fetch_k=None, probes=None, lambda_=None):
+        """Single ANN query + MMR. Returns [{id, content, score}]."""
+        k = k or self.k
+        fetch_k = max(fetch_k or self.fetch_k, k)
+        probes = probes or self.probes
+        lambda_ = self.lambda_ if lambda_ is None else lambda_
+
+        query_vec = embed_text(query_text)
+        self.indexes.search_settings(db, "rag_documents", fetch_k, probes)
+        nearest = self.indexes.nearest_sql("rag_documents", "CAST(:q AS vector)", "id, content", limit=":fetch_k")
+        rows = db.execute(
+            text(f"SELECT id, content, vector_send(embedding) AS embedding, score FROM ({nearest}) nearest"),
+            {"q": to_pgvector(query_vec), "fetch_k": fetch_k, "candidates": self.indexes.candidates("rag_documents", fetch_k)}
+        ).all()
+        if not rows:
+            return []
+
+        vectors = np.vstack([from_pgvector_binary(r.embedding) for r in rows])
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        scores = np.array([r.score for r in rows], dtype=np.float32)
+        return [
+            {"id": str(rows[i].id), "content": rows[i].content, "score": round(float(scores[i]), 4)}
+            for i in mmr(scores, vectors, k, lambda_)
+        ]
+
+    def rank_many(self, db, card_ids, k=None, fetch_k=None, probes=None, lambda_=None):
+        """rank() for many skill cards in one query, using their stored embeddings.
+
+        A LATERAL join runs the ANN lookup per card inside a single statement.
+        Returns {card_id: [{id, content, score}]}; cards without an embedding are left out.
+        """
+        if not card_ids:
+            return {}
+        k = k or self.k
+        fetch_k = max(fetch_k or self.fetch_k, k)
+        probes = probes or self.probes
+        lambda_ = self.lambda_ if lambda_ is None else lambda_
+
+        self.indexes.search_settings(db, "rag_documents", fetch_k, probes)
+        nearest = self.indexes.nearest_sql("rag_documents", "c.embedding", "id, content", limit=":fetch_k")
+        rows = db.execute(text(f"""
+            SELECT c.id AS card_id, d.id, d.content, vector_send(d.embedding) AS embedding, d.score
+            FROM rag_documents c
+            CROSS JOIN LATERAL ({nearest}) d
+            WHERE c.id = ANY(CAST(:ids AS uuid[])) AND c.embedding IS NOT NULL
+            ORDER BY c.id, d.score DESC
+        """), {"ids": [str(i) for i in card_ids], "fetch_k": fetch_k,
+               "candidates": self.indexes.candidates("rag_documents", fetch_k)}).all()
+
+        by_card = {}
+        for row in rows:
+            by_card.setdefault(str(row.card_id), []).append(row)
+        ranked = {}
+        for card_id, candidates in by_card.items():
+            vectors = np.vstack([from_pgvector_binary(r.embedding) for r in candidates])
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            scores = np.array([r.score for r in candidates], dtype=np.float32)
+            ranked[card_id] = [
+                {"id": str(candidates[i].id), "content": candidates[i].content, "score": round(float(scores[i]), 4)}
+                for i in mmr(scores, vectors, k, lambda_)
+            ]
+        return ranked
+
+    def get_many(self, db, cards):
+        """get() for many skill cards ({"id", "content"}); cache misses share one rank_many query."""
+        result, missing = {}, []
+        for card in cards:
+            cached = self._lookup(card["id"])
+            if cached is not None:
+                self.hits += 1
+                result[card["id"]] = cached
+            else:
+                missing.append(card)
+        if missing:
+            self.misses += len(missing)
+            fresh = self.rank_many(db, [card["id"] for card in missing])
+            for card in missing:
+                if card["id"] not in fresh:
+                    fresh[card["id"]] = self.rank(db, card["content"])  # no stored embedding yet
+            with self._lock:
+                for key, ranked in fresh.items():
+                    self._store(key, ranked)
+            result.update(fresh)
+        return result
+
+    def get(self, db, cache_key: str, query_text: str):
+        """Cached ranking for a skill card (cache_key = skill card id or normalized query)."""
+        cached = self._lookup(cache_key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        result = self.rank(db, query_text)
+        with self._lock:
+            self._store(cache_key, result)
+        return result
+
+    def _lookup(self, key):
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+            return cached
+
+    def _store(self, key, ranked):
+        # Caller holds _lock
+        self._cache[key] = ranked
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def precompute(self, session_factory, skill_cards):
+        """Computes and caches the top-k for every skill card; replaces the cache.
+
+        Cards are ranked PRECOMPUTE_BATCH at a time with rank_many (stored
+        embeddings, one query per batch); only cards without a stored
+        embedding are embedded and ranked one by one.
+        """
+        skill_cards = list(skill_cards)
+        if len(skill_cards) > self.cache_size:
+            logger.warning(f"{len(skill_cards)} skill cards exceed DISTRACTOR_CACHE_SIZE={self.cache_size}; the rest are ranked on demand.")
+            skill_cards = skill_cards[-self.cache_size:]
+        fresh = OrderedDict()
+        db = session_factory()
+        try:
+            for start in range(0, len(skill_cards), PRECOMPUTE_BATCH):
+                batch = skill_cards[start:start + PRECOMPUTE_BATCH]
+                ranked = self.rank_many(db, [card["id"] for card in batch])
+                for card in batch:
+                    fresh[card["id"]] = ranked[card["id"]] if card["id"] in ranked else self.rank(db, card["content"])
+            db.rollback()  # only SET LOCAL / SELECTs ran
+        finally:
+            db.close()
+        with self._lock:
+            self._cache = fresh
+        logger.info(f"Precomputed distractors for {len(fresh)} skill cards.")
+
+    def on_etl_commit(self, session_factory, skill_index):
+        """events.ETL_COMMITTED listener (subscribe after the skill index's own listener)."""
+        def _listener(documents_changed=True, **_):
+            if not documents_changed:
+                return
+            with self._lock:
+                self._cache = OrderedDict()
+            threading.Thread(target=self.safe_precompute, args=(session_factory, skill_index), daemon=True).start()
+        return _listener
+
+    def safe_precompute(self, session_factory, skill_index):
+        try:
+            self.precompute(session_factory, skill_index.entries)
+        except Exception as e:
+            logger.error(f"Distractor precompute failed: {e}")
+
+    def stats(self):
+        return {
+            "cached_skills": len(self._cache),
+            "cache_size": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "k": self.k,
+            "fetch_k": self.fetch_k,
+            "probes": self.probes or "auto",
+            "index": self.indexes.plan("rag_documents"),
+            "mmr_lambda": self.lambda_,
+        }
+
+
+distractor_retriever = DistractorRetriever()
@@ -0,0 +1,186 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from core.hashing import content_hash
+
+logger = logging.getLogger("Embeddings")
+
+# Must match the VECTOR(...) columns in database/init.sql
+EMBEDDING_DIM = 1536
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "hashing")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "20000"))
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _strip_accents(text_content: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text_content)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+class HashingEmbedder:
+    """Offline, deterministic embedder based on signed feature hashing.
+
+    Word unigrams and bigrams are hashed (blake2b, not Python's salted hash())
+    into `dim` buckets with a +/-1 sign, weighted with sublinear tf and
+    L2-normalised. Cosine similarity then approximates lexical overlap, which is
+    good enough for retrieval over skill cards and for near-copy screening.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = EMBEDDING_DIM, ngram_range=(1, 2)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self._token_cache = {}
+
+    def _tokens(self, text_content: str):
+        words = _TOKEN_RE.findall(_strip_accents(str(text_content).lower()))
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(words) - n + 1):
+                yield " ".join(words[i:i + n])
+
+    def _bucket(self, token: str):
+        cached = self._token_cache.get(token)
+        if cached is None:
+            digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            cached = (digest % self.dim, 1.0 if (digest >> 63) & 1 else -1.0)
+            if len(self._token_cache) < 500000:
+                self._token_cache[token] = cached
+        return cached
+
+    def embed(self, texts):
+        """Embeds a list of texts in one vectorized pass. Returns (n, dim) float32."""
+        rows, cols, values = [], [], []
+        for row, text_content in enumerate(texts):
+            counts = {}
+            for token in self._tokens(text_content):
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                bucket, sign = self._bucket(token)
+                rows.append(row)
+                cols.append(bucket)
+                values.append(sign * (1.0 + np.log(tf)))
+
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if rows:
+            np.add.at(matrix, (np.asarray(rows), np.asarray(cols)), np.asarray(values, dtype=np.float32))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+# Registry of available backends. Add new ones with register_backend().
+_BACKENDS = {
+    "hashing": HashingEmbedder,
+}
+
+
+def register_backend(name: str, factory):
+    _BACKENDS[name] = factory
+
+
+class CachedEmbedder:
+    """Wraps a backend with an LRU cache keyed by content hash."""
+
+    def __init__(self, backend, max_size: int = EMBEDDING_CACHE_SIZE):
+        self.backend = backend
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_texts(self, texts):
+        texts = ["" if t is None else str(t) for t in texts]
+        keys = [content_hash(t) for t in texts]
+        result = np.empty((len(texts), self.backend.dim), dtype=np.float32)
+
+        missing = {}  # hash -> first text with that hash
+        with self._lock:
+            for i, key in enumerate(keys):
+                vec = self._cache.get(key)
+                if vec is not None:
+                    self._cache.move_to_end(key)
+                    result[i] = vec
+                    self.hits += 1
+                elif key not in missing:
+                    missing[key] = texts[i]
+                    self.misses += 1
+                else:
+                    self.hits += 1
+
+        if missing:
+            new_vectors = self.backend.embed(list(missing.values()))
+            computed = dict(zip(missing.keys(), new_vectors))
+            with self._lock:
+                for key, vec in computed.items():
+                    self._cache[key] = vec
+                while len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+            for i, key in enumerate(keys):
+                if key in computed:
+                    result[i] = computed[key]
+        return result
+
+    def stats(self):
+        return {
+            "backend": getattr(self.backend, "name", type(self.backend).__name__),
+            "cache_size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder() -> CachedEmbedder:
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                if EMBEDDING_BACKEND not in _BACKENDS:
+                    raise ValueError(f"Unknown EMBEDDING_BACKEND '{EMBEDDING_BACKEND}'")
+                _embedder = CachedEmbedder(_BACKENDS[EMBEDDING_BACKEND]())
+                logger.info(f"Embedding backend: {EMBEDDING_BACKEND} (dim={EMBEDDING_DIM})")
+    return _embedder
+
+
+def embed_texts(texts) -> np.ndarray:
+    """Batch embedding, (n, dim) float32. Repeated texts are served from cache."""
+    return get_embedder().embed_texts(list(texts))
+
+
+def embed_text(text_content: str) -> np.ndarray:
+    return embed_texts([text_content])[0]
+
+
+def to_pgvector(vec) -> str:
+    """Formats a vector as a pgvector text literal ('[x,y,...]')."""
+    return "[" + ",".join(f"{x:.6g}" for x in vec) + "]"
+
+
+def from_pgvector(value) -> np.ndarray:
+    """Parses a pgvector text value ('[x,y,...]') into a float32 array."""
+    return np.array(value.strip("[]").split(","), dtype=np.float32)
+
+
+def from_pgvector_binary(value) -> np.ndarray:
+    """Decodes vector_send(embedding) (int16 dim, int16 unused, big-endian float32s).
+
+    Selecting vector_send(embedding) instead of embedding::text moves ~6 KB per
+    1536-dim vector instead of ~15 KB of text, and skips float parsing.
+    """
+    buf = bytes(value)
+    dim = int.from_bytes(buf[:2], "big")
+    return np.frombuffer(buf, dtype=">f4", count=dim, offset=4).astype(np.float32)
@@ -0,0 +1,132 @@
+import json
+import uuid
+import select
+import logging
+import threading
+from collections import defaultdict
+
+from sqlalchemy import text
+
+logger = logging.getLogger("Events")
+
+# Minimal in-process pub/sub so the ETL can tell in-memory caches and indexes
+# that new data was committed, without importing them.
+ETL_COMMITTED = "etl.committed"
+# A pgvector index was rebuilt: query SQL must follow its method/quantization
+VECTOR_INDEX_REBUILT = "vector_index.rebuilt"
+
+# Other processes (uvicorn workers, the ETL CLI) hear about commits through
+# Postgres NOTIFY on this channel; payloads carry only small flags, never data
+CHANNEL = "app_events"
+NOTIFY_SQL = text("SELECT pg_notify(:channel, :payload)")
+# Seconds between reconnect attempts of the LISTEN connection
+RECONNECT_SECONDS = 5.0
+
+# Tells this process's own notifications apart from everyone else's
+_PROCESS_ID = uuid.uuid4().hex
+
+_listeners = defaultdict(list)
+
+
+def subscribe(event: str, callback):
+    if callback not in _listeners[event]:
+        _listeners[event].append(callback)
+
+
+def publish(event: str, **payload):
+    for callback in list(_listeners[event]):
+        try:
+            callback(**payload)
+        except Exception as e:
+            # A broken listener must never fail the ETL run that published
+            logger.error(f"Listener {callback} for '{event}' failed: {e}")
+
+
+def notify_params(event: str, **flags) -> dict:
+    """Bind parameters for NOTIFY_SQL; flags must be JSON-serializable (payload limit 8000 bytes)."""
+    return {"channel": CHANNEL, "payload": json.dumps({"event": event, "origin": _PROCESS_ID, "flags": flags})}
+
+
+def notify(db, event: str, **flags):
+    """Queues `event` for the other processes; Postgres delivers it when `db`'s transaction commits."""
+    db.execute(NOTIFY_SQL, notify_params(event, **flags))
+
+
+class RemoteEvents:
+    """LISTENs on CHANNEL and re-publishes other processes' events locally with remote=True.
+
+    Notifications sent while the connection was down are lost, so after a
+    reconnect every event in `catch_up` is published once with all its flags
+    set, and listeners re-read whatever they cache from the database.
+    """
+
+    def __init__(self, catch_up=None):
+        self.catch_up = catch_up or {}
+        self.received = 0
+        self.reconnects = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, engine):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(engine,), name="remote-events", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _run(self, engine):
+        connected_before = False
+        while not self._stop.is_set():
+            raw = None
+            try:
+                raw = engine.raw_connection()
+                raw.detach()  # held for the life of the process; not a pool slot
+                conn = raw.driver_connection
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANNEL}")
+                if connected_before:
+                    self.reconnects += 1
+                    for event, flags in self.catch_up.items():
+                        publish(event, remote=True, **flags)
+                connected_before = True
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            self._dispatch(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logger.error(f"Event listener connection failed: {e}")
+                self._stop.wait(RECONNECT_SECONDS)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+
+    def _dispatch(self, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning(f"Ignoring malformed notification: {payload[:200]}")
+            return
+        if message.get("origin") == _PROCESS_ID:
+            return  # already published in-process, with the full payload
+        self.received += 1
+        publish(message["event"], remote=True, **message.get("flags", {}))
+
+    def stats(self):
+        return {"running": self._thread is not None, "received": self.received, "reconnects": self.reconnects}
+
+
+remote_events = RemoteEvents(catch_up={
+    ETL_COMMITTED: {"documents_changed": True, "similarity_changed": True},
+    VECTOR_INDEX_REBUILT: {},
+})
@@ -0,0 +1,308 @@
+import os
+import json
+import uuid
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+from sqlalchemy import text
+
+from core import jobs
+from core.database import engine
+from core.hashing import minhash_signature, lsh_bands, estimated_jaccard
+from core.item_validator import issue, has_errors
+from core.llm_scheduler import PRIORITY_BATCH
+from core.write_behind import write_behind
+
+logger = logging.getLogger("FormAssembly")
+
+# Parallel slot generations per form (the LLM scheduler still enforces the provider budget)
+FORM_MAX_CONCURRENCY = int(os.getenv("FORM_MAX_CONCURRENCY", "16"))
+# Generations tried per slot before it is left empty (invalid item, near-duplicate, LLM failure)
+FORM_MAX_ATTEMPTS = int(os.getenv("FORM_MAX_ATTEMPTS", "3"))
+# Estimated Jaccard (MinHash over stimulus, stem and options) at which two items of a form count as the same item
+FORM_DUPLICATE_JACCARD = float(os.getenv("FORM_DUPLICATE_JACCARD", "0.6"))
+MAX_FORM_SLOTS = 1000
+
+# Session-level advisory lock per form: one assembler at a time across every worker
+LOCK_SQL = text("SELECT pg_try_advisory_lock(hashtext(:k))")
+UNLOCK_SQL = text("SELECT pg_advisory_unlock(hashtext(:k))")
+# Held by anyone? (pg_locks splits the bigint key into classid/objid; hashtext() is sign-extended)
+LOCKED_SQL = text("""
+    SELECT EXISTS (
+        SELECT 1 FROM pg_locks
+        WHERE locktype = 'advisory' AND objsubid = 1 AND granted
+          AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+          AND ((classid::bigint << 32) | objid::bigint) = hashtext(:k)::bigint
+    )
+""")
+
+
+def _lock_key(form_id):
+    return f"form_assembly:{form_id}"
+
+
+def expand_blueprint(blueprint: dict) -> list:
+    """Blueprint sections -> one slot per item, in a stable order (resume relies on it)."""
+    slots = []
+    for section in blueprint.get("sections", []):
+        for _ in range(int(section["count"])):
+            slots.append({
+                "slot": len(slots),
+                "skill": section["skill"],
+                "difficulty": section["difficulty"],
+                "topic": section.get("topic"),
+            })
+    return slots
+
+
+def item_text(item: dict) -> str:
+    options = item.get("options") if isinstance(item.get("options"), dict) else {}
+    parts = [item.get("stimulus"), item.get("question_stem")] + [options.get(key) for key in sorted(options)]
+    return "\n".join(str(p) for p in parts if p)
+
+
+class DuplicateScreen:
+    """Near-duplicate check within one form: MinHash signatures bucketed by LSH band.
+
+    check() is the `screen` hook of GenerationService._persist: it runs after
+    validation, so an item that passes it is the one that takes the slot.
+    """
+
+    def __init__(self, threshold=FORM_DUPLICATE_JACCARD):
+        self.threshold = threshold
+        self._signatures = {}
+        self._bands = defaultdict(set)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def add(self, slot, item):
+        signature = minhash_signature(item_text(item))
+        with self._lock:
+            self._add(slot, signature)
+
+    def _add(self, slot, signature):
+        self._signatures[slot] = signature
+        for band in lsh_bands(signature):
+            self._bands[band].add(slot)
+
+    def check(self, slot, item):
+        signature = minhash_signature(item_text(item))
+        with self._lock:
+            candidates = set()
+            for band in lsh_bands(signature):
+                candidates |= self._bands.get(band, set())
+            for other in sorted(candidates - {slot}):
+                similarity = estimated_jaccard(signature, self._signatures[other])
+                if similarity >= self.threshold:
+                    self.rejected += 1
+                    return [issue("near_duplicate", f"near-duplicate of slot {other} (jaccard {similarity:.2f})")]
+            self._add(slot, signature)
+        return []
+
+
+class FormAssembler:
+    """Builds an exam form from a blueprint (item counts per skill and difficulty).
+
+    Contexts for every (skill, topic) in the form are fetched up front with
+    set-based queries, then slots are generated in parallel through the LLM
+    scheduler. Each accepted item is banked in items_bank with form_id and its
+    form_slot; invalid items and near-duplicates of items already in the form
+    are banked as 'rejected' and the slot is retried. Filled slots are read
+    back from items_bank, so a crashed or incomplete run resumes with only the
+    missing slots. A Postgres advisory lock per form keeps two workers from
+    assembling the same form at once.
+    """
+
+    def create(self, session_factory, blueprint: dict) -> dict:
+        slots = expand_blueprint(blueprint)
+        if not slots:
+            raise ValueError("Blueprint has no items")
+        if len(slots) > MAX_FORM_SLOTS:
+            raise ValueError(f"Blueprint has {len(slots)} items (max {MAX_FORM_SLOTS})")
+        with session_factory() as db:
+            form_id = db.execute(text("""
+                INSERT INTO forms (name, exam, blueprint, n_slots, status)
+                VALUES (:name, :exam, CAST(:blueprint AS jsonb), :n_slots, 'assembling')
+                RETURNING id
+            """), {"name": blueprint.get("name"), "exam": blueprint["exam"],
+                   "blueprint": json.dumps(blueprint, ensure_ascii=False), "n_slots": len(slots)}).scalar()
+            db.commit()
+        return {"id": str(form_id), "n_slots": len(slots)}
+
+    def running(self, form_id, bind=engine) -> bool:
+        """Whether some process (this one or another worker) is assembling the form."""
+        with bind.connect() as conn:
+            return bool(conn.execute(LOCKED_SQL, {"k": _lock_key(form_id)}).scalar())
+
+    def assemble(self, session_factory, form_id, job_id=None, bind=engine):
+        """Fills every empty slot of the form; safe to call again to resume."""
+        form_id = str(form_id)
+        # The lock lives as long as this connection: a crashed worker never leaves the form locked
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+            if not lock_conn.execute(LOCK_SQL, {"k": _lock_key(form_id)}).scalar():
+                raise RuntimeError(f"Form {form_id} is already being assembled")
+            try:
+                return self._assemble(session_factory, form_id, job_id)
+            finally:
+                lock_conn.execute(UNLOCK_SQL, {"k": _lock_key(form_id)})
+
+    def _assemble(self, session_factory, form_id, job_id):
+        from core.generation_service import GenerationService
+
+        try:
+            # Items of an earlier run in this process may still be in the write-behind queue
+            write_behind.flush()
+            with session_factory() as db:
+                form = db.execute(text("SELECT exam, blueprint FROM forms WHERE id = :id"), {"id": form_id}).first()
+                if form is None:
+                    raise ValueError(f"Form {form_id} not found")
+                slots = expand_blueprint(form.blueprint)
+                filled = db.execute(text("""
+                    SELECT DISTINCT ON (form_slot) form_slot, question_content FROM items_bank
+                    WHERE form_id = :id AND form_slot IS NOT NULL
+                    ORDER BY form_slot, created_at
+                """), {"id": form_id}).all()
+                db.execute(text("UPDATE forms SET status = 'assembling', finished_at = NULL WHERE id = :id"), {"id": form_id})
+                db.commit()
+
+                screen = DuplicateScreen()
+                for row in filled:
+                    screen.add(row.form_slot, row.question_content)
+                done = {row.form_slot for row in filled}
+                pending = [slot for slot in slots if slot["slot"] not in done]
+                if job_id:
+                    jobs.report_progress(job_id, rows=len(done))
+                logger.info(f"Assembling form {form_id}: {len(pending)} of {len(slots)} slots to fill.")
+
+                service = GenerationService(db)
+                contexts = service.retrieve_contexts(form.exam, [(s["skill"], s["topic"]) for s in pending]) if pending else {}
+                db.rollback()  # only SET LOCAL / SELECTs ran; give the connection back
+                summary = self._fill(service, form_id, form.exam, pending, contexts, screen, job_id)
+
+            # Rows must be in items_bank before the form is reported done
+            if not write_behind.flush():
+                logger.warning(f"Form {form_id}: write-behind flush timed out; counting only the slots already written.")
+            # A slot counts once its row is written, not when its item passed the screen
+            with session_factory() as db:
+                written = set(db.execute(text("""
+                    SELECT DISTINCT form_slot FROM items_bank WHERE form_id = :id AND form_slot IS NOT NULL
+                """), {"id": form_id}).scalars())
+            summary.pop("filled_now")
+            summary.update(n_slots=len(slots), filled=len(written), resumed_from=len(done),
+                           empty_slots=[slot["slot"] for slot in slots if slot["slot"] not in written])
+            status = "complete" if summary["filled"] == len(slots) else "incomplete"
+            self._finish(session_factory, form_id, status, summary)
+            return {"form_id": form_id, "status": status, **summary}
+        except Exception:
+            self._finish(session_factory, form_id, "failed", None)
+            raise
+
+    def _fill(self, service, form_id, exam, pending, contexts, screen, job_id):
+        counts = {"filled_now": 0, "attempts": 0, "invalid": 0, "failed_calls": 0, "empty_slots": []}
+        counts_lock = threading.Lock()
+
+        form_uuid = uuid.UUID(form_id)
+
+        def fill(slot):
+            reasons = []
+            for _ in range(FORM_MAX_ATTEMPTS):
+                # served=True stamps served_at, which keeps form items out of the generation pool
+                item = service.generate_item(
+                    exam, slot["skill"], slot["difficulty"], context=contexts[(slot["skill"], slot["topic"])],
+                    served=True, priority=PRIORITY_BATCH, topic=slot["topic"],
+                    form={"id": form_uuid, "slot": slot["slot"], "screen": partial(screen.check, slot["slot"])}
+                )
+                issues = item.get("validation_issues")
+                with counts_lock:
+                    counts["attempts"] += 1
+                    if issues is None:
+                        counts["failed_calls"] += 1
+                    elif has_errors(issues):
+                        counts["invalid"] += 1
+                if issues is not None and not has_errors(issues):
+                    return True, []
+                reasons.append(item.get("error") or ", ".join(i["code"] for i in (issues or []) if i["severity"] == "error") or "unparsed")
+            return False, reasons
+
+        if not pending:
+            return counts
+        with ThreadPoolExecutor(max_workers=max(1, min(FORM_MAX_CONCURRENCY, len(pending)))) as pool:
+            futures = {pool.submit(fill, slot): slot for slot in pending}
+            for future in as_completed(futures):
+                slot = futures[future]
+                try:
+                    ok, reasons = future.result()
+                except Exception as e:
+                    logger.error(f"Form {form_id} slot {slot['slot']} failed: {e}")
+                    ok, reasons = False, [str(e)]
+                if ok:
+                    counts["filled_now"] += 1
+                    if job_id:
+                        jobs.report_progress(job_id, rows=1)
+                else:
+                    counts["empty_slots"].append(slot["slot"])
+                    if job_id:
+                        jobs.add_error(job_id, "slot left empty", slot=slot["slot"], skill=slot["skill"], reasons=reasons)
+        counts["empty_slots"].sort()
+        counts["near_duplicates"] = screen.rejected
+        return counts
+
+    def _finish(self, session_factory, form_id, status, summary):
+        try:
+            with session_factory() as db:
+                db.execute(text("""
+                    UPDATE forms SET status = :status, summary = COALESCE(CAST(:summary AS jsonb), summary), finished_at = NOW()
+                    WHERE id = :id
+                """), {"id": form_id, "status": status, "summary": json.dumps(summary) if summary is not None else None})
+                db.commit()
+        except Exception as e:
+            logger.error(f"Could not record status of form {form_id}: {e}")
+
+    def get(self, session_factory, form_id):
+        """Form row plus its accepted items in slot order, or None."""
+        with session_factory() as db:
+            form = db.execute(text("""
+                SELECT id, name, exam, blueprint, n_slots, status, summary, created_at, finished_at
+                FROM forms WHERE id = :id
+            """), {"id": str(form_id)}).first()
+            if form is None:
+                return None
+            items = db.execute(text("""
+                SELECT DISTINCT ON (form_slot) form_slot, id, skill, difficulty, status, validation_issues, question_content
+                FROM items_bank
+                WHERE form_id = :id AND form_slot IS NOT NULL
+                ORDER BY form_slot, created_at
+            """), {"id": str(form_id)}).all()
+        return {
+            **self._form_row(form),
+            "assembling": self.running(form.id),
+            "items": [{"slot": r.form_slot, "item_id": str(r.id), "skill": r.skill, "difficulty": r.difficulty,
+                       "status": r.status, "validation_issues": r.validation_issues, "item": r.question_content} for r in items],
+        }
+
+    def list_forms(self, session_factory, limit=50):
+        with session_factory() as db:
+            rows = db.execute(text("""
+                SELECT id, name, exam, blueprint, n_slots, status, summary, created_at, finished_at
+                FROM forms ORDER BY created_at DESC LIMIT :n
+            """), {"n": limit}).all()
+        return [{k: v for k, v in self._form_row(r).items() if k != "blueprint"} for r in rows]
+
+    def _form_row(self, row):
+        return {
+            "id": str(row.id),
+            "name": row.name,
+            "exam": row.exam,
+            "blueprint": row.blueprint,
+            "n_slots": row.n_slots,
+            "status": row.status,
+            "summary": row.summary,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "finished_at": row.finished_at.isoformat() if row.finished_at else None,
+        }
+
+
+form_assembler = FormAssembler()
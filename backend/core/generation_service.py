@@ -1,25 +1,88 @@
 import os
-import openai
+import threading
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from core.models import RagDocument
+from core.embeddings import embed_text
+from core.skill_index import skill_index, normalize_skill
+from core.distractor_retrieval import distractor_retriever
+from core.write_behind import write_behind
+from core.json_stream import IncrementalJSONParser
+from core import metrics
+from core.context_packer import context_packer, count_tokens
+from core.llm_scheduler import llm_scheduler, PRIORITY_INTERACTIVE, PRIORITY_BATCH, PRIORITY_BACKGROUND
+from core.item_validator import validate_item, has_errors, issue
 import json
+import time
+import textwrap
+import uuid
 import logging
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 logger = logging.getLogger("GenerationService")
 
-# Configure OpenAI / Groq Client
-from openai import OpenAI
-
 # We use OpenAI client but pointing to Groq
-client = OpenAI(
-    api_key=os.getenv("GROQ_API_KEY"),
-    base_url="https://api.groq.com/openai/v1"
-)
-# Note: Groq mainly does chat/generation. 
-# For embeddings, we might still need OpenAI or a local model.
-# Current code attempts 'client.embeddings.create' which might fail if using Groq base URL unless they proxy it or have a model.
-# We will flag embedding generation to check for separate key or fallback.
+# LLM_BASE_URL can point at any OpenAI-compatible server (e.g. benchmarks/fake_llm.py)
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.groq.com/openai/v1")
+LLM_API_KEY = os.getenv("GROQ_API_KEY")
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """OpenAI client for Groq, built on first use: the SDK takes ~0.6 s to import."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+
+                # Retries are owned by core/llm_scheduler.py (budget-aware), not the client
+                _client = OpenAI(api_key=LLM_API_KEY, base_url=LLM_BASE_URL, max_retries=0)
+    return _client
+
+LLM_MODEL = "llama-3.3-70b-versatile"
+LLM_TEMPERATURE = 0.7
+
+# Upper bound of parallel LLM calls per batch request
+GENERATION_MAX_CONCURRENCY = int(os.getenv("GENERATION_MAX_CONCURRENCY", "8"))
+
+# Prompt templates, dedented and compiled once at import; only the context is filled per request
+SYSTEM_PROMPT = "You are an expert assessment specialist for the ICFES exam (Colombia). Your goal is to create high-quality, valid multiple-choice questions that measure specific competencies."
+USER_PROMPT_TEMPLATE = textwrap.dedent("""\
+    TASK: Generate a multiple-choice question (4 options: A, B, C, D) for the '{exam}' exam.
+
+    COMPETENCY/SKILL TARGET:
+    {skill_card}
+
+    DIFFICULTY: {difficulty}
+
+    GUIDELINES FOR DISTRACTORS:
+    Use the following patterns to create plausible but incorrect answers:
+    {distractors}
+
+    OUTPUT FORMAT (JSON):
+    {{
+        "stimulus": "The context text or situation...",
+        "question_stem": "The specific question...",
+        "options": {{
+            "A": "...",
+            "B": "...",
+            "C": "...",
+            "D": "..."
+        }},
+        "correct_option": "A|B|C|D",
+        "rationale": "Explanation of why the correct answer is correct...",
+        "distractor_rationales": {{
+            "<letter of each wrong option>": "Why it is wrong..."
+        }}
+    }}
+    """)
+
+# Note: Groq mainly does chat/generation.
+# Embeddings are computed locally, see core/embeddings.py (EMBEDDING_BACKEND).
 
 
 class GenerationService:
@@ -27,120 +90,349 @@ class GenerationService:
         self.db = db
 
     def get_embedding(self, text_content: str):
-        """Generates embedding for query text."""
-        # GROQ does not currently support consistent embeddings via this endpoint URL in same way as OpenAI 'text-embedding-ada-002'.
-        # For this MVP with Groq, we will use random mock embeddings unless a separate OPENAI_API_KEY is provided for a separate client.
-        # Returning mock for stability now.
-        import numpy as np
-        return np.random.rand(1536).tolist()
-        
-        # Original logic commented out to prevent Groq client error on embeddings:
+        """Generates embedding for query text (local deterministic backend, cached by content hash)."""
+        return embed_text(text_content).tolist()
+
+    def find_skill_card(self, skill: str):
+        """Best-ranked skill card for `skill` as a dict (id, skill, content, metadata), or None.
+
+        Served from the in-process skill index; falls back to the database
+        (ordered, so the answer is still deterministic) while the index warms up.
         """
-        try:
-            if not client.api_key or "sk-" not in client.api_key:
-                logger.warning("No valid OpenAI API Key found. Returning mock embedding.")
-                import numpy as np
-                return np.random.rand(1536).tolist()
-                
-            response = client.embeddings.create(
-                input=text_content,
-                model="text-embedding-ada-002"
-            )
-            return response.data[0].embedding
-        except Exception as e:
-            logger.error(f"Error generating embedding: {e}")
-            import numpy as np
-            return np.random.rand(1536).tolist()
+        if skill_index.ready:
+            return skill_index.best(skill)
+
+        card = self.db.query(RagDocument.id, RagDocument.skill, RagDocument.content, RagDocument.metadata_).filter(
+            RagDocument.doc_type == "skill_card",
+            RagDocument.skill.ilike(f"%{skill}%")
+        ).order_by(RagDocument.skill, RagDocument.source_file, RagDocument.id).first()
+        return {"id": str(card.id), "skill": card.skill, "content": card.content, "metadata": card.metadata_} if card else None
+
+    def find_skill_cards(self, skills):
+        """find_skill_card for many skills at once: {skill: card or None}.
+
+        One set-based query (unnest + ILIKE, same ordering as find_skill_card)
+        when the in-process index is not ready yet.
+        """
+        skills = list(dict.fromkeys(skills))
+        if skill_index.ready:
+            return {skill: skill_index.best(skill) for skill in skills}
+
+        rows = self.db.execute(text("""
+            SELECT DISTINCT ON (q.skill) q.skill AS query, d.id, d.skill, d.content, d.metadata
+            FROM unnest(CAST(:skills AS text[])) AS q(skill)
+            JOIN rag_documents d ON d.doc_type = 'skill_card' AND d.skill ILIKE '%' || q.skill || '%'
+            ORDER BY q.skill, d.skill, d.source_file, d.id
+        """), {"skills": skills}).all()
+        found = {r.query: {"id": str(r.id), "skill": r.skill, "content": r.content, "metadata": r.metadata} for r in rows}
+        return {skill: found.get(skill) for skill in skills}
+
+    def retrieve_contexts(self, exam: str, requests, budget: int = None):
+        """retrieve_context for many (skill, topic) pairs: {(skill, topic): context}.
+
+        Skill cards and distractor patterns for every pair come from one
+        set-based lookup each instead of one round trip per pair.
         """
+        with metrics.timed("retrieve_contexts"):
+            requests = list(dict.fromkeys(requests))
+            cards = self.find_skill_cards([skill for skill, _ in requests])
+            distractors = distractor_retriever.get_many(self.db, [c for c in cards.values() if c])
+            contexts = {}
+            for skill, topic in requests:
+                card = cards.get(skill)
+                if card:
+                    contexts[(skill, topic)] = self._pack_context(skill, topic, budget, card, card["id"], distractors[card["id"]])
+                else:
+                    cache_key = f"query:{normalize_skill(skill)}"
+                    contexts[(skill, topic)] = self._pack_context(
+                        skill, topic, budget, None, cache_key, distractor_retriever.get(self.db, cache_key, skill)
+                    )
+            return contexts
 
-    def retrieve_context(self, exam: str, skill: str, topic: str = None):
+    def retrieve_context(self, exam: str, skill: str, topic: str = None, budget: int = None):
         """Retrieves relevant skill cards and distractors."""
-        # Simple logical retrieval for now (since we might have random embeddings in DB)
+        with metrics.timed("retrieve_context"):
+            return self._retrieve_context(exam, skill, topic, budget)
+
+    def _retrieve_context(self, exam: str, skill: str, topic: str = None, budget: int = None):
         # 1. Get Skill Card
-        skill_card = self.db.query(RagDocument).filter(
-            RagDocument.doc_type == "skill_card",
-            RagDocument.skill.ilike(f"%{skill}%")
-        ).first()
+        skill_card = self.find_skill_card(skill)
+
+        # 2. Distractor patterns closest to the skill card (pgvector ANN + MMR, cached per skill)
+        if skill_card:
+            cache_key = skill_card["id"]
+            distractors = distractor_retriever.get(self.db, cache_key, skill_card["content"])
+        else:
+            cache_key = f"query:{normalize_skill(skill)}"
+            distractors = distractor_retriever.get(self.db, cache_key, skill)
 
-        # 2. Get some random distractors patterns for variety
-        # In a real scenario, we would use vector search here
-        distractors = self.db.query(RagDocument).filter(
-            RagDocument.doc_type == "distractor_pattern"
-        ).limit(3).all()
+        return self._pack_context(skill, topic, budget, skill_card, cache_key, distractors)
 
+    def _pack_context(self, skill, topic, budget, skill_card, cache_key, distractors):
+        # 3. Deduped, ranked and cut to the token budget (cached per card)
+        if skill_card is None:
+            skill_card = {"skill": skill, "content": f"Skill: {skill}"}
+        packed = context_packer.pack(
+            skill_card, distractors, topic=topic, budget=budget,
+            cache_key=(cache_key, tuple(d["id"] for d in distractors))
+        )
         return {
-            "skill_card": skill_card.content if skill_card else f"Skill {skill} not found.",
-            "distractors": "\n".join([d.content for d in distractors])
+            "skill_card": packed["skill_card"],
+            "distractors": packed["distractors"],
+            "context_tokens": packed["tokens"],
+            "dropped": packed["dropped"],
         }
 
-    def generate_item(self, exam: str, skill: str, difficulty: str):
-        context = self.retrieve_context(exam, skill)
-        
-        system_prompt = "You are an expert assessment specialist for the ICFES exam (Colombia). Your goal is to create high-quality, valid multiple-choice questions that measure specific competencies."
-        
-        user_prompt = f"""
-        TASK: Generate a multiple-choice question (4 options: A, B, C, D) for the '{exam}' exam.
-        
-        COMPETENCY/SKILL TARGET:
-        {context['skill_card']}
-        
-        DIFFICULTY: {difficulty}
+    def build_prompts(self, exam: str, context: dict, difficulty: str):
+        """Builds the (system, user) prompt pair for one item from the precompiled templates."""
+        return SYSTEM_PROMPT, USER_PROMPT_TEMPLATE.format(
+            exam=exam,
+            skill_card=context["skill_card"],
+            difficulty=difficulty,
+            distractors=context["distractors"],
+        )
+
+    def generate_item(self, exam: str, skill: str, difficulty: str, context: dict = None, served: bool = True, priority: int = None, topic: str = None, form: dict = None):
+        """Generates one item and queues it (plus its generation_runs log) for persistence.
+
+        `served=False` banks the item as a ready pool item instead of one already
+        handed to a user. `priority` orders the call in the LLM scheduler queue
+        (defaults: interactive when served, background otherwise). `form`
+        ({"id", "slot", "screen"}) banks the item into a form slot, see
+        core/form_assembly.py.
+        """
+        if priority is None:
+            priority = PRIORITY_INTERACTIVE if served else PRIORITY_BACKGROUND
+        # Context can be passed in so batch runs only hit the DB once
+        if context is None:
+            context = self.retrieve_context(exam, skill, topic)
         
-        GUIDELINES FOR DISTRACTORS:
-        Use the following patterns to create plausible but incorrect answers:
-        {context['distractors']}
+        with metrics.timed("build_prompts"):
+            system_prompt, user_prompt = self.build_prompts(exam, context, difficulty)
+        prompt_tokens = count_tokens(system_prompt) + count_tokens(user_prompt)
+        metrics.prompt_tokens.observe(prompt_tokens)
         
-        OUTPUT FORMAT (JSON):
-        {{
-            "stimulus": "The context text or situation...",
-            "question_stem": "The specific question...",
-            "options": {{
-                "A": "...",
-                "B": "...",
-                "C": "...",
-                "D": "..."
-            }},
-            "correct_option": "A|B|C|D",
-            "rationale": "Explanation of why the correct answer is correct...",
-            "distractor_rationales": {{
-                "wrong_option_1": "Why it is wrong...",
-                "wrong_option_2": "..."
-            }}
-        }}
+        # Full prompts go to generation_runs; keep them out of the INFO log
+        logger.debug(f"--- GENERATION PROMPT ---\nSYSTEM: {system_prompt}\nUSER: {user_prompt}\n-------------------------")
+
+        start = time.perf_counter()
+        try:
+            if not LLM_API_KEY:
+                raise Exception("Missing GROQ_API_KEY")
+
+            with metrics.timed("llm_call"):
+                response = llm_scheduler.chat(
+                    get_client(),
+                    priority=priority,
+                    model=LLM_MODEL, # Groq model
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    temperature=LLM_TEMPERATURE,
+                    response_format={ "type": "json_object" } 
+                )
+            _count_tokens(response.usage)
+            
+            content = response.choices[0].message.content
+            # Try to parse JSON
+            with metrics.timed("parse_json"):
+                try:
+                    result = json.loads(content)
+                    status = "ok"
+                except:
+                    result = {"raw_output": content}
+                    status = "unparsed"
+            error = None
+
+        except Exception as e:
+            logger.error(f"LLM Generation failed: {e}")
+            metrics.errors.inc(component="llm")
+            result = self._fallback(e, system_prompt, user_prompt)
+            status = "fallback"
+            error = str(e)
+
+        duration_ms = (time.perf_counter() - start) * 1000
+        metrics.generations.inc(status=status)
+        self._persist(exam, skill, difficulty, system_prompt, user_prompt, result, status, error, duration_ms, served, prompt_tokens, form)
+        return result
+
+    def _fallback(self, e, system_prompt, user_prompt):
+        return {
+            "error": str(e),
+            "mock_fallback": True,
+            "stimulus": "Error connecting to OpenAI or Key missing.",
+            "question_stem": "Please check your API Key configuration.",
+            "options": {"A": "Check Logs", "B": "Retry", "C": "Config", "D": "Support"},
+            "correct_option": "C",
+            "debug_info": {"system_prompt": system_prompt, "user_prompt": user_prompt}
+        }
+
+    def stream_item(self, exam: str, skill: str, difficulty: str, served: bool = True, topic: str = None):
+        """Generates one item, yielding (event, data) pairs while the LLM writes it.
+
+        Events: "token" (raw LLM text), "field" (a top-level field such as
+        stimulus, or an option such as options.A, as soon as it is complete) and
+        a final "item" with the parsed object plus its validation "issues".
+        Persistence is the same as generate_item.
         """
-        
-        # Log the full prompt for debugging
-        logger.info(f"--- GENERATION PROMPT ---\nSYSTEM: {system_prompt}\nUSER: {user_prompt}\n-------------------------")
+        context = self.retrieve_context(exam, skill, topic)
+        with metrics.timed("build_prompts"):
+            system_prompt, user_prompt = self.build_prompts(exam, context, difficulty)
+        prompt_tokens = count_tokens(system_prompt) + count_tokens(user_prompt)
+        metrics.prompt_tokens.observe(prompt_tokens)
+        logger.debug(f"--- GENERATION PROMPT (stream) ---\nSYSTEM: {system_prompt}\nUSER: {user_prompt}\n-------------------------")
 
+        parser = IncrementalJSONParser()
+        content = []
+        start = time.perf_counter()
         try:
-            if not client.api_key:
+            if not LLM_API_KEY:
                 raise Exception("Missing GROQ_API_KEY")
 
-            response = client.chat.completions.create(
-                model="llama-3.3-70b-versatile", # Groq model
+            # No response_format here: JSON mode does not stream on every provider;
+            # the prompt already demands strict JSON and the parser skips any preamble.
+            with llm_scheduler.chat(
+                get_client(),
+                priority=PRIORITY_INTERACTIVE,
+                model=LLM_MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
                 ],
-                temperature=0.7,
-                response_format={ "type": "json_object" } 
-            )
-            
-            content = response.choices[0].message.content
-            # Try to parse JSON
-            try:
-                return json.loads(content)
-            except:
-                return {"raw_output": content}
+                temperature=LLM_TEMPERATURE,
+                stream=True
+            ) as stream:
+                for chunk in stream:
+                    if getattr(chunk, "usage", None):
+                        _count_tokens(chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if not content:
+                        metrics.stage_seconds.observe(time.perf_counter() - start, stage="llm_first_token")
+                    content.append(delta)
+                    yield "token", {"text": delta}
+                    for path, value in parser.feed(delta):
+                        if path:
+                            yield "field", {"path": ".".join(str(p) for p in path), "value": value}
+
+            if parser.root is not None and isinstance(parser.root, dict):
+                result = parser.root
+                status = "ok"
+            else:
+                result = {"raw_output": "".join(content)}
+                status = "unparsed"
+            error = None
 
         except Exception as e:
-            logger.error(f"LLM Generation failed: {e}")
-            return {
-                "error": str(e),
-                "mock_fallback": True,
-                "stimulus": "Error connecting to OpenAI or Key missing.",
-                "question_stem": "Please check your API Key configuration.",
-                "options": {"A": "Check Logs", "B": "Retry", "C": "Config", "D": "Support"},
-                "correct_option": "C",
-                "debug_info": {"system_prompt": system_prompt, "user_prompt": user_prompt} 
+            logger.error(f"LLM streaming generation failed: {e}")
+            metrics.errors.inc(component="llm")
+            result = self._fallback(e, system_prompt, user_prompt)
+            status = "fallback"
+            error = str(e)
+
+        duration_ms = (time.perf_counter() - start) * 1000
+        metrics.stage_seconds.observe(duration_ms / 1000, stage="llm_stream")
+        metrics.generations.inc(status=status)
+        self._persist(exam, skill, difficulty, system_prompt, user_prompt, result, status, error, duration_ms, served, prompt_tokens)
+        final = {k: v for k, v in result.items() if k not in ("debug_info", "validation_issues")}
+        issues = result["validation_issues"] if status == "ok" else [issue(status, f"generation {status}")]
+        yield "item", {**final, "issues": issues}
+
+    def _persist(self, exam, skill, difficulty, system_prompt, user_prompt, result, status, error, duration_ms, served, prompt_tokens=None, form=None):
+        """Queues the run log, and the item itself when usable (write-behind, no DB wait here).
+
+        Parsed items are validated first; items with errors are banked as
+        'rejected' so the pool never hands them out. For form items,
+        form["screen"](item) can add more issues (e.g. near-duplicates) and
+        only accepted items take the form slot.
+        """
+        result["prompt_tokens"] = prompt_tokens
+        item_row = None
+        if status == "ok":
+            with metrics.timed("validate"):
+                issues = validate_item(result)
+            if form and form.get("screen") and not has_errors(issues):
+                issues += form["screen"](result)
+            item_id = uuid.uuid4()
+            result["item_id"] = str(item_id)
+            item_row = {
+                "id": item_id,
+                "exam": exam,
+                "skill": skill,
+                "difficulty": difficulty,
+                "question_content": {k: v for k, v in result.items() if k not in ("item_id", "prompt_tokens")},
+                "status": "rejected" if has_errors(issues) else "draft",
+                "validation_issues": issues,
+                "served_at": datetime.now(timezone.utc) if served else None,
+                # Same keys on every row: write-behind inserts them as one executemany
+                "form_id": form["id"] if form else None,
+                "form_slot": form["slot"] if form and not has_errors(issues) else None,
             }
+            result["validation_issues"] = issues
+            for found in issues:
+                metrics.validation_issues.inc(code=found["code"], severity=found["severity"])
+        write_behind.enqueue({
+            "id": uuid.uuid4(),
+            "item_id": item_row["id"] if item_row else None,
+            "prompt_used": f"SYSTEM: {system_prompt}\nUSER: {user_prompt}",
+            "parameters": {"model": LLM_MODEL, "temperature": LLM_TEMPERATURE, "exam": exam, "skill": skill, "difficulty": difficulty,
+                           "prompt_tokens": prompt_tokens},
+            "exam": exam,
+            "skill": skill,
+            "difficulty": difficulty,
+            "output": {k: v for k, v in result.items() if k != "debug_info"},
+            "status": status,
+            "error": error,
+            "duration_ms": round(duration_ms, 2),
+        }, item_row)
+
+    def generate_items(self, exam: str, skill: str, difficulty: str, n_items: int = 1, max_concurrency: int = None, served: bool = True, topic: str = None):
+        """Generates n_items concurrently, sharing a single context lookup.
+
+        The LLM client is blocking, so each item runs in its own worker thread;
+        total latency is roughly the slowest call instead of the sum of all calls.
+        """
+        if max_concurrency is None:
+            max_concurrency = GENERATION_MAX_CONCURRENCY
+        max_concurrency = max(1, min(max_concurrency, n_items))
+
+        # Retrieve once, reuse for every item (the session is not thread safe anyway)
+        context = self.retrieve_context(exam, skill, topic)
+
+        items = [None] * n_items
+        errors = []
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            futures = {
+                pool.submit(self.generate_item, exam, skill, difficulty, context, served,
+                            PRIORITY_BATCH if served else PRIORITY_BACKGROUND): i
+                for i in range(n_items)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    item = future.result()
+                except Exception as e:
+                    logger.error(f"Batch item {index} failed: {e}")
+                    item = {"error": str(e)}
+                items[index] = item
+                if item.get("error") or item.get("mock_fallback"):
+                    errors.append({"index": index, "error": item.get("error", "unknown error")})
+
+        return {
+            "n_items": n_items,
+            "n_succeeded": n_items - len(errors),
+            "items": items,
+            "errors": sorted(errors, key=lambda e: e["index"]),
+        }
+
+
+def _count_tokens(usage):
+    if usage is None:
+        return
+    metrics.llm_tokens.inc(getattr(usage, "prompt_tokens", 0) or 0, kind="prompt")
+    metrics.llm_tokens.inc(getattr(usage, "completion_tokens", 0) or 0, kind="completion")
+
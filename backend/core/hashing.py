@@ -0,0 +1,77 @@
+import hashlib
+import re
+import unicodedata
+
+import numpy as np
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text_content: str) -> str:
+    """Canonical form used for hashing: NFC, trimmed, collapsed whitespace."""
+    if text_content is None:
+        return ""
+    text_content = unicodedata.normalize("NFC", str(text_content))
+    return _WS_RE.sub(" ", text_content).strip()
+
+
+def content_hash(text_content: str) -> str:
+    """Stable SHA-256 hex digest of the normalized text.
+
+    Unlike Python's built-in hash() this is identical across processes and runs,
+    so it can be stored in the DB and used as a cache key.
+    """
+    return hashlib.sha256(normalize_text(text_content).encode("utf-8")).hexdigest()
+
+
+# --- MinHash / LSH for near-duplicate detection ---
+# Signatures are computed at ingest time and stored next to the document, so
+# near-duplicate lookups only touch the (small, indexed) band hashes.
+MINHASH_NUM_PERM = 128
+LSH_BANDS = 32  # 32 bands x 4 rows: pairs above ~0.5 Jaccard almost always collide
+SHINGLE_SIZE = 5
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 32, size=MINHASH_NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=MINHASH_NUM_PERM, dtype=np.uint64)
+
+
+def shingles(text_content: str, size: int = SHINGLE_SIZE):
+    """Character shingles over the lowercased, whitespace-collapsed text."""
+    normalized = normalize_text(text_content).lower()
+    if len(normalized) <= size:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+def minhash_signature(text_content: str) -> np.ndarray:
+    """MinHash signature (MINHASH_NUM_PERM uint32 values stored as uint64)."""
+    tokens = shingles(text_content)
+    if not tokens:
+        return np.full(MINHASH_NUM_PERM, _MAX_HASH, dtype=np.uint64)
+    hashed = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=4).digest(), "little") for t in tokens),
+        dtype=np.uint64,
+        count=len(tokens)
+    )
+    permuted = (np.outer(_PERM_A, hashed) + _PERM_B[:, None]) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=1)
+
+
+def lsh_bands(signature) -> list:
+    """Band keys ('<band>:<hash>'); two documents sharing any key are near-duplicate candidates."""
+    signature = np.asarray(signature, dtype=np.uint64)
+    rows = len(signature) // LSH_BANDS
+    keys = []
+    for band in range(LSH_BANDS):
+        chunk = signature[band * rows:(band + 1) * rows].tobytes()
+        keys.append(f"{band}:{hashlib.blake2b(chunk, digest_size=8).hexdigest()}")
+    return keys
+
+
+def estimated_jaccard(sig_a, sig_b) -> float:
+    sig_a = np.asarray(sig_a, dtype=np.uint64)
+    sig_b = np.asarray(sig_b, dtype=np.uint64)
+    return float(np.mean(sig_a == sig_b))
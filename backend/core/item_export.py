@@ -0,0 +1,331 @@
+"""Streaming export of items_bank to JSONL or Parquet.
+
+    python -m core.item_export items.parquet --status draft --exam "Sociales y Ciudadanas"
+    python -m core.item_export nightly.jsonl --since nightly-assembly   # only rows new since the last run
+
+Rows are read through a server-side cursor in EXPORT_BATCH_SIZE chunks and
+written out chunk by chunk (one Parquet row group per chunk), so memory does
+not grow with the size of the bank. The same generator backs GET /items/export.
+
+Incremental exports (`since`) keep a (created_at, id) watermark per consumer
+name, together with the filters it was created with. A name can only be used
+again with the same filters, and not with `status`: status changes after a row
+is created, and a row filtered out once would never be exported later.
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+from datetime import datetime
+
+from sqlalchemy import select, text, tuple_
+
+from core.database import SessionLocal
+from core.models import ItemsBank
+
+logger = logging.getLogger("ItemExport")
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# Incremental exports stop this many seconds before NOW(): write-behind rows are
+# committed a little after their created_at, and must not land behind the watermark
+EXPORT_SETTLE_SECONDS = float(os.getenv("EXPORT_SETTLE_SECONDS", "60"))
+FORMATS = ("jsonl", "parquet")
+MEDIA_TYPES = {"jsonl": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+OPTION_KEYS = ("A", "B", "C", "D")
+# Filters whose value can change after a row is created; they cannot be used with `since`
+MUTABLE_FILTERS = ("status",)
+
+# Optional dependency, only needed for Parquet; slow to import, so loaded on first use
+pa = pq = None
+
+
+def _load_pyarrow():
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+
+def check_format(fmt: str):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r} (expected one of {', '.join(FORMATS)})")
+    if fmt == "parquet" and not _load_pyarrow():
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+
+def export_query(exam=None, skill=None, difficulty=None, status=None, created_from=None, created_to=None, form_id=None, after=None, until=None):
+    query = select(
+        ItemsBank.id, ItemsBank.exam, ItemsBank.skill, ItemsBank.difficulty, ItemsBank.status,
+        ItemsBank.created_at, ItemsBank.served_at, ItemsBank.validation_issues, ItemsBank.question_content
+    )
+    if exam:
+        query = query.where(ItemsBank.exam == exam)
+    if skill:
+        query = query.where(ItemsBank.skill == skill)
+    if difficulty:
+        query = query.where(ItemsBank.difficulty == difficulty)
+    if status:
+        query = query.where(ItemsBank.status == status)
+    if form_id:
+        query = query.where(ItemsBank.form_id == form_id, ItemsBank.form_slot.isnot(None))
+    if created_from:
+        query = query.where(ItemsBank.created_at >= created_from)
+    if created_to:
+        query = query.where(ItemsBank.created_at < created_to)
+    if after:
+        # Keyset on (created_at, id): resumes exactly after the last exported row
+        query = query.where(tuple_(ItemsBank.created_at, ItemsBank.id) > tuple_(*after))
+    if until:
+        query = query.where(ItemsBank.created_at < until)
+    return query.order_by(ItemsBank.created_at, ItemsBank.id)
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _record(row):
+    return {
+        "id": str(row.id),
+        "exam": row.exam,
+        "skill": row.skill,
+        "difficulty": row.difficulty,
+        "status": row.status,
+        "created_at": _isoformat(row.created_at),
+        "served_at": _isoformat(row.served_at),
+        "validation_issues": row.validation_issues,
+        "question_content": row.question_content,
+    }
+
+
+def _jsonl_chunks(rows, batch_size):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(_record(row), ensure_ascii=False, default=str))
+        if len(lines) >= batch_size:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def parquet_schema():
+    # Item fields flattened into columns for the assembly tooling; nested parts stay JSON text
+    return pa.schema(
+        [("id", pa.string()), ("exam", pa.string()), ("skill", pa.string()), ("difficulty", pa.string()),
+         ("status", pa.string()), ("created_at", pa.timestamp("us", tz="UTC")), ("served_at", pa.timestamp("us", tz="UTC")),
+         ("stimulus", pa.string()), ("question_stem", pa.string())]
+        + [(f"option_{key.lower()}", pa.string()) for key in OPTION_KEYS]
+        + [("correct_option", pa.string()), ("rationale", pa.string()), ("distractor_rationales", pa.string()),
+           ("validation_issues", pa.string()), ("question_content", pa.string())]
+    )
+
+
+def _json_text(value):
+    return None if value is None else json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _as_text(value):
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+def _columns(rows):
+    schema = parquet_schema()
+    columns = {name: [] for name in schema.names}
+    for row in rows:
+        content = row.question_content if isinstance(row.question_content, dict) else {}
+        options = content.get("options") if isinstance(content.get("options"), dict) else {}
+        columns["id"].append(str(row.id))
+        columns["exam"].append(row.exam)
+        columns["skill"].append(row.skill)
+        columns["difficulty"].append(row.difficulty)
+        columns["status"].append(row.status)
+        columns["created_at"].append(row.created_at)
+        columns["served_at"].append(row.served_at)
+        for field in ("stimulus", "question_stem", "correct_option", "rationale"):
+            columns[field].append(_as_text(content.get(field)))
+        for key in OPTION_KEYS:
+            columns[f"option_{key.lower()}"].append(_as_text(options.get(key)))
+        columns["distractor_rationales"].append(_json_text(content.get("distractor_rationales")))
+        columns["validation_issues"].append(_json_text(row.validation_issues))
+        columns["question_content"].append(_json_text(row.question_content))
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+class _Drain:
+    """Write-only file object that hands back whatever was written since the last take()."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet_chunks(rows, batch_size):
+    sink = _Drain()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), parquet_schema(), compression="zstd")
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                writer.write_table(_columns(batch))  # one row group per batch
+                batch = []
+                yield sink.take()
+        if batch:
+            writer.write_table(_columns(batch))
+    finally:
+        writer.close()
+    yield sink.take()  # footer
+
+
+def watermark_filters(filters):
+    """The filters a watermark is bound to, in a comparable JSON-safe form."""
+    return {k: _isoformat(v) if isinstance(v, datetime) else str(v) for k, v in sorted(filters.items()) if v is not None}
+
+
+def check_incremental(db, since, filters):
+    """Raises ValueError when `since` cannot be combined with these filters."""
+    mutable = [name for name in MUTABLE_FILTERS if filters.get(name)]
+    if mutable:
+        raise ValueError(f"'{', '.join(mutable)}' cannot be combined with since: rows that change later would be skipped for good")
+    row = db.execute(text("SELECT filters FROM export_watermarks WHERE name = :name"), {"name": since}).first()
+    # filters IS NULL: watermark from before filters were recorded, it adopts these ones
+    if row is not None and row.filters is not None and row.filters != watermark_filters(filters):
+        raise ValueError(f"Watermark '{since}' was created with filters {row.filters}; "
+                         "use the same filters, another name, or reset it")
+
+
+def get_watermark(db, name):
+    row = db.execute(text("SELECT last_created_at, last_id FROM export_watermarks WHERE name = :name"), {"name": name}).first()
+    return (row.last_created_at, row.last_id) if row else None
+
+
+def set_watermark(db, name, last_created_at, last_id, rows, filters=None):
+    db.execute(text("""
+        INSERT INTO export_watermarks (name, last_created_at, last_id, rows_exported, filters, updated_at)
+        VALUES (:name, :created_at, :id, :rows, CAST(:filters AS jsonb), NOW())
+        ON CONFLICT (name) DO UPDATE SET
+            last_created_at = EXCLUDED.last_created_at,
+            last_id = EXCLUDED.last_id,
+            rows_exported = export_watermarks.rows_exported + EXCLUDED.rows_exported,
+            filters = COALESCE(export_watermarks.filters, EXCLUDED.filters),
+            updated_at = NOW()
+    """), {"name": name, "created_at": last_created_at, "id": last_id, "rows": rows,
+           "filters": json.dumps(watermark_filters(filters or {}))})
+
+
+def list_watermarks(db):
+    rows = db.execute(text("SELECT name, last_created_at, last_id, rows_exported, filters, updated_at FROM export_watermarks ORDER BY name")).all()
+    return [{"name": r.name, "last_created_at": _isoformat(r.last_created_at), "last_id": str(r.last_id),
+             "rows_exported": r.rows_exported, "filters": r.filters, "updated_at": _isoformat(r.updated_at)} for r in rows]
+
+
+def delete_watermark(db, name):
+    deleted = db.execute(text("DELETE FROM export_watermarks WHERE name = :name"), {"name": name}).rowcount
+    db.commit()
+    return bool(deleted)
+
+
+def export(fmt="jsonl", since=None, batch_size=EXPORT_BATCH_SIZE, session_factory=SessionLocal, report=None, **filters):
+    """Yields the export as byte chunks.
+
+    `filters`: exam, skill, difficulty, status, created_from, created_to, form_id.
+    `since`: name of an incremental consumer; only rows after its watermark are
+    exported, and the watermark moves forward once the last chunk has been
+    consumed (an interrupted download leaves it where it was). It raises
+    ValueError with a `status` filter or with other filters than the
+    watermark was created with (see check_incremental).
+    `report`, if given, is filled with the row count and the new watermark.
+    """
+    check_format(fmt)
+    report = report if report is not None else {}
+    report.update(rows=0, watermark=None)
+    with session_factory() as db:
+        after = until = None
+        if since:
+            check_incremental(db, since, filters)
+            after = get_watermark(db, since)
+            until = db.execute(text("SELECT NOW() - make_interval(secs => :s)"), {"s": EXPORT_SETTLE_SECONDS}).scalar()
+        # yield_per turns on a server-side cursor (psycopg2 named cursor)
+        result = db.execute(export_query(after=after, until=until, **filters).execution_options(yield_per=batch_size))
+        last = []
+
+        def tracked():
+            for row in result:
+                report["rows"] += 1
+                last[:] = [row.created_at, row.id]
+                yield row
+
+        chunks = _jsonl_chunks if fmt == "jsonl" else _parquet_chunks
+        for chunk in chunks(tracked(), batch_size):
+            if chunk:
+                yield chunk
+
+        if since and last:
+            result.close()
+            set_watermark(db, since, last[0], last[1], report["rows"], filters)
+            db.commit()
+            report["watermark"] = {"created_at": _isoformat(last[0]), "id": str(last[1])}
+    logger.info(f"Exported {report['rows']} items_bank rows as {fmt}" + (f" (since '{since}')" if since else "") + ".")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exports items_bank to JSONL or Parquet.")
+    parser.add_argument("output", help="output file, or - for stdout")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="default: from the output extension, else jsonl")
+    parser.add_argument("--exam")
+    parser.add_argument("--skill")
+    parser.add_argument("--difficulty")
+    parser.add_argument("--status", help="draft, approved, rejected, ...")
+    parser.add_argument("--created-from", type=datetime.fromisoformat, help="ISO date/time, inclusive")
+    parser.add_argument("--created-to", type=datetime.fromisoformat, help="ISO date/time, exclusive")
+    parser.add_argument("--form-id", help="only the accepted items of one assembled form")
+    parser.add_argument("--since", metavar="NAME", help="incremental: only rows new since the last export with this name "
+                                                        "(always with the same filters; not with --status)")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("parquet" if args.output.endswith(".parquet") else "jsonl")
+    check_format(fmt)
+    filters = {"exam": args.exam, "skill": args.skill, "difficulty": args.difficulty, "status": args.status,
+               "created_from": args.created_from, "created_to": args.created_to, "form_id": args.form_id}
+    report = {}
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for chunk in export(fmt, since=args.since, batch_size=args.batch_size, report=report, **filters):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(json.dumps(report), file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+from sqlalchemy import text
+
+from core.item_validator import has_errors
+from core.skill_index import skill_index
+from core.write_behind import write_behind
+
+logger = logging.getLogger("ItemPool")
+
+POOL_ENABLED = os.getenv("POOL_ENABLED", "true").lower() == "true"
+# Ready 'draft' items kept per (exam, skill, difficulty)
+POOL_TARGET_DEPTH = int(os.getenv("POOL_TARGET_DEPTH", "5"))
+# Max seconds between pool scans (claims wake the filler immediately)
+POOL_REFILL_INTERVAL = float(os.getenv("POOL_REFILL_INTERVAL", "30"))
+POOL_MAX_CONCURRENCY = int(os.getenv("POOL_MAX_CONCURRENCY", "4"))
+# Optional warm keys, e.g. '[["Sociales", "Argumentación", "Media"]]'
+POOL_KEYS = os.getenv("POOL_KEYS", "[]")
+# Keys tracked from /generate requests: at most POOL_MAX_KEYS, dropped after
+# POOL_KEY_TTL seconds without a claim (POOL_KEYS and /pool/targets never expire)
+POOL_MAX_KEYS = int(os.getenv("POOL_MAX_KEYS", "200"))
+POOL_KEY_TTL = float(os.getenv("POOL_KEY_TTL", "86400"))
+# Longest pause for a key whose refills keep failing or getting rejected by validation
+POOL_MAX_COOLDOWN = float(os.getenv("POOL_MAX_COOLDOWN", "3600"))
+RATE_WINDOW_SECONDS = 300
+
+# Session-level advisory lock per key, same scheme as form assembly
+LOCK_SQL = text("SELECT pg_try_advisory_lock(hashtext(:k))")
+UNLOCK_SQL = text("SELECT pg_advisory_unlock(hashtext(:k))")
+
+
+def _lock_key(key):
+    return "item_pool:" + json.dumps(key, ensure_ascii=False)
+
+
+class ItemPool:
+    """Keeps a stock of pre-generated items per (exam, skill, difficulty) in items_bank.
+
+    Pool items are rows with status 'draft' and served_at NULL. /generate claims
+    one with FOR UPDATE SKIP LOCKED (safe across workers), and a background
+    filler thread tops each tracked key back up to POOL_TARGET_DEPTH; an
+    advisory lock per key keeps the fillers of other workers off the same key.
+    Keys are pinned up front (POOL_KEYS, /pool/targets) or tracked when first
+    requested. Requested keys only count when the skill is a known skill card,
+    and are capped (POOL_MAX_KEYS) and expired (POOL_KEY_TTL), so free-text
+    skills sent to /generate cannot grow the LLM spend of the filler.
+    """
+
+    def __init__(self, target_depth=POOL_TARGET_DEPTH, refill_interval=POOL_REFILL_INTERVAL,
+                 max_keys=POOL_MAX_KEYS, key_ttl=POOL_KEY_TTL, skills=skill_index):
+        self.target_depth = target_depth
+        self.refill_interval = refill_interval
+        self.max_keys = max_keys
+        self.key_ttl = key_ttl
+        self.skills = skills
+        self.keys = set()
+        self.pinned = set()
+        self._last_claim = {}  # requested key -> time of its last claim
+        self.depths = {}
+        self.served = 0
+        self.generated = 0
+        self.failed = 0
+        self._generated_at = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._session_factory = None
+        self._cooldown = {}  # key -> time before which refills are skipped (LLM failing or items rejected)
+        self._strikes = {}  # key -> consecutive refill passes that banked nothing usable
+        self.rejected = 0
+        for key in json.loads(POOL_KEYS):
+            self.pin(*key)
+
+    def pin(self, exam, skill, difficulty):
+        """Tracks a key for good (no skill check, cap or TTL)."""
+        key = (exam, skill, difficulty)
+        with self._lock:
+            self.pinned.add(key)
+            self.keys.add(key)
+            self._last_claim.pop(key, None)
+        self._wake.set()
+
+    def track(self, exam, skill, difficulty):
+        """Tracks a requested key; returns whether it is (now) being refilled."""
+        key = (exam, skill, difficulty)
+        with self._lock:
+            if key in self.pinned:
+                return True
+            if key in self.keys:
+                self._last_claim[key] = time.time()
+                return True
+        match = self.skills.best(skill)
+        if match is None or match["match"] != "exact":
+            return False
+        with self._lock:
+            if len(self._last_claim) >= self.max_keys:
+                logger.debug(f"Pool key limit ({self.max_keys}) reached; not tracking {key}.")
+                return False
+            self.keys.add(key)
+            self._last_claim[key] = time.time()
+        self._wake.set()
+        return True
+
+    def _expire(self):
+        cutoff = time.time() - self.key_ttl
+        with self._lock:
+            for key in [k for k, last in self._last_claim.items() if last < cutoff]:
+                del self._last_claim[key]
+                self.keys.discard(key)
+                self.depths.pop(key, None)
+                self._cooldown.pop(key, None)
+                self._strikes.pop(key, None)
+
+    CLAIM_SQL = text("""
+        UPDATE items_bank SET served_at = NOW()
+        WHERE id IN (
+            SELECT id FROM items_bank
+            WHERE exam = :exam AND skill = :skill AND difficulty = :difficulty
+              AND status = 'draft' AND served_at IS NULL
+            ORDER BY created_at
+            LIMIT :n
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, question_content
+    """)
+
+    def claim(self, db, exam, skill, difficulty, n=1):
+        """Takes up to `n` ready items for the key. Returns [{"id", "item"}]."""
+        self.track(exam, skill, difficulty)
+        rows = db.execute(self.CLAIM_SQL, {"exam": exam, "skill": skill, "difficulty": difficulty, "n": n}).all()
+        db.commit()
+        return self._claimed((exam, skill, difficulty), rows)
+
+    async def claim_async(self, db, exam, skill, difficulty, n=1):
+        """claim() on an AsyncSession, for async request handlers."""
+        self.track(exam, skill, difficulty)
+        rows = (await db.execute(self.CLAIM_SQL, {"exam": exam, "skill": skill, "difficulty": difficulty, "n": n})).all()
+        await db.commit()
+        return self._claimed((exam, skill, difficulty), rows)
+
+    def _claimed(self, key, rows):
+        if rows:
+            with self._lock:
+                self.served += len(rows)
+                self.depths[key] = max(0, self.depths.get(key, len(rows)) - len(rows))
+            # Refill asynchronously
+            self._wake.set()
+        return [{"id": str(row.id), "item": row.question_content} for row in rows]
+
+    def depth(self, db, key):
+        exam, skill, difficulty = key
+        return db.execute(text("""
+            SELECT count(*) FROM items_bank
+            WHERE exam = :exam AND skill = :skill AND difficulty = :difficulty
+              AND status = 'draft' AND served_at IS NULL
+        """), {"exam": exam, "skill": skill, "difficulty": difficulty}).scalar()
+
+    def refill_once(self):
+        """One pass over the tracked keys; generates the missing items for each."""
+        self._expire()
+        with self._lock:
+            keys = sorted(self.keys)
+        db = self._session_factory()
+        try:
+            # Every worker runs a filler: a session-level advisory lock per key on an
+            # AUTOCOMMIT connection lets only one of them top a key up at a time
+            with db.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+                for key in keys:
+                    if self._stop.is_set():
+                        return
+                    if self._cooldown.get(key, 0) > time.time():
+                        continue
+                    if not lock_conn.execute(LOCK_SQL, {"k": _lock_key(key)}).scalar():
+                        continue  # another worker is refilling this key
+                    try:
+                        self._refill_key(db, key)
+                    finally:
+                        lock_conn.execute(UNLOCK_SQL, {"k": _lock_key(key)})
+        finally:
+            db.close()
+
+    def _refill_key(self, db, key):
+        from core.generation_service import GenerationService
+
+        depth = self.depth(db, key)
+        self.depths[key] = depth
+        missing = self.target_depth - depth
+        if missing <= 0:
+            return
+
+        exam, skill, difficulty = key
+        # served=False: items are banked through the write-behind queue as ready pool items
+        batch = GenerationService(db).generate_items(
+            exam, skill, difficulty, n_items=missing, max_concurrency=POOL_MAX_CONCURRENCY, served=False
+        )
+        banked = [item for item in batch["items"] if item and item.get("item_id")]
+        # Items that failed validation are banked as 'rejected' and never count toward depth
+        good = [item for item in banked if not has_errors(item.get("validation_issues") or [])]
+        # Rows must be in items_bank before the lock is released, or the next worker refills them again
+        if not write_behind.flush():
+            logger.warning(f"Pool refill for {key}: write-behind flush timed out.")
+        db.rollback()  # end the read transaction so the new rows are visible
+        depth = self.depth(db, key)
+
+        now = time.time()
+        if good:
+            self._strikes.pop(key, None)
+        else:
+            # Every generation failed or was rejected: back off (doubling) instead of
+            # paying for the same unusable items on every pass
+            strikes = self._strikes.get(key, 0) + 1
+            self._strikes[key] = strikes
+            self._cooldown[key] = now + min(POOL_MAX_COOLDOWN, self.refill_interval * 2 ** (strikes - 1))
+            logger.warning(f"Pool refill for {key} produced no usable items; cooling down.")
+        with self._lock:
+            self.generated += len(good)
+            self.rejected += len(banked) - len(good)
+            self.failed += missing - len(banked)
+            self.depths[key] = depth
+            self._generated_at.extend([now] * len(good))
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.refill_once()
+            except Exception as e:
+                logger.error(f"Pool refill failed: {e}")
+            self._wake.wait(self.refill_interval)
+
+    def start(self, session_factory):
+        if not POOL_ENABLED or self._thread is not None:
+            return
+        self._session_factory = session_factory
+        self._thread = threading.Thread(target=self._run, name="item-pool-filler", daemon=True)
+        self._thread.start()
+        logger.info(f"Item pool filler started (target depth {self.target_depth}).")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            while self._generated_at and now - self._generated_at[0] > RATE_WINDOW_SECONDS:
+                self._generated_at.popleft()
+            recent = len(self._generated_at)
+            return {
+                "enabled": POOL_ENABLED,
+                "target_depth": self.target_depth,
+                "tracked_keys": len(self.keys),
+                "pinned_keys": len(self.pinned),
+                "max_keys": self.max_keys,
+                "key_ttl_seconds": self.key_ttl,
+                "served": self.served,
+                "generated": self.generated,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "cooling_down": sum(1 for until in self._cooldown.values() if until > now),
+                "refill_rate_per_min": round(recent * 60 / RATE_WINDOW_SECONDS, 2),
+                "depths": [
+                    {"exam": k[0], "skill": k[1], "difficulty": k[2], "ready": self.depths.get(k)}
+                    for k in sorted(self.keys)
+                ],
+            }
+
+
+item_pool = ItemPool()
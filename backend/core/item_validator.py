@@ -0,0 +1,254 @@
+import os
+import re
+import json
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from psycopg2.extras import execute_values
+from sqlalchemy import text
+
+from core import jobs
+from core.skill_index import normalize_skill
+
+logger = logging.getLogger("ItemValidator")
+
+# Fields a generated item must have before it is handed out as final
+REQUIRED_FIELDS = ("stimulus", "question_stem", "options", "correct_option")
+OPTION_KEYS = ("A", "B", "C", "D")
+
+# Longest / shortest option length (characters) above which the options look unbalanced
+OPTION_LENGTH_RATIO = float(os.getenv("VALIDATION_OPTION_LENGTH_RATIO", "2.5"))
+# Share of the correct option's content words that may appear in the stem before it counts as leaked
+ANSWER_LEAK_OVERLAP = float(os.getenv("VALIDATION_ANSWER_LEAK_OVERLAP", "0.8"))
+LEAK_MIN_WORDS = 3
+CONTENT_WORD_MIN_CHARS = 4
+# Batches smaller than this are validated inline (process start-up and pickling cost more)
+VALIDATION_PARALLEL_MIN_ITEMS = int(os.getenv("VALIDATION_PARALLEL_MIN_ITEMS", "500"))
+VALIDATION_CHUNK_SIZE = int(os.getenv("VALIDATION_CHUNK_SIZE", "250"))
+VALIDATION_WORKERS = int(os.getenv("VALIDATION_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# items_bank rows validated per round trip by the backfill
+VALIDATION_BACKFILL_BATCH = int(os.getenv("VALIDATION_BACKFILL_BATCH", "2000"))
+
+ERROR = "error"
+WARNING = "warning"
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def issue(code, message, severity=ERROR, field=None):
+    return {"code": code, "severity": severity, "field": field, "message": message}
+
+
+def has_errors(issues) -> bool:
+    return any(i["severity"] == ERROR for i in issues)
+
+
+def _text(value):
+    return _PUNCTUATION.sub(" ", normalize_skill(value if isinstance(value, str) else "")).split()
+
+
+def _content_words(words):
+    return {w for w in words if len(w) >= CONTENT_WORD_MIN_CHARS}
+
+
+def validate_item(item) -> list:
+    """Rule-based checks on an item in the shape generate_item produces.
+
+    Returns a list of issues ({"code", "severity", "field", "message"});
+    any "error" means the item must not be banked for serving, "warning"s are
+    left to reviewers.
+    """
+    if not isinstance(item, dict):
+        return [issue("not_an_object", "Item is not a JSON object")]
+
+    issues = [issue("missing_field", f"missing {field}", field=field) for field in REQUIRED_FIELDS if not item.get(field)]
+    options = item.get("options")
+    if options and not isinstance(options, dict):
+        issues.append(issue("invalid_options", "options must be an object keyed A-D", field="options"))
+        options = None
+    options = options or {}
+
+    # Options: all four present, none empty, none repeated
+    texts = {}
+    for key in OPTION_KEYS:
+        value = options.get(key)
+        if value is None:
+            if options:
+                issues.append(issue("missing_option", f"missing option {key}", field=f"options.{key}"))
+            continue
+        if not isinstance(value, str) or not value.strip():
+            issues.append(issue("empty_option", f"option {key} is empty", field=f"options.{key}"))
+            continue
+        texts[key] = value.strip()
+    extra = sorted(set(options) - set(OPTION_KEYS))
+    if extra:
+        issues.append(issue("unexpected_option", f"unexpected options {', '.join(map(str, extra))}", field="options"))
+
+    seen = {}
+    for key, value in texts.items():
+        norm = " ".join(_text(value))
+        if norm in seen:
+            issues.append(issue("duplicate_option", f"options {seen[norm]} and {key} are the same", field=f"options.{key}"))
+        else:
+            seen[norm] = key
+
+    # Correct option
+    correct = item.get("correct_option")
+    if correct is not None and correct != "":
+        if not isinstance(correct, str) or correct.strip().upper() not in OPTION_KEYS:
+            issues.append(issue("invalid_correct_option", f"correct_option {correct!r} is not one of {', '.join(OPTION_KEYS)}", field="correct_option"))
+            correct = None
+        else:
+            correct = correct.strip().upper()
+            if options and correct not in options:
+                issues.append(issue("invalid_correct_option", f"correct_option {correct} is not one of the options", field="correct_option"))
+                correct = None
+    else:
+        correct = None
+
+    # Length balance: a much longer (or shorter) option is a test-wiseness cue
+    if len(texts) >= 2:
+        lengths = {key: len(value) for key, value in texts.items()}
+        longest, shortest = max(lengths.values()), min(lengths.values())
+        if shortest and longest / shortest > OPTION_LENGTH_RATIO:
+            issues.append(issue("unbalanced_options", f"option lengths range from {shortest} to {longest} characters",
+                                severity=WARNING, field="options"))
+        if correct in lengths and len(lengths) == len(OPTION_KEYS):
+            others = sorted(v for k, v in lengths.items() if k != correct)
+            if lengths[correct] > others[-1] * 1.5:
+                issues.append(issue("longest_is_correct", f"correct option {correct} is much longer than every distractor",
+                                    severity=WARNING, field=f"options.{correct}"))
+
+    # Answer leaked into the stem (verbatim or nearly all its content words)
+    if correct in texts and isinstance(item.get("question_stem"), str):
+        stem = _text(item["question_stem"])
+        answer = _text(texts[correct])
+        answer_words = _content_words(answer)
+        leaked = len(answer) >= LEAK_MIN_WORDS and f" {' '.join(answer)} " in f" {' '.join(stem)} "
+        if not leaked and len(answer_words) >= LEAK_MIN_WORDS:
+            leaked = len(answer_words & set(stem)) / len(answer_words) >= ANSWER_LEAK_OVERLAP
+        if leaked:
+            issues.append(issue("answer_in_stem", f"question_stem gives away option {correct}", field="question_stem"))
+
+    # Rationales: one for the key, one per distractor
+    if not (isinstance(item.get("rationale"), str) and item["rationale"].strip()):
+        issues.append(issue("missing_rationale", "missing rationale", severity=WARNING, field="rationale"))
+    if correct:
+        distractors = [key for key in OPTION_KEYS if key != correct and key in options]
+        rationales = item.get("distractor_rationales")
+        rationales = rationales if isinstance(rationales, dict) else {}
+        given = {str(k).strip().upper(): v for k, v in rationales.items() if isinstance(v, str) and v.strip()}
+        if given and not set(given) & set(OPTION_KEYS):
+            # Keys like "wrong_option_1" (older prompts): only the count can be checked,
+            # and those items routinely carry 2 for 3 distractors, so it is not blocking
+            if len(given) < len(distractors):
+                issues.append(issue("missing_distractor_rationale", f"{len(given)} distractor rationales for {len(distractors)} distractors",
+                                    severity=WARNING, field="distractor_rationales"))
+        else:
+            missing = [key for key in distractors if key not in given]
+            if missing:
+                issues.append(issue("missing_distractor_rationale", f"no rationale for distractor {', '.join(missing)}",
+                                    field="distractor_rationales"))
+    return issues
+
+
+def _validate_chunk(items):
+    return [validate_item(item) for item in items]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: the API process has live threads (write-behind, pool filler)
+            _executor = ProcessPoolExecutor(max_workers=VALIDATION_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def validate_many(items, parallel=None) -> list:
+    """validate_item over a batch; large batches are spread over a process pool in chunks."""
+    if parallel is None:
+        parallel = len(items) >= VALIDATION_PARALLEL_MIN_ITEMS and VALIDATION_WORKERS > 1
+    if not parallel:
+        return _validate_chunk(items)
+    chunks = [items[i:i + VALIDATION_CHUNK_SIZE] for i in range(0, len(items), VALIDATION_CHUNK_SIZE)]
+    results = []
+    for chunk_result in _get_executor().map(_validate_chunk, chunks):
+        results.extend(chunk_result)
+    return results
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+PENDING_SQL = text("""
+    SELECT id, question_content FROM items_bank
+    WHERE validation_issues IS NULL AND (CAST(:after AS uuid) IS NULL OR id > CAST(:after AS uuid))
+    ORDER BY id
+    LIMIT :n
+""")
+
+# Only drafts are rejected: approved items were already accepted by a reviewer
+UPDATE_SQL = """
+    UPDATE items_bank AS ib
+    SET validation_issues = v.issues::jsonb,
+        status = CASE WHEN v.rejected AND ib.status = 'draft' THEN 'rejected' ELSE ib.status END
+    FROM (VALUES %s) AS v(id, issues, rejected)
+    WHERE ib.id = v.id::uuid
+"""
+
+
+def backfill(session_factory, job_id=None, batch_size=VALIDATION_BACKFILL_BATCH, reject=True):
+    """Validates every items_bank row without validation_issues (rows banked before validation existed).
+
+    With reject=False the issues are only recorded and no status changes
+    (drafts with errors are left for a reviewer or POST /generation/validate/bank).
+    """
+    totals = {"validated": 0, "rejected": 0, "with_errors": 0, "with_warnings": 0}
+    after = None
+    while True:
+        with session_factory() as db:
+            rows = db.execute(PENDING_SQL, {"after": after, "n": batch_size}).all()
+            if not rows:
+                break
+            after = str(rows[-1][0])
+            results = validate_many([row[1] for row in rows])
+            values = []
+            for (item_id, _), issues in zip(rows, results):
+                errors = has_errors(issues)
+                totals["with_errors"] += errors
+                totals["rejected"] += errors and reject
+                totals["with_warnings"] += bool(issues) and not errors
+                values.append((str(item_id), json.dumps(issues), errors and reject))
+            cursor = db.connection().connection.cursor()
+            try:
+                execute_values(cursor, UPDATE_SQL, values, page_size=len(values))
+            finally:
+                cursor.close()
+            db.commit()
+        totals["validated"] += len(rows)
+        if job_id:
+            jobs.report_progress(job_id, rows=len(rows), chunks=1)
+    if totals["validated"]:
+        logger.info(f"Validated {totals['validated']} banked items ({totals['with_errors']} with errors, {totals['rejected']} rejected).")
+    return totals
+
+
+def safe_backfill(session_factory):
+    # Startup variant: the table may not have the column yet, never crash the app.
+    # Unattended, so it only records issues and never changes an item's status.
+    try:
+        backfill(session_factory, reject=False)
+    except Exception as e:
+        logger.warning(f"items_bank validation backfill skipped: {e}")
@@ -0,0 +1,90 @@
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+# In-process registry of background jobs (ETL ingestion, ...).
+# Jobs live in memory only: they are progress reports, not durable state.
+MAX_JOBS = 200
+
+_jobs = {}
+_lock = threading.Lock()
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def create_job(kind: str, **params) -> dict:
+    job = {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "status": "queued",
+        "params": params,
+        "created_at": _now(),
+        "started_at": None,
+        "finished_at": None,
+        "rows_processed": 0,
+        "chunks_committed": 0,
+        "rows_per_s": None,
+        "errors": [],
+        "result": None,
+        "_t0": None,
+    }
+    with _lock:
+        _jobs[job["id"]] = job
+        # Forget the oldest finished jobs so the registry stays bounded
+        if len(_jobs) > MAX_JOBS:
+            finished = [j for j in _jobs.values() if j["finished_at"]]
+            for old in sorted(finished, key=lambda j: j["created_at"])[:len(_jobs) - MAX_JOBS]:
+                _jobs.pop(old["id"], None)
+    return job
+
+
+def start_job(job_id: str):
+    with _lock:
+        job = _jobs[job_id]
+        job["status"] = "running"
+        job["started_at"] = _now()
+        job["_t0"] = time.perf_counter()
+
+
+def report_progress(job_id: str, rows: int = 0, chunks: int = 0):
+    with _lock:
+        job = _jobs[job_id]
+        job["rows_processed"] += rows
+        job["chunks_committed"] += chunks
+        elapsed = time.perf_counter() - job["_t0"] if job["_t0"] else 0
+        if elapsed > 0:
+            job["rows_per_s"] = round(job["rows_processed"] / elapsed, 1)
+
+
+def add_error(job_id: str, message: str, **context):
+    with _lock:
+        _jobs[job_id]["errors"].append({"message": message, **context})
+
+
+def finish_job(job_id: str, status: str, result=None):
+    with _lock:
+        job = _jobs[job_id]
+        job["status"] = status
+        job["result"] = result
+        job["finished_at"] = _now()
+
+
+def get_job(job_id: str):
+    with _lock:
+        job = _jobs.get(job_id)
+        return _public(job) if job else None
+
+
+def list_jobs(kind: str = None):
+    with _lock:
+        jobs = [_public(j) for j in _jobs.values() if kind is None or j["kind"] == kind]
+    return sorted(jobs, key=lambda j: j["created_at"], reverse=True)
+
+
+def _public(job):
+    data = {k: v for k, v in job.items() if not k.startswith("_")}
+    data["errors"] = list(job["errors"])
+    return data
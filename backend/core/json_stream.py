@@ -0,0 +1,101 @@
+import json
+
+
+class IncrementalJSONParser:
+    """Parses a JSON document as it arrives, chunk by chunk.
+
+    feed() returns the values that became complete with that chunk as
+    (path, value) pairs, where path is a tuple of keys / list indices, e.g.
+    ("stimulus",) or ("options", "A"). Only values up to `max_depth` levels deep
+    are reported; the root object comes last with path (). Text before the
+    first '{' or '[' (model preamble) is ignored.
+    """
+
+    def __init__(self, max_depth: int = 2):
+        self.max_depth = max_depth
+        self.buf = ""
+        self.pos = 0
+        self.stack = []     # open containers: {"type", "expect", "key", "index"}
+        self.starts = []    # open values: (path, start offset)
+        self.in_string = False
+        self.escape = False
+        self.string_is_key = False
+        self.key_start = None
+        self.scalar_start = None
+        self.done = False
+        self.root = None
+
+    def _path(self):
+        return tuple(f["key"] if f["type"] == "obj" else f["index"] for f in self.stack)
+
+    def _begin(self, i):
+        self.starts.append((self._path(), i))
+
+    def _complete(self, end, events):
+        path, start = self.starts.pop()
+        if len(path) > self.max_depth:
+            return
+        try:
+            value = json.loads(self.buf[start:end])
+        except ValueError:
+            return
+        events.append((path, value))
+        if not path:
+            self.root = value
+            self.done = True
+
+    def feed(self, chunk: str):
+        self.buf += chunk
+        events = []
+        while self.pos < len(self.buf) and not self.done:
+            i = self.pos
+            c = self.buf[i]
+            self.pos += 1
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    if self.string_is_key:
+                        self.stack[-1]["key"] = json.loads(self.buf[self.key_start:i + 1])
+                    else:
+                        self._complete(i + 1, events)
+                continue
+
+            if not self.stack and c not in "{[":
+                continue
+
+            if self.scalar_start is not None and (c in ",}]" or c.isspace()):
+                self.scalar_start = None
+                self._complete(i, events)
+
+            if c == '"':
+                self.in_string = True
+                frame = self.stack[-1]
+                self.string_is_key = frame["type"] == "obj" and frame["expect"] == "key"
+                if self.string_is_key:
+                    self.key_start = i
+                else:
+                    self._begin(i)
+            elif c in "{[":
+                self._begin(i)
+                self.stack.append({"type": "obj" if c == "{" else "arr", "expect": "key", "key": None, "index": 0})
+            elif c in "}]":
+                self.stack.pop()
+                self._complete(i + 1, events)
+            elif c == ":":
+                self.stack[-1]["expect"] = "value"
+            elif c == ",":
+                frame = self.stack[-1]
+                if frame["type"] == "obj":
+                    frame["expect"] = "key"
+                else:
+                    frame["index"] += 1
+            elif not c.isspace() and self.scalar_start is None:
+                # number / true / false / null
+                self.scalar_start = i
+                self._begin(i)
+        return events
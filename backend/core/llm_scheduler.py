@@ -0,0 +1,402 @@
+import os
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+
+from core import metrics
+from core.context_packer import count_tokens
+
+logger = logging.getLogger("LLMScheduler")
+
+# Provider budgets (Groq llama-3.3-70b free tier by default), for the whole API key
+LLM_RPM = float(os.getenv("LLM_RPM", "30"))
+LLM_TPM = float(os.getenv("LLM_TPM", "12000"))
+# Processes sharing the key (uvicorn --workers); each one gets 1/LLM_WORKERS of the budgets
+LLM_WORKERS = max(1, int(os.getenv("LLM_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))))
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "16"))
+# Completion tokens reserved per call before the real usage is known
+LLM_EST_COMPLETION_TOKENS = int(os.getenv("LLM_EST_COMPLETION_TOKENS", "700"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+# Consecutive failed calls that open the breaker, and how long it stays open
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0  # a user is waiting (/generate, /generate/stream)
+PRIORITY_BATCH = 5        # n_items > 1 requests
+PRIORITY_BACKGROUND = 10  # pool refills and other offline work
+
+TRANSIENT_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """The provider is considered down; the call was not attempted."""
+
+
+class QueueTimeoutError(Exception):
+    """No budget became available within LLM_QUEUE_TIMEOUT."""
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, clock=time.monotonic):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = clock()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+    def cap(self, remaining: float):
+        # Provider says fewer are left (other processes share the budget)
+        self.level = min(self.level, remaining)
+
+
+class CircuitBreaker:
+    def __init__(self, failures=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN, clock=time.monotonic):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = "closed"
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "open":
+                if self.clock() - self.opened_at < self.cooldown:
+                    raise CircuitOpenError("LLM circuit breaker is open")
+                self.state = "half_open"
+            if self.state == "half_open":
+                # One probe at a time decides whether the provider is back
+                if self._probing:
+                    raise CircuitOpenError("LLM circuit breaker is half-open (probe in flight)")
+                self._probing = True
+
+    def success(self):
+        with self._lock:
+            self.consecutive = 0
+            self._probing = False
+            if self.state != "closed":
+                logger.info("LLM circuit breaker closed.")
+            self.state = "closed"
+
+    def failure(self):
+        with self._lock:
+            self.consecutive += 1
+            self._probing = False
+            if self.state == "half_open" or self.consecutive >= self.failures:
+                if self.state != "open":
+                    self.trips += 1
+                    logger.warning(f"LLM circuit breaker opened after {self.consecutive} consecutive failures.")
+                self.state = "open"
+                self.opened_at = self.clock()
+
+    def release_probe(self):
+        # Non-transient error during a probe: says nothing about the outage
+        with self._lock:
+            self._probing = False
+
+
+def _retry_after(e):
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                return None
+    return None
+
+
+def _is_transient(e):
+    import openai  # already loaded by the client that raised e; keeps the SDK off the import path
+
+    if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code in TRANSIENT_STATUS
+
+
+class _ScheduledStream:
+    """Iterator over a streamed completion that holds its in-flight slot until the stream ends.
+
+    Success/failure reaches the breaker only once the stream is exhausted or
+    raises; closing it early (client went away) just frees the slot.
+    """
+
+    def __init__(self, scheduler, stream, reserved):
+        self._scheduler = scheduler
+        self._stream = stream
+        self._iter = iter(stream)
+        self._reserved = reserved
+        self._used = None
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._iter)
+        except StopIteration:
+            self._finish(ok=True)
+            raise
+        except Exception as e:
+            self._finish(error=e)
+            raise
+        usage = getattr(chunk, "usage", None)
+        if usage is not None and getattr(usage, "total_tokens", None):
+            self._used = usage.total_tokens
+        return chunk
+
+    def _finish(self, ok=False, error=None):
+        if self._done:
+            return
+        self._done = True
+        scheduler = self._scheduler
+        if ok:
+            scheduler.breaker.success()
+            scheduler._count("succeeded")
+        elif error is not None:
+            if _is_transient(error):
+                scheduler.breaker.failure()
+            else:
+                scheduler.breaker.release_probe()
+            scheduler._count("failed")
+        else:
+            scheduler.breaker.release_probe()
+            scheduler._count("abandoned")
+        scheduler._release(self._reserved, self._used)
+
+    def close(self):
+        if self._done:
+            return
+        self._finish()
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+def estimate_tokens(messages) -> int:
+    return sum(count_tokens(m.get("content") or "") for m in messages) + LLM_EST_COMPLETION_TOKENS
+
+
+class LLMScheduler:
+    """Process-wide gate in front of the LLM provider.
+
+    Every chat completion goes through chat(): it waits in a priority queue
+    until the requests/min and tokens/min buckets (and LLM_MAX_IN_FLIGHT) allow
+    it, retries transient errors with full-jitter backoff honouring
+    Retry-After, and fails fast while the circuit breaker is open. A 429 pauses
+    the whole queue, not just the caller.
+
+    The budgets are for the whole API key, so each of the LLM_WORKERS
+    processes starts from its share. The provider's
+    x-ratelimit-remaining-requests / -tokens headers then cap the local
+    buckets before the next reservation is taken, so workers converge on what
+    is really left of the key's budget.
+    """
+
+    def __init__(self, rpm=LLM_RPM, tpm=LLM_TPM, max_in_flight=LLM_MAX_IN_FLIGHT, workers=LLM_WORKERS,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.workers = workers
+        self.requests = TokenBucket(rpm / workers, clock)
+        self.tokens = TokenBucket(tpm / workers, clock)
+        self.max_in_flight = max_in_flight
+        self.breaker = CircuitBreaker(clock=clock)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._provider_remaining = {}  # bucket name -> (remaining, clock time of the response)
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.counters = {"calls": 0, "succeeded": 0, "failed": 0, "abandoned": 0, "retries": 0, "rate_limited": 0, "rejected_open": 0}
+
+    def _count(self, *names):
+        with self._cond:
+            for name in names:
+                self.counters[name] += 1
+
+    def _wait_time(self, tokens, now):
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.in_flight >= self.max_in_flight:
+            return None
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def _apply_provider_caps(self, now):
+        # Caller holds _cond. Headers of the last response, plus what refilled since then
+        for name, (remaining, at) in self._provider_remaining.items():
+            bucket = getattr(self, name)
+            bucket._refill(now)
+            bucket.cap(remaining + max(0.0, now - at) * bucket.rate)
+        self._provider_remaining.clear()
+
+    def _admit(self, tokens, priority):
+        ticket = (priority, next(self._seq))
+        deadline = self.clock() + LLM_QUEUE_TIMEOUT
+        queued_at = time.perf_counter()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                now = self.clock()
+                self._apply_provider_caps(now)
+                wait = self._wait_time(tokens, now) if self._waiting[0] == ticket else None
+                if wait == 0:
+                    heapq.heappop(self._waiting)
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    self.in_flight += 1
+                    self._cond.notify_all()
+                    break
+                if now >= deadline:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    raise QueueTimeoutError(f"No LLM budget within {LLM_QUEUE_TIMEOUT}s")
+                self._cond.wait(timeout=min(wait if wait is not None else 1.0, deadline - now))
+        metrics.stage_seconds.observe(time.perf_counter() - queued_at, stage="llm_queue_wait")
+
+    def _release(self, reserved=0, used=None):
+        with self._cond:
+            self.in_flight -= 1
+            if used is not None and used < reserved:
+                self.tokens.give_back(reserved - used)
+            self._cond.notify_all()
+
+    def _pause(self, seconds):
+        with self._cond:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+    def _sync(self, headers):
+        """Records the provider's remaining budgets; applied before the next reservation."""
+        now = self.clock()
+        with self._cond:
+            for header, name in (("x-ratelimit-remaining-requests", "requests"), ("x-ratelimit-remaining-tokens", "tokens")):
+                try:
+                    self._provider_remaining[name] = (float(headers.get(header)), now)
+                except (TypeError, ValueError):
+                    pass
+            self._cond.notify_all()
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+    def chat(self, client, priority=PRIORITY_INTERACTIVE, max_retries=LLM_MAX_RETRIES, **create_kwargs):
+        """client.chat.completions.create(**create_kwargs) under the budgets. Returns the parsed response.
+
+        With stream=True the result is an iterator of chunks that keeps the
+        in-flight slot until it is exhausted or closed (use it as a context manager).
+        """
+        reserved = estimate_tokens(create_kwargs.get("messages", []))
+        self._count("calls")
+        for attempt in range(max_retries + 1):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self._count("rejected_open", "failed")
+                raise
+            try:
+                self._admit(reserved, priority)
+            except QueueTimeoutError:
+                self.breaker.release_probe()
+                self._count("failed")
+                raise
+            try:
+                raw = client.chat.completions.with_raw_response.create(**create_kwargs)
+                response = raw.parse()
+            except Exception as e:
+                self._release()
+                transient = _is_transient(e)
+                retry_after = _retry_after(e)
+                if getattr(e, "status_code", None) == 429:
+                    # Budget exhausted for everyone on this key: hold the whole queue
+                    self._count("rate_limited")
+                    self._pause(retry_after if retry_after is not None else self._backoff(attempt + 1))
+                    self.breaker.release_probe()
+                elif transient:
+                    self.breaker.failure()
+                else:
+                    self.breaker.release_probe()
+                if not transient or attempt == max_retries:
+                    self._count("failed")
+                    raise
+                delay = max(retry_after or 0.0, self._backoff(attempt))
+                self._count("retries")
+                metrics.llm_retries.inc(reason=str(getattr(e, "status_code", None) or type(e).__name__))
+                logger.warning(f"LLM call failed ({e}); retry {attempt + 1}/{max_retries} in {delay:.2f}s")
+                self.sleep(delay)
+                continue
+
+            self._sync(raw.headers)
+            if create_kwargs.get("stream"):
+                # The call is only over once the stream has been consumed
+                return _ScheduledStream(self, response, reserved)
+
+            self.breaker.success()
+            usage = getattr(response, "usage", None)
+            used = None
+            if usage is not None and getattr(usage, "total_tokens", None):
+                used = usage.total_tokens
+            self._release(reserved, used)
+            self._count("succeeded")
+            return response
+
+    def stats(self):
+        with self._cond:
+            now = self.clock()
+            self._apply_provider_caps(now)
+            self.requests._refill(now)
+            self.tokens._refill(now)
+            return {
+                "queued": len(self._waiting),
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "requests_available": round(self.requests.level, 2),
+                "rpm": self.requests.capacity,
+                "tokens_available": round(self.tokens.level),
+                "tpm": self.tokens.capacity,
+                "workers": self.workers,
+                "paused_for_s": round(max(0.0, self.paused_until - now), 2),
+                "breaker": {"state": self.breaker.state, "consecutive_failures": self.breaker.consecutive, "trips": self.breaker.trips},
+                **self.counters,
+            }
+
+
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,208 @@
+import os
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Adds a Server-Timing header (per-stage durations) to every response
+METRICS_TIMING_HEADER = os.getenv("METRICS_TIMING_HEADER", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (256, 512, 1024, 1536, 2048, 3072, 4096, 8192)
+DB_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "SET"}
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0)
+
+# Stage durations of the request being served, for the timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _samples(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', bound)])} {cumulative}")
+        lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {state['count']}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {round(state['sum'], 6)}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+
+class Registry:
+    """Minimal in-process metrics registry rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    "icfes_stage_duration_seconds", "Duration of pipeline stages (generation and ETL).", ["stage"]))
+http_request_seconds = registry.register(Histogram(
+    "icfes_http_request_duration_seconds", "HTTP request latency by route.", ["method", "route", "status"]))
+db_query_seconds = registry.register(Histogram(
+    "icfes_db_query_duration_seconds", "Database statement latency by statement type.", ["operation"], DB_BUCKETS))
+llm_tokens = registry.register(Counter(
+    "icfes_llm_tokens_total", "LLM tokens reported by the provider.", ["kind"]))
+prompt_tokens = registry.register(Histogram(
+    "icfes_prompt_tokens", "Prompt size (system + user) per generation call.", [], TOKEN_BUCKETS))
+llm_retries = registry.register(Counter(
+    "icfes_llm_retries_total", "LLM call retries by cause (HTTP status or exception type).", ["reason"]))
+generations = registry.register(Counter(
+    "icfes_generations_total", "Generated items by outcome (ok, unparsed, fallback = mock_fallback served).", ["status"]))
+validation_issues = registry.register(Counter(
+    "icfes_validation_issues_total", "Validator findings on generated items by rule and severity.", ["code", "severity"]))
+errors = registry.register(Counter(
+    "icfes_errors_total", "Errors by component.", ["component"]))
+etl_rows = registry.register(Counter(
+    "icfes_etl_rows_total", "CSV rows processed per ETL stage.", ["stage"]))
+etl_rows_per_second = registry.register(Gauge(
+    "icfes_etl_rows_per_second", "Throughput of the last ETL run per stage.", ["stage"]))
+startup_seconds = registry.register(Gauge(
+    "icfes_startup_seconds", "Startup time by phase (import, warmup, total) and warm-up step.", ["phase"]))
+
+
+@contextmanager
+def timed(stage: str):
+    """Observes the block's duration under icfes_stage_duration_seconds{stage}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def record_etl_stage(stage: str, input_rows: int, seconds: float):
+    etl_rows.inc(input_rows, stage=stage)
+    stage_seconds.observe(seconds, stage=f"etl_{stage}")
+    if seconds > 0:
+        etl_rows_per_second.set(round(input_rows / seconds, 1), stage=stage)
+
+
+def start_request_timings():
+    timings = []
+    return timings, _request_timings.set(timings)
+
+
+def end_request_timings(token):
+    _request_timings.reset(token)
+
+
+def server_timing_header(timings, total: float) -> str:
+    parts = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def instrument_engine(engine):
+    """Times every statement run through a (sync) SQLAlchemy engine."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if not starts:
+            return
+        words = statement.split(None, 1)
+        operation = words[0].upper() if words else "OTHER"
+        if operation not in DB_OPERATIONS:
+            operation = "OTHER"
+        db_query_seconds.observe(time.perf_counter() - starts.pop(), operation=operation)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        errors.inc(component="db")
+        if context.connection is not None and context.connection.info.get("query_start"):
+            context.connection.info["query_start"].pop()
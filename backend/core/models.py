@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, TIMESTAMP, func
+from sqlalchemy import Column, String, Text, TIMESTAMP, BigInteger, Integer, Float, func
 from sqlalchemy.dialects.postgresql import UUID, JSONB, ARRAY
 from sqlalchemy.types import UserDefinedType
 from core.database import Base
@@ -21,6 +21,10 @@ class RagDocument(Base):
     content = Column(Text, nullable=False)
     metadata_ = Column("metadata", JSONB, default={})
     source_file = Column(String)
+    doc_key = Column(String, unique=True)
+    content_hash = Column(String, index=True)
+    minhash = Column(ARRAY(BigInteger))
+    lsh_bands = Column(ARRAY(String))
     embedding = Column(Vector)
 
 class ItemsBank(Base):
@@ -33,12 +37,69 @@ class ItemsBank(Base):
     question_content = Column(JSONB, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
     status = Column(String, default="draft")
+    served_at = Column(TIMESTAMP(timezone=True)) # NULL while the item waits in the generation pool
+    validation_issues = Column(JSONB) # core/item_validator.py findings, NULL until validated
+    form_id = Column(UUID(as_uuid=True)) # forms row when assembled from a blueprint
+    form_slot = Column(Integer) # position in the form; NULL for rejected attempts
 
 class SimilarityItem(Base):
     __tablename__ = "similarity_items"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    content_hash = Column(String)
+    content_hash = Column(String, unique=True)
     content_snippet = Column(Text)
     embedding = Column(Vector)
     source = Column(String)
+
+class GenerationRun(Base):
+    __tablename__ = "generation_runs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    prompt_used = Column(Text)
+    parameters = Column(JSONB)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    item_id = Column(UUID(as_uuid=True)) # items_bank row, NULL when generation failed
+    exam = Column(String)
+    skill = Column(String)
+    difficulty = Column(String)
+    output = Column(JSONB)
+    status = Column(String) # 'ok', 'fallback', 'unparsed'
+    error = Column(Text)
+    duration_ms = Column(Float)
+
+class Form(Base):
+    __tablename__ = "forms"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    name = Column(String)
+    exam = Column(String)
+    blueprint = Column(JSONB, nullable=False)
+    n_slots = Column(Integer)
+    status = Column(String, default="assembling") # 'assembling', 'complete', 'incomplete', 'failed'
+    summary = Column(JSONB)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    finished_at = Column(TIMESTAMP(timezone=True))
+
+class ExportWatermark(Base):
+    __tablename__ = "export_watermarks"
+
+    name = Column(String, primary_key=True) # one per consumer, e.g. 'nightly-assembly'
+    last_created_at = Column(TIMESTAMP(timezone=True), nullable=False)
+    last_id = Column(UUID(as_uuid=True), nullable=False)
+    rows_exported = Column(BigInteger, default=0)
+    filters = Column(JSONB) # filters the watermark was created with; later exports must match
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+
+class VectorIndexState(Base):
+    __tablename__ = "vector_indexes"
+
+    table_name = Column(String, primary_key=True)
+    index_name = Column(String, nullable=False)
+    method = Column(String, nullable=False) # 'ivfflat', 'hnsw', 'exact'
+    quantization = Column(String, nullable=False) # 'none', 'halfvec', 'binary'
+    params = Column(JSONB, default=dict)
+    rows_at_build = Column(BigInteger, default=0)
+    build_seconds = Column(Float)
+    built_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+    desired_method = Column(String) # override from a rebuild request; NULL = VECTOR_INDEX_METHOD
+    desired_quantization = Column(String) # NULL = VECTOR_INDEX_QUANTIZATION
@@ -0,0 +1,92 @@
+"""Encoder for PostgreSQL binary COPY (COPY ... FROM STDIN WITH (FORMAT BINARY)).
+
+Used by the ETL so embeddings travel as packed float32 instead of
+'[0.0123,...]' text literals: ~6 KB per 1536-dim vector instead of ~15 KB,
+and no float parsing on the server.
+"""
+import json
+import struct
+import uuid
+
+import numpy as np
+
+HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+TRAILER = struct.pack("!h", -1)
+NULL = struct.pack("!i", -1)
+
+# Column kinds -> SQL type of the staging column
+SQL_TYPES = {
+    "text": "text",
+    "jsonb": "jsonb",
+    "uuid": "uuid",
+    "int8": "bigint",
+    "int8[]": "bigint[]",
+    "text[]": "text[]",
+    "vector": "vector",
+}
+_ELEMENT_OIDS = {"int8": 20, "text": 25}
+
+
+def _text(value):
+    return str(value).encode("utf-8")
+
+
+def _jsonb(value):
+    # jsonb binary format: version byte + JSON text
+    return b"\x01" + (value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)).encode("utf-8")
+
+
+def _uuid(value):
+    return value.bytes if isinstance(value, uuid.UUID) else uuid.UUID(str(value)).bytes
+
+
+def _int8(value):
+    return struct.pack("!q", int(value))
+
+
+def vector_binary(vec) -> bytes:
+    """pgvector wire format: int16 dim, int16 unused, dim x big-endian float32."""
+    arr = np.asarray(vec, dtype=">f4").ravel()
+    return struct.pack("!hh", len(arr), 0) + arr.tobytes()
+
+
+def _array(element):
+    encode = ENCODERS[element]
+    oid = _ELEMENT_OIDS[element]
+
+    def _encode(values):
+        values = list(values)
+        if not values:
+            return struct.pack("!iii", 0, 0, oid)
+        parts = [struct.pack("!iiiii", 1, int(any(v is None for v in values)), oid, len(values), 1)]
+        for v in values:
+            if v is None:
+                parts.append(NULL)
+            else:
+                data = encode(v)
+                parts.append(struct.pack("!i", len(data)) + data)
+        return b"".join(parts)
+    return _encode
+
+
+ENCODERS = {"text": _text, "jsonb": _jsonb, "uuid": _uuid, "int8": _int8, "vector": vector_binary}
+ENCODERS["int8[]"] = _array("int8")
+ENCODERS["text[]"] = _array("text")
+
+
+def encode_rows(rows, kinds) -> bytes:
+    """One binary COPY payload (header, tuples, trailer) for `rows` (tuples in `kinds` order)."""
+    encoders = [ENCODERS[kind] for kind in kinds]
+    field_count = struct.pack("!h", len(kinds))
+    parts = [HEADER]
+    for row in rows:
+        parts.append(field_count)
+        for encode, value in zip(encoders, row):
+            if value is None:
+                parts.append(NULL)
+            else:
+                data = encode(value)
+                parts.append(struct.pack("!i", len(data)))
+                parts.append(data)
+    parts.append(TRAILER)
+    return b"".join(parts)
@@ -0,0 +1,464 @@
+"""Lifecycle of the pgvector ANN indexes (rag_documents, similarity_items).
+
+    python -m core.pgvector_indexes report
+    python -m core.pgvector_indexes rebuild --method hnsw --quantization halfvec
+    python -m core.pgvector_indexes recall --table rag_documents --sample 50 --k 10
+
+An ivfflat index built on an empty table (lists=100 from init.sql) has
+centroids that describe nothing, so recall drops as data arrives. Indexes are
+therefore (re)built here, after bulk loads, with `lists` sized to the row
+count, or as HNSW. Optionally the index stores a compact copy of the
+embedding (halfvec = float16, or binary_quantize = 1 bit per dimension); the
+quantized index only proposes VECTOR_RERANK_FACTOR x k candidates and the
+exact float32 distance picks the final k.
+"""
+import os
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+import threading
+
+from sqlalchemy import text
+
+from core import jobs, events
+from core.database import SessionLocal, engine
+from core.embeddings import EMBEDDING_DIM, from_pgvector_binary, to_pgvector
+
+logger = logging.getLogger("PgVectorIndexes")
+
+VECTOR_INDEX_METHOD = os.getenv("VECTOR_INDEX_METHOD", "ivfflat")  # ivfflat | hnsw
+VECTOR_INDEX_QUANTIZATION = os.getenv("VECTOR_INDEX_QUANTIZATION", "none")  # none | halfvec | binary
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+# Quantized indexes return this many times the wanted rows; exact distances pick the final ones
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))
+# Below this many rows no ANN index is kept: a sequential scan is fast and exact
+VECTOR_INDEX_MIN_ROWS = int(os.getenv("VECTOR_INDEX_MIN_ROWS", "1000"))
+# Rebuild once the table has grown by this factor since the last build
+VECTOR_REBUILD_GROWTH = float(os.getenv("VECTOR_REBUILD_GROWTH", "2.0"))
+# ETL commits arrive per chunk; wait for the load to go quiet before checking
+VECTOR_REBUILD_DELAY_SECONDS = float(os.getenv("VECTOR_REBUILD_DELAY_SECONDS", "30"))
+VECTOR_MAINTENANCE_WORK_MEM = os.getenv("VECTOR_MAINTENANCE_WORK_MEM", "512MB")
+
+METHODS = ("ivfflat", "hnsw")
+QUANTIZATIONS = ("none", "halfvec", "binary")
+
+# Partial index on rag_documents: distractor patterns are the only documents searched by vector
+TABLES = {
+    "rag_documents": {"index": "rag_documents_embedding_idx", "where": "doc_type = 'distractor_pattern' AND embedding IS NOT NULL"},
+    "similarity_items": {"index": "similarity_items_embedding_idx", "where": "embedding IS NOT NULL"},
+}
+
+# Minimum pgvector version per feature
+_REQUIRES = {"hnsw": (0, 5, 0), "halfvec": (0, 7, 0), "binary": (0, 7, 0)}
+
+
+def lists_for(rows: int) -> int:
+    """ivfflat lists: rows / 1000 up to 1M rows, sqrt(rows) above (pgvector's guidance)."""
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return int(math.sqrt(rows))
+
+
+def bytes_per_vector(quantization: str, dim: int = EMBEDDING_DIM) -> int:
+    return {"none": 4 * dim + 8, "halfvec": 2 * dim + 8, "binary": dim // 8 + 8}[quantization]
+
+
+def _indexed_expression(quantization, column="embedding"):
+    if quantization == "halfvec":
+        return f"({column}::halfvec({EMBEDDING_DIM}))", "halfvec_cosine_ops"
+    if quantization == "binary":
+        return f"(binary_quantize({column})::bit({EMBEDDING_DIM}))", "bit_hamming_ops"
+    return column, "vector_cosine_ops"
+
+
+def distance_sql(quantization, query, column="embedding"):
+    """ORDER BY expression that the index of this quantization can serve."""
+    if quantization == "halfvec":
+        return f"({column}::halfvec({EMBEDDING_DIM})) <=> ({query})::halfvec({EMBEDDING_DIM})"
+    if quantization == "binary":
+        return f"(binary_quantize({column})::bit({EMBEDDING_DIM})) <~> binary_quantize({query})"
+    return f"{column} <=> {query}"
+
+
+def _version_tuple(value):
+    return tuple(int(part) for part in str(value).split(".")[:3] if part.isdigit())
+
+
+class VectorIndexManager:
+    """Builds, rebuilds and reports on the pgvector indexes, and tells queries how to use them.
+
+    The method/quantization the last build actually used is kept per table
+    (vector_indexes state table, cached here), and query SQL follows it rather
+    than the env settings. A rebuild sends VECTOR_INDEX_REBUILT to every
+    worker, which re-reads the state table; until that arrives (a moment after
+    the swap) a worker's queries may miss the new index and scan, but the
+    results stay exact.
+    A method/quantization passed to a rebuild (endpoint or CLI) is stored as
+    that table's desired setting and wins over the env vars in later
+    maintenance passes, until a rebuild with use_env clears it.
+    """
+
+    def __init__(self, method=VECTOR_INDEX_METHOD, quantization=VECTOR_INDEX_QUANTIZATION):
+        if method not in METHODS:
+            raise ValueError(f"Unknown VECTOR_INDEX_METHOD {method!r} (expected one of {', '.join(METHODS)})")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown VECTOR_INDEX_QUANTIZATION {quantization!r} (expected one of {', '.join(QUANTIZATIONS)})")
+        self.method = method
+        self.quantization = quantization
+        self._built = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self.last_maintenance = None
+
+    # --- query side ---
+
+    def plan(self, table):
+        """{method, quantization, params} of the index currently serving `table`."""
+        return self._built.get(table) or {"method": self.method, "quantization": self.quantization, "params": {}}
+
+    def candidates(self, table, k):
+        return k * VECTOR_RERANK_FACTOR if self.plan(table)["quantization"] != "none" else k
+
+    def search_settings(self, db, table, k, probes=None):
+        """SET LOCAL the ANN knobs of the current index for this transaction."""
+        plan = self.plan(table)
+        if plan["method"] == "hnsw":
+            # ef_search bounds how many rows the scan can return
+            db.execute(text(f"SET LOCAL hnsw.ef_search = {int(max(HNSW_EF_SEARCH, self.candidates(table, k)))}"))
+        elif plan["method"] == "ivfflat":
+            lists = plan["params"].get("lists", 100)
+            probes = int(probes or max(1, round(math.sqrt(lists))))
+            # SET LOCAL cannot take bind parameters; probes is an int
+            db.execute(text(f"SET LOCAL ivfflat.probes = {probes}"))
+
+    def nearest_sql(self, table, query, columns, limit=":k"):
+        """SELECT `columns`, embedding, score of the `limit` rows nearest to `query` (an SQL expression).
+
+        Quantized indexes fetch :candidates rows through the compact index and
+        re-rank them on the float32 embedding; bind :candidates with candidates().
+        """
+        spec = TABLES[table]
+        quantization = self.plan(table)["quantization"]
+        exact = f"embedding <=> {query}"
+        if quantization == "none":
+            return f"""SELECT {columns}, embedding, 1 - ({exact}) AS score FROM {table}
+                WHERE {spec['where']} ORDER BY {exact} LIMIT {limit}"""
+        return f"""SELECT {columns}, embedding, 1 - ({exact}) AS score FROM (
+                SELECT {columns}, embedding FROM {table}
+                WHERE {spec['where']} ORDER BY {distance_sql(quantization, query)} LIMIT :candidates
+            ) candidates ORDER BY {exact} LIMIT {limit}"""
+
+    # --- build side ---
+
+    def pgvector_version(self, db):
+        value = db.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+        return _version_tuple(value) if value else None
+
+    def check_supported(self, version, method, quantization):
+        for feature in (method, quantization):
+            needed = _REQUIRES.get(feature)
+            if needed and (version is None or version < needed):
+                have = ".".join(map(str, version)) if version else "not installed"
+                raise RuntimeError(
+                    f"{feature} needs pgvector >= {'.'.join(map(str, needed))} (installed: {have}; "
+                    "after upgrading the image run ALTER EXTENSION vector UPDATE)"
+                )
+
+    def load_state(self, session_factory=SessionLocal):
+        """Reads what the last builds used into the query-side cache."""
+        with session_factory() as db:
+            rows = db.execute(text("SELECT table_name, method, quantization, params FROM vector_indexes")).all()
+        with self._lock:
+            self._built = {r.table_name: {"method": r.method, "quantization": r.quantization, "params": r.params or {}}
+                           for r in rows}
+        return self._built
+
+    def _state(self, db, table):
+        return db.execute(text("""
+            SELECT table_name, index_name, method, quantization, params, rows_at_build, build_seconds, built_at,
+                   desired_method, desired_quantization
+            FROM vector_indexes WHERE table_name = :table
+        """), {"table": table}).first()
+
+    def desired(self, state):
+        """(method, quantization) the table should be built with: a stored override, else the env settings."""
+        if state is None:
+            return self.method, self.quantization
+        return state.desired_method or self.method, state.desired_quantization or self.quantization
+
+    def _count(self, db, table):
+        return db.execute(text(f"SELECT count(*) FROM {table} WHERE {TABLES[table]['where']}")).scalar()
+
+    def rebuild_reason(self, db, table):
+        """Why `table`'s index should be rebuilt now, or None."""
+        state = self._state(db, table)
+        rows = self._count(db, table)
+        if state is None:
+            return "no managed index yet"
+        if state.method == "exact":
+            return f"{rows} rows reached VECTOR_INDEX_MIN_ROWS" if rows >= VECTOR_INDEX_MIN_ROWS else None
+        method, quantization = self.desired(state)
+        if (state.method, state.quantization) != (method, quantization):
+            return f"settings changed to {method}/{quantization}"
+        if rows >= max(1, state.rows_at_build) * VECTOR_REBUILD_GROWTH:
+            return f"grew from {state.rows_at_build} to {rows} rows"
+        if db.execute(text("SELECT to_regclass(:name)"), {"name": TABLES[table]["index"]}).scalar() is None:
+            return "index missing"
+        return None
+
+    def rebuild(self, table, method=None, quantization=None, bind=engine, use_env=False):
+        """Builds a new index next to the old one (CONCURRENTLY) and swaps it in.
+
+        Reads keep using the old index until the swap. Below
+        VECTOR_INDEX_MIN_ROWS the index is dropped and searches are exact.
+        `method`/`quantization` become the table's desired setting (see
+        desired()); use_env=True drops any stored one and builds per the env.
+        """
+        spec = TABLES[table]
+        name = spec["index"]
+        lock_key = f"vector_index:{table}"
+        start = time.perf_counter()
+        # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if not conn.execute(text("SELECT pg_try_advisory_lock(hashtext(:k))"), {"k": lock_key}).scalar():
+                return {"table": table, "skipped": "another rebuild is running"}
+            try:
+                state = None if use_env else self._state(conn, table)
+                desired_method = method or (state.desired_method if state is not None else None)
+                desired_quantization = quantization or (state.desired_quantization if state is not None else None)
+                method = desired_method or self.method
+                quantization = desired_quantization or self.quantization
+                self.check_supported(self.pgvector_version(conn), method, quantization)
+                conn.execute(text("SET statement_timeout = 0"))
+                conn.execute(text(f"SET maintenance_work_mem = '{VECTOR_MAINTENANCE_WORK_MEM}'"))
+                rows = self._count(conn, table)
+                # Leftover (invalid) index of a build that died half-way
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}_new"))
+                if rows < VECTOR_INDEX_MIN_ROWS:
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                    method, quantization, params = "exact", "none", {}
+                else:
+                    if method == "hnsw":
+                        params = {"m": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION}
+                    else:
+                        params = {"lists": lists_for(rows)}
+                    expression, opclass = _indexed_expression(quantization)
+                    options = ", ".join(f"{key} = {value}" for key, value in params.items())
+                    conn.execute(text(
+                        f"CREATE INDEX CONCURRENTLY {name}_new ON {table} USING {method} ({expression} {opclass}) "
+                        f"WITH ({options}) WHERE {spec['where']}"
+                    ))
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                    conn.execute(text(f"ALTER INDEX {name}_new RENAME TO {name}"))
+                seconds = round(time.perf_counter() - start, 3)
+                conn.execute(text("""
+                    INSERT INTO vector_indexes (table_name, index_name, method, quantization, params, rows_at_build, build_seconds, built_at,
+                                                desired_method, desired_quantization)
+                    VALUES (:table, :name, :method, :quantization, CAST(:params AS jsonb), :rows, :seconds, NOW(),
+                            :desired_method, :desired_quantization)
+                    ON CONFLICT (table_name) DO UPDATE SET
+                        index_name = EXCLUDED.index_name,
+                        method = EXCLUDED.method,
+                        quantization = EXCLUDED.quantization,
+                        params = EXCLUDED.params,
+                        rows_at_build = EXCLUDED.rows_at_build,
+                        build_seconds = EXCLUDED.build_seconds,
+                        built_at = NOW(),
+                        desired_method = EXCLUDED.desired_method,
+                        desired_quantization = EXCLUDED.desired_quantization
+                """), {"table": table, "name": name, "method": method, "quantization": quantization,
+                       "params": json.dumps(params), "rows": rows, "seconds": seconds,
+                       "desired_method": desired_method, "desired_quantization": desired_quantization})
+                # AUTOCOMMIT: the other workers hear about it right away
+                events.notify(conn, events.VECTOR_INDEX_REBUILT, table=table)
+            finally:
+                conn.execute(text("RESET statement_timeout"))
+                conn.execute(text("RESET maintenance_work_mem"))
+                conn.execute(text("SELECT pg_advisory_unlock(hashtext(:k))"), {"k": lock_key})
+        with self._lock:
+            self._built[table] = {"method": method, "quantization": quantization, "params": params}
+        logger.info(f"Vector index on {table}: {method}/{quantization} {params} over {rows} rows in {seconds}s.")
+        return {"table": table, "method": method, "quantization": quantization, "params": params,
+                "rows": rows, "build_seconds": seconds}
+
+    def maintain(self, session_factory=SessionLocal, force=False, method=None, quantization=None, job_id=None, use_env=False):
+        """Rebuilds every table whose index is missing, stale or built with other settings.
+
+        method/quantization are persisted as the desired setting (see rebuild()).
+        """
+        results = []
+        for table in TABLES:
+            with session_factory() as db:
+                reason = "forced" if force else self.rebuild_reason(db, table)
+            if reason is None:
+                results.append({"table": table, "skipped": "up to date"})
+                continue
+            logger.info(f"Rebuilding vector index on {table}: {reason}.")
+            try:
+                result = self.rebuild(table, method=method, quantization=quantization, use_env=use_env)
+                results.append({**result, "reason": reason})
+                if job_id:
+                    jobs.report_progress(job_id, rows=result.get("rows", 0))
+            except Exception as e:
+                logger.error(f"Vector index rebuild on {table} failed: {e}")
+                results.append({"table": table, "error": str(e), "reason": reason})
+                if job_id:
+                    jobs.add_error(job_id, str(e), table=table)
+        self.last_maintenance = time.time()
+        return results
+
+    def safe_maintain(self, session_factory=SessionLocal):
+        try:
+            self.load_state(session_factory)
+            self.maintain(session_factory)
+        except Exception as e:
+            logger.error(f"Vector index maintenance failed: {e}")
+
+    def on_etl_commit(self, session_factory=SessionLocal):
+        """events.ETL_COMMITTED listener: check the indexes once the load has gone quiet."""
+        def _listener(documents_changed=False, similarity_items=None, remote=False, **_):
+            # The process that loaded the data schedules the rebuild (the ETL CLI runs it itself)
+            if remote or (not documents_changed and not similarity_items):
+                return
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                self._timer = threading.Timer(VECTOR_REBUILD_DELAY_SECONDS, self.safe_maintain, args=(session_factory,))
+                self._timer.daemon = True
+                self._timer.start()
+        return _listener
+
+    def on_index_rebuilt(self, session_factory=SessionLocal):
+        """events.VECTOR_INDEX_REBUILT listener: another worker swapped an index, re-read the plans."""
+        def _listener(remote=False, **_):
+            if not remote:
+                return  # rebuild() already updated this process's plan
+            try:
+                self.load_state(session_factory)
+            except Exception as e:
+                logger.error(f"Could not reload vector index state: {e}")
+        return _listener
+
+    def shutdown(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    # --- reporting ---
+
+    def report(self, session_factory=SessionLocal):
+        """Per table: rows, sizes, index definition and the settings of its last build."""
+        report = {"settings": {"method": self.method, "quantization": self.quantization,
+                               "rerank_factor": VECTOR_RERANK_FACTOR, "min_rows": VECTOR_INDEX_MIN_ROWS}}
+        with session_factory() as db:
+            version = self.pgvector_version(db)
+            report["pgvector_version"] = ".".join(map(str, version)) if version else None
+            for table, spec in TABLES.items():
+                rows = self._count(db, table)
+                sizes = db.execute(text("""
+                    SELECT pg_total_relation_size(CAST(:table AS regclass)) AS table_bytes,
+                           pg_relation_size(to_regclass(:index)) AS index_bytes,
+                           (SELECT indexdef FROM pg_indexes WHERE indexname = :index) AS definition
+                """), {"table": table, "index": spec["index"]}).first()
+                state = self._state(db, table)
+                report[table] = {
+                    "rows": rows,
+                    "table_bytes": sizes.table_bytes,
+                    "index": spec["index"],
+                    "index_bytes": sizes.index_bytes,
+                    "definition": sizes.definition,
+                    # Raw embedding payload per encoding, for comparison with index_bytes
+                    "embedding_bytes": {q: rows * bytes_per_vector(q) for q in QUANTIZATIONS},
+                    "desired": dict(zip(("method", "quantization"), self.desired(state))),
+                    "override": state is not None and bool(state.desired_method or state.desired_quantization),
+                    "last_build": None if state is None else {
+                        "method": state.method, "quantization": state.quantization, "params": state.params,
+                        "rows_at_build": state.rows_at_build, "build_seconds": state.build_seconds,
+                        "built_at": state.built_at.isoformat() if state.built_at else None,
+                    },
+                }
+        return report
+
+    def measure_recall(self, session_factory=SessionLocal, table="rag_documents", sample=20, k=10, probes=None):
+        """recall@k of the ANN search against an exact scan, using `sample` stored vectors as queries."""
+        spec = TABLES[table]
+        with session_factory() as db:
+            queries = [to_pgvector(from_pgvector_binary(r[0])) for r in db.execute(text(
+                f"SELECT vector_send(embedding) FROM {table} WHERE {spec['where']} ORDER BY random() LIMIT :n"
+            ), {"n": sample})]
+            if not queries:
+                return {"table": table, "queries": 0}
+            ann_sql = text(f"SELECT id FROM ({self.nearest_sql(table, 'CAST(:q AS vector)', 'id')}) ann")
+            exact_sql = text(f"SELECT id FROM {table} WHERE {spec['where']} ORDER BY embedding <=> CAST(:q AS vector) LIMIT :k")
+
+            self.search_settings(db, table, k, probes)
+            ann, ann_ms = [], []
+            for q in queries:
+                start = time.perf_counter()
+                ann.append({r[0] for r in db.execute(ann_sql, {"q": q, "k": k, "candidates": self.candidates(table, k)})})
+                ann_ms.append((time.perf_counter() - start) * 1000)
+
+            # Same transaction, index scans off: the ground truth is a sequential scan
+            db.execute(text("SET LOCAL enable_indexscan = off"))
+            exact, exact_ms = [], []
+            for q in queries:
+                start = time.perf_counter()
+                exact.append({r[0] for r in db.execute(exact_sql, {"q": q, "k": k})})
+                exact_ms.append((time.perf_counter() - start) * 1000)
+            db.rollback()
+
+        recalls = [len(a & e) / len(e) for a, e in zip(ann, exact) if e]
+        return {
+            "table": table,
+            "plan": self.plan(table),
+            "queries": len(queries),
+            "k": k,
+            "recall": round(sum(recalls) / len(recalls), 4) if recalls else None,
+            "min_recall": round(min(recalls), 4) if recalls else None,
+            "ann_ms_p50": round(sorted(ann_ms)[len(ann_ms) // 2], 2),
+            "exact_ms_p50": round(sorted(exact_ms)[len(exact_ms) // 2], 2),
+        }
+
+
+vector_index_manager = VectorIndexManager()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manages the pgvector ANN indexes.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("report", help="rows, index sizes and last build per table")
+    rebuild = sub.add_parser("rebuild", help="rebuild indexes (all stale ones, or --force all)")
+    rebuild.add_argument("--method", choices=METHODS)
+    rebuild.add_argument("--quantization", choices=QUANTIZATIONS)
+    rebuild.add_argument("--force", action="store_true")
+    rebuild.add_argument("--use-env", action="store_true",
+                         help="forget a --method/--quantization given earlier and rebuild per VECTOR_INDEX_* env vars")
+    recall = sub.add_parser("recall", help="recall@k of the ANN search vs an exact scan")
+    recall.add_argument("--table", choices=list(TABLES), default="rag_documents")
+    recall.add_argument("--sample", type=int, default=20)
+    recall.add_argument("--k", type=int, default=10)
+    recall.add_argument("--probes", type=int)
+    args = parser.parse_args(argv)
+
+    manager = vector_index_manager
+    manager.load_state()
+    if args.command == "report":
+        result = manager.report()
+    elif args.command == "rebuild":
+        force = args.force or args.use_env or bool(args.method or args.quantization)
+        result = manager.maintain(force=force, method=args.method, quantization=args.quantization, use_env=args.use_env)
+    else:
+        result = manager.measure_recall(table=args.table, sample=args.sample, k=args.k, probes=args.probes)
+    json.dump(result, sys.stdout, indent=2, default=str)
+    print()
+    return result
+
+
+if __name__ == "__main__":
+    main()
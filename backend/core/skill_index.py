@@ -0,0 +1,204 @@
+import bisect
+import logging
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+from sqlalchemy import text
+
+logger = logging.getLogger("SkillIndex")
+
+# Minimum trigram similarity for a fuzzy match to be returned
+FUZZY_MIN_SCORE = 0.3
+QUERY_CACHE_SIZE = 4096
+
+# Match types, best first; scores keep exact > prefix > substring > fuzzy
+MATCH_SCORES = {"exact": 1.0, "prefix": 0.9, "substring": 0.8}
+
+
+def normalize_skill(value: str) -> str:
+    """Lowercase, accent-free, single-spaced form used for matching."""
+    decomposed = unicodedata.normalize("NFKD", str(value or ""))
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.lower().split())
+
+
+def trigrams(value: str) -> set:
+    padded = f"  {value} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SkillCardIndex:
+    """Process-level lookup index over skill cards (rag_documents.doc_type = 'skill_card').
+
+    Supports exact, prefix, substring and trigram (fuzzy) matching with ranked,
+    deterministic results, so retrieve_context does not need an ILIKE scan per
+    request. It is warmed at startup and refreshed when an ETL run commits.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._lock = threading.Lock()
+        self._set_entries([])
+        self.stats_counters = defaultdict(int)
+        self.last_refresh = None
+        self.refresh_seconds = None
+
+    def _set_entries(self, entries):
+        exact = defaultdict(list)
+        grams = defaultdict(set)
+        for i, entry in enumerate(entries):
+            exact[entry["norm"]].append(i)
+            for gram in trigrams(entry["norm"]):
+                grams[gram].add(i)
+        names = sorted((entry["norm"], i) for i, entry in enumerate(entries))
+        # One snapshot swapped in atomically, so readers never mix old and new structures
+        self._snapshot = {
+            "entries": entries,
+            "exact": dict(exact),
+            "grams": dict(grams),
+            "sorted_names": [name for name, _ in names],
+            "sorted_ids": [i for _, i in names],
+            "query_cache": {},
+        }
+
+    @property
+    def entries(self):
+        return self._snapshot["entries"]
+
+    def load(self, rows):
+        """rows: iterables of (id, skill, content, source_file, metadata)."""
+        entries = []
+        for doc_id, skill, content, source_file, metadata in rows:
+            if not skill:
+                continue
+            entries.append({
+                "id": str(doc_id),
+                "skill": skill,
+                "content": content,
+                "source_file": source_file,
+                "metadata": metadata or {},
+                "norm": normalize_skill(skill),
+            })
+        # Deterministic tie-breaking between cards of the same skill
+        entries.sort(key=lambda e: (e["norm"], e["source_file"] or "", e["id"]))
+        with self._lock:
+            self._set_entries(entries)
+            self.ready = True
+
+    def refresh(self, session_factory):
+        start = time.perf_counter()
+        db = session_factory()
+        try:
+            rows = db.execute(text(
+                "SELECT id, skill, content, source_file, metadata FROM rag_documents WHERE doc_type = 'skill_card'"
+            )).all()
+        finally:
+            db.close()
+        self.load(rows)
+        self.refresh_seconds = round(time.perf_counter() - start, 4)
+        self.last_refresh = time.time()
+        logger.info(f"Skill index refreshed: {len(self.entries)} skill cards in {self.refresh_seconds}s.")
+
+    def safe_refresh(self, session_factory):
+        try:
+            self.refresh(session_factory)
+        except Exception as e:
+            logger.error(f"Skill index refresh failed: {e}")
+
+    def search(self, query: str, limit: int = 5):
+        """Ranked matches: list of dicts with id, skill, content, score, match."""
+        snap = self._snapshot
+        entries, query_cache = snap["entries"], snap["query_cache"]
+        sorted_names, sorted_ids = snap["sorted_names"], snap["sorted_ids"]
+
+        norm = normalize_skill(query)
+        cache_key = (norm, limit)
+        cached = query_cache.get(cache_key)
+        if cached is not None:
+            self._count("cache_hits", "found" if cached else "not_found")
+            return cached
+        self._count("cache_misses")
+
+        scored = {}
+        if norm:
+            for i in snap["exact"].get(norm, []):
+                scored[i] = ("exact", MATCH_SCORES["exact"])
+
+            # Prefix: contiguous run in the sorted names
+            pos = bisect.bisect_left(sorted_names, norm)
+            while pos < len(sorted_names) and sorted_names[pos].startswith(norm):
+                scored.setdefault(sorted_ids[pos], ("prefix", MATCH_SCORES["prefix"]))
+                pos += 1
+
+            # Too short for an unpadded trigram: "ab" inside "xaby" shares none of
+            # "  a", " ab", "ab ", so substring matches need a plain scan
+            if len(norm) < 3:
+                for i, entry in enumerate(entries):
+                    if i not in scored and norm in entry["norm"]:
+                        scored[i] = ("substring", MATCH_SCORES["substring"])
+
+            # Substring + fuzzy, restricted to candidates sharing a trigram
+            query_grams = trigrams(norm)
+            overlap = defaultdict(int)
+            for gram in query_grams:
+                for i in snap["grams"].get(gram, ()):
+                    overlap[i] += 1
+            for i, shared in overlap.items():
+                if i in scored:
+                    continue
+                if norm in entries[i]["norm"]:
+                    scored[i] = ("substring", MATCH_SCORES["substring"])
+                    continue
+                similarity = shared / (len(query_grams) + len(trigrams(entries[i]["norm"])) - shared)
+                if similarity >= FUZZY_MIN_SCORE:
+                    # Keep fuzzy scores strictly below the substring tier
+                    scored[i] = ("fuzzy", round(similarity * MATCH_SCORES["substring"], 4))
+
+        ranked = sorted(scored.items(), key=lambda item: (-item[1][1], entries[item[0]]["norm"], item[0]))
+        results = [
+            {**{k: v for k, v in entries[i].items() if k != "norm"}, "match": match, "score": score}
+            for i, (match, score) in ranked[:limit]
+        ]
+
+        self._count(results[0]["match"] if results else "miss", "found" if results else "not_found")
+        if len(query_cache) >= QUERY_CACHE_SIZE:
+            query_cache.clear()
+        query_cache[cache_key] = results
+        return results
+
+    def _count(self, *names):
+        # search() runs on many request threads; += on a shared dict is not atomic
+        with self._lock:
+            for name in names:
+                self.stats_counters[name] += 1
+
+    def best(self, query: str):
+        results = self.search(query, limit=1)
+        return results[0] if results else None
+
+    def on_etl_commit(self, session_factory):
+        """Returns an events.ETL_COMMITTED listener bound to a session factory."""
+        def _listener(documents_changed=True, **_):
+            if documents_changed:
+                self.safe_refresh(session_factory)
+        return _listener
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.stats_counters)
+        lookups = counters.get("found", 0) + counters.get("not_found", 0)
+        found = counters.get("found", 0)
+        return {
+            "ready": self.ready,
+            "skill_cards": len(self.entries),
+            "lookups": lookups,
+            "hit_rate": round(found / lookups, 4) if lookups else None,
+            "counters": counters,
+            "last_refresh": self.last_refresh,
+            "refresh_seconds": self.refresh_seconds,
+        }
+
+
+skill_index = SkillCardIndex()
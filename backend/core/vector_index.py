@@ -0,0 +1,362 @@
+import os
+import json
+import uuid
+import fcntl
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from sqlalchemy import text
+
+from core.embeddings import EMBEDDING_DIM, from_pgvector_binary
+
+logger = logging.getLogger("VectorIndex")
+
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "data/similarity_index")
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "8"))
+# Flat search is exact and fast enough below this size; IVF kicks in above it
+IVF_MIN_ROWS = 2000
+KMEANS_ITERATIONS = 10
+KMEANS_TRAIN_SAMPLE = 20000
+# Merge the in-memory delta into the base arrays once it is this fraction of the base
+DELTA_MERGE_RATIO = 0.1
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def train_centroids(vectors, n_lists, seed=0):
+    """Spherical k-means (cosine) on a sample of the vectors."""
+    rng = np.random.RandomState(seed)
+    sample = vectors
+    if len(vectors) > KMEANS_TRAIN_SAMPLE:
+        sample = vectors[np.sort(rng.choice(len(vectors), KMEANS_TRAIN_SAMPLE, replace=False))]
+    sample = np.asarray(sample, dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(n_lists):
+            members = sample[assignment == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+            else:
+                # Re-seed empty lists with a random point
+                centroids[c] = sample[rng.randint(len(sample))]
+        centroids = _normalize(centroids)
+    return centroids
+
+
+class IVFIndex:
+    """In-process cosine ANN index: NumPy matrix + IVF (inverted file) partitioning.
+
+    The base arrays are persisted as .npy files and memory-mapped on load, so
+    startup cost does not depend on the corpus size. Rows added after the last
+    save live in a small in-memory delta that is searched exhaustively and
+    persisted alongside the base. Keys are strings (similarity_items.content_hash).
+
+    Every uvicorn worker holds its own copy. Commits in other processes arrive
+    as remote ETL_COMMITTED events (core.events.RemoteEvents) and are read
+    back from similarity_items. Workers share the files under `path`: saves
+    and loads take a file lock, and the delta files record which base they
+    extend, so a worker never pairs its delta with another worker's base.
+    """
+
+    def __init__(self, path: str = VECTOR_INDEX_DIR, dim: int = EMBEDDING_DIM, nprobe: int = VECTOR_INDEX_NPROBE):
+        self.path = path
+        self.dim = dim
+        self.nprobe = nprobe
+        self.ready = False
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.keys = np.empty(0, dtype=object)
+        self.vectors = np.empty((0, self.dim), dtype=np.float32)
+        self.centroids = None
+        self.list_offsets = None   # CSR-style: rows of list c are order[offsets[c]:offsets[c+1]]
+        self.list_order = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.trained_size = 0
+        self.delta_keys = []
+        self.delta_vectors = []
+        self._known = set()
+        self._base_dirty = False
+        self.base_id = None  # id of the persisted base these arrays match
+
+    def __len__(self):
+        return len(self.keys) + len(self.delta_keys)
+
+    # --- building ---
+
+    def build(self, keys, vectors):
+        """(Re)builds the whole index from scratch."""
+        vectors = _normalize(vectors) if len(keys) else np.empty((0, self.dim), dtype=np.float32)
+        with self._lock:
+            self._reset()
+            self.keys = np.asarray(keys, dtype=object)
+            self.vectors = vectors
+            self._known = set(self.keys.tolist())
+            self._train()
+            self._base_dirty = True
+            self.ready = True
+        logger.info(f"Built similarity index with {len(self.keys)} vectors ({self.stats()['n_lists']} lists).")
+
+    def _train(self):
+        n = len(self.keys)
+        if n < IVF_MIN_ROWS:
+            self.centroids = None
+            self.trained_size = n
+            return
+        n_lists = max(1, int(np.sqrt(n)))
+        self.centroids = train_centroids(self.vectors, n_lists)
+        self.assignments = self._assign(self.vectors)
+        self._rebuild_lists()
+        self.trained_size = n
+
+    def _assign(self, vectors, batch=4096):
+        out = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), batch):
+            out[start:start + batch] = np.argmax(vectors[start:start + batch] @ self.centroids.T, axis=1)
+        return out
+
+    def _rebuild_lists(self):
+        self.list_order = np.argsort(self.assignments, kind="stable").astype(np.int64)
+        counts = np.bincount(self.assignments, minlength=len(self.centroids))
+        self.list_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def add(self, keys, vectors):
+        """Incremental insert; keys already indexed are ignored."""
+        vectors = _normalize(vectors)
+        with self._lock:
+            for key, vec in zip(keys, vectors):
+                if key in self._known:
+                    continue
+                self._known.add(key)
+                self.delta_keys.append(key)
+                self.delta_vectors.append(vec)
+            if len(self.delta_keys) > max(IVF_MIN_ROWS, DELTA_MERGE_RATIO * len(self.keys)):
+                self._merge_delta()
+
+    def _merge_delta(self):
+        if not self.delta_keys:
+            return
+        new_vectors = np.vstack(self.delta_vectors).astype(np.float32)
+        self.keys = np.concatenate([self.keys, np.asarray(self.delta_keys, dtype=object)])
+        self.vectors = np.vstack([np.asarray(self.vectors), new_vectors])
+        self.delta_keys, self.delta_vectors = [], []
+        self._base_dirty = True
+        # Retrain when the corpus has doubled since the centroids were fitted
+        if self.centroids is None or len(self.keys) >= 2 * max(self.trained_size, 1):
+            self._train()
+        else:
+            self.assignments = np.concatenate([self.assignments, self._assign(new_vectors)])
+            self._rebuild_lists()
+
+    # --- search ---
+
+    def search(self, queries, k: int = 5, nprobe: int = None):
+        """Top-k (key, cosine score) per query. `queries` is (q, dim) or (dim,)."""
+        queries = _normalize(queries)
+        nprobe = nprobe or self.nprobe
+        with self._lock:
+            keys, vectors, centroids = self.keys, self.vectors, self.centroids
+            order, offsets = self.list_order, self.list_offsets
+            delta_keys = list(self.delta_keys)
+            delta_vectors = np.vstack(self.delta_vectors) if self.delta_vectors else None
+
+        results = []
+        if centroids is not None:
+            probe_lists = np.argsort(-(queries @ centroids.T), axis=1)[:, :nprobe]
+        for qi, query in enumerate(queries):
+            cand_keys, cand_scores = [], []
+            if len(keys):
+                if centroids is None:
+                    scores = np.asarray(vectors) @ query
+                    cand_keys.append(keys)
+                else:
+                    rows = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe_lists[qi]])
+                    rows.sort()  # sequential reads from the memmap
+                    scores = np.asarray(vectors[rows]) @ query
+                    cand_keys.append(keys[rows])
+                cand_scores.append(scores)
+            if delta_vectors is not None:
+                cand_keys.append(np.asarray(delta_keys, dtype=object))
+                cand_scores.append(delta_vectors @ query)
+            if not cand_scores:
+                results.append([])
+                continue
+
+            all_keys = np.concatenate(cand_keys)
+            all_scores = np.concatenate(cand_scores)
+            top = min(k, len(all_scores))
+            best = np.argpartition(-all_scores, top - 1)[:top]
+            best = best[np.argsort(-all_scores[best])]
+            results.append([(all_keys[i], float(all_scores[i])) for i in best])
+        return results
+
+    # --- persistence ---
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        """flock on `path`/.lock: one writer, or any number of readers, across processes."""
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_meta(self):
+        meta_path = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def _write(self, name, array):
+        tmp = os.path.join(self.path, f"{name}.{os.getpid()}.tmp.npy")
+        np.save(tmp, array)
+        os.replace(tmp, os.path.join(self.path, f"{name}.npy"))
+
+    def save(self):
+        """Persists the index to `path` (atomic renames, under the exclusive file lock).
+
+        The base arrays are only rewritten after a delta merge or rebuild, or
+        when another worker has saved a different base since; otherwise just
+        the small delta files are written, so saving after every ETL commit
+        stays cheap.
+        """
+        with self._lock, self._file_lock(exclusive=True):
+            on_disk = self._read_meta() or {}
+            if self._base_dirty or on_disk.get("base_id") != self.base_id:
+                if self._base_dirty or self.base_id is None:
+                    self.base_id = uuid.uuid4().hex
+                self._write("keys", self.keys.astype(str))
+                self._write("vectors", np.asarray(self.vectors, dtype=np.float32))
+                self._write("assignments", self.assignments)
+                if self.centroids is not None:
+                    self._write("centroids", self.centroids)
+                # Re-open the freshly written vectors as a memmap
+                self.vectors = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode="r")
+                self._base_dirty = False
+
+            self._write("delta_keys", np.asarray(self.delta_keys, dtype=str))
+            self._write("delta_vectors", np.vstack(self.delta_vectors) if self.delta_vectors
+                        else np.empty((0, self.dim), dtype=np.float32))
+
+            meta = {"dim": self.dim, "count": len(self.keys), "trained_size": self.trained_size,
+                    "has_centroids": self.centroids is not None, "base_id": self.base_id, "saved_at": time.time()}
+            tmp = os.path.join(self.path, f"meta.{os.getpid()}.json.tmp")
+            with open(tmp, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp, os.path.join(self.path, "meta.json"))
+
+    def load(self) -> bool:
+        if not os.path.exists(os.path.join(self.path, "meta.json")):
+            return False
+        with self._lock, self._file_lock(exclusive=False):
+            meta = self._read_meta()
+            if meta is None:
+                return False
+            if meta.get("dim") != self.dim:
+                logger.warning(f"Ignoring similarity index at {self.path}: dim {meta.get('dim')} != {self.dim}")
+                return False
+            self._reset()
+            self.keys = np.load(os.path.join(self.path, "keys.npy")).astype(object)
+            self.vectors = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode="r")
+            self.assignments = np.load(os.path.join(self.path, "assignments.npy"))
+            self.trained_size = meta.get("trained_size", len(self.keys))
+            self.base_id = meta.get("base_id")
+            if meta.get("has_centroids"):
+                self.centroids = np.load(os.path.join(self.path, "centroids.npy"))
+                self._rebuild_lists()
+            delta_path = os.path.join(self.path, "delta_keys.npy")
+            if os.path.exists(delta_path):
+                self.delta_keys = np.load(delta_path).astype(object).tolist()
+                self.delta_vectors = list(np.load(os.path.join(self.path, "delta_vectors.npy")))
+            self._known = set(self.keys.tolist()) | set(self.delta_keys)
+            self.ready = True
+        logger.info(f"Loaded similarity index from {self.path} ({len(self)} vectors, memory-mapped).")
+        return True
+
+    def sync_from_db(self, db, keys=None, batch_size=5000):
+        """Adds similarity_items rows the index has not seen (e.g. loaded while offline).
+
+        `keys` limits the check to those content hashes (rows another process
+        just committed); by default every row is checked.
+        """
+        if keys is None:
+            keys = [row[0] for row in db.execute(
+                text("SELECT content_hash FROM similarity_items WHERE content_hash IS NOT NULL AND embedding IS NOT NULL")
+            )]
+        missing = [key for key in keys if key not in self._known]
+        added = 0
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            rows = db.execute(
+                text("""
+                    SELECT content_hash, vector_send(embedding) FROM similarity_items
+                    WHERE content_hash = ANY(:keys) AND embedding IS NOT NULL
+                """),
+                {"keys": batch}
+            ).all()
+            if rows:
+                self.add([r[0] for r in rows], np.vstack([from_pgvector_binary(r[1]) for r in rows]))
+                added += len(rows)
+        return added
+
+    def load_or_build(self, session_factory):
+        """Startup path: memory-map the saved index, then catch up with the DB."""
+        self.load()
+        self.catch_up(session_factory)
+        self.ready = True
+
+    def catch_up(self, session_factory, keys=None):
+        db = session_factory()
+        try:
+            added = self.sync_from_db(db, keys=keys)
+            if added:
+                self.save()
+                logger.info(f"Similarity index synced: {added} new vectors.")
+        except Exception as e:
+            logger.error(f"Could not sync similarity index with the database: {e}")
+        finally:
+            db.close()
+
+    def on_etl_commit(self, session_factory):
+        """Returns an events.ETL_COMMITTED listener bound to a session factory.
+
+        Commits in this process hand over the new vectors; commits in other
+        processes (remote events) only say which keys changed, so the rows are
+        read back from similarity_items.
+        """
+        def _listener(similarity_items=None, similarity_changed=False, similarity_keys=None, **_):
+            if similarity_items:
+                keys = [key for key, _ in similarity_items]
+                self.add(keys, np.vstack([vec for _, vec in similarity_items]))
+                self.save()
+            elif similarity_changed:
+                self.catch_up(session_factory, keys=similarity_keys)
+        return _listener
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "size": len(self),
+            "delta_size": len(self.delta_keys),
+            "n_lists": 0 if self.centroids is None else len(self.centroids),
+            "nprobe": self.nprobe,
+            "path": self.path,
+        }
+
+
+similarity_index = IVFIndex()
@@ -0,0 +1,168 @@
+"""Startup warm-up and readiness.
+
+The app starts serving (and /healthz answers) as soon as it is imported;
+caches and pool connections are then loaded by the steps registered here, in
+order, off the request path. /readyz reports 503 until every required step
+has succeeded, so the load balancer only routes traffic to warm workers.
+A failing step (e.g. the database is not up yet) is retried every
+WARMUP_RETRY_SECONDS; later steps wait for it.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+
+from sqlalchemy import text
+
+from core import metrics
+
+logger = logging.getLogger("Warmup")
+
+# Connections opened at startup so the first requests do not pay for the handshake
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", "4"))
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+
+
+def warm_pool(engine, connections=WARMUP_DB_CONNECTIONS):
+    """Opens `connections` pooled connections at once (they stay in the pool)."""
+    opened = []
+    try:
+        for _ in range(connections):
+            conn = engine.connect()
+            opened.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            conn.close()
+
+
+async def warm_async_pool(engine, connections=WARMUP_DB_CONNECTIONS):
+    opened = []
+    try:
+        for _ in range(connections):
+            conn = await engine.connect()
+            opened.append(conn)
+            await conn.execute(text("SELECT 1"))
+    finally:
+        for conn in opened:
+            await conn.close()
+
+
+class Warmup:
+    """Ordered warm-up steps plus the startup-time report behind /readyz."""
+
+    def __init__(self):
+        self._steps = []
+        self._async_steps = []
+        self.state = {}
+        self.import_seconds = None
+        self.boot_time = None  # perf_counter() when the app module started importing
+        self.started_at = None
+        self.ready_at = None
+        self._lock = threading.Lock()
+
+    def add(self, name, fn, required=True):
+        """Step run in the warm-up thread. Optional steps are tried once and never block readiness."""
+        self._steps.append((name, fn, required))
+        self.state[name] = {"status": "pending", "required": required}
+
+    def add_async(self, name, coro_fn, required=True):
+        """Step run on the app's event loop (anything holding asyncio resources, e.g. the asyncpg pool)."""
+        self._async_steps.append((name, coro_fn, required))
+        self.state[name] = {"status": "pending", "required": required}
+
+    def record_imports(self, boot_time):
+        self.boot_time = boot_time
+        self.import_seconds = round(time.perf_counter() - boot_time, 4)
+        metrics.startup_seconds.set(self.import_seconds, phase="import")
+
+    def start(self, loop=None):
+        self.started_at = time.perf_counter()
+        threading.Thread(target=self._run, name="warmup", daemon=True).start()
+        if self._async_steps:
+            loop = loop or asyncio.get_running_loop()
+            for name, coro_fn, required in self._async_steps:
+                loop.create_task(self._run_async(name, coro_fn, required))
+
+    def _begin(self, name):
+        with self._lock:
+            st = self.state[name]
+            st["status"] = "running"
+            st["attempts"] = st.get("attempts", 0) + 1
+        return time.perf_counter()
+
+    def _succeed(self, name, start):
+        seconds = round(time.perf_counter() - start, 4)
+        with self._lock:
+            self.state[name].update(status="ok", seconds=seconds, error=None)
+        metrics.startup_seconds.set(seconds, phase=name)
+        logger.info(f"Warm-up step {name}: {seconds}s.")
+        self._check_ready()
+
+    def _fail(self, name, e, required):
+        with self._lock:
+            self.state[name].update(status="retrying" if required else "failed", error=str(e))
+        metrics.errors.inc(component="warmup")
+        logger.error(f"Warm-up step {name} failed: {e}")
+
+    def _run(self):
+        for name, fn, required in self._steps:
+            while True:
+                start = self._begin(name)
+                try:
+                    fn()
+                except Exception as e:
+                    self._fail(name, e, required)
+                    if required:
+                        time.sleep(WARMUP_RETRY_SECONDS)
+                        continue
+                else:
+                    self._succeed(name, start)
+                break
+
+    async def _run_async(self, name, coro_fn, required):
+        while True:
+            start = self._begin(name)
+            try:
+                await coro_fn()
+            except Exception as e:
+                self._fail(name, e, required)
+                if required:
+                    await asyncio.sleep(WARMUP_RETRY_SECONDS)
+                    continue
+            else:
+                self._succeed(name, start)
+            return
+
+    @property
+    def ready(self):
+        return self.ready_at is not None
+
+    def _check_ready(self):
+        with self._lock:
+            if self.ready_at is not None:
+                return
+            if any(st["required"] and st["status"] != "ok" for st in self.state.values()):
+                return
+            self.ready_at = time.perf_counter()
+        warmup_seconds = round(self.ready_at - self.started_at, 4)
+        metrics.startup_seconds.set(warmup_seconds, phase="warmup")
+        if self.boot_time is not None:
+            metrics.startup_seconds.set(round(self.ready_at - self.boot_time, 4), phase="total")
+        logger.info(f"Ready: imports {self.import_seconds}s, warm-up {warmup_seconds}s.")
+
+    def report(self):
+        now = time.perf_counter()
+        with self._lock:
+            steps = {name: dict(st) for name, st in self.state.items()}
+        return {
+            "ready": self.ready,
+            "import_seconds": self.import_seconds,
+            "warmup_seconds": round((self.ready_at or now) - self.started_at, 4) if self.started_at else None,
+            "startup_seconds": round((self.ready_at or now) - self.boot_time, 4) if self.boot_time else None,
+            "steps": steps,
+        }
+
+
+warmup = Warmup()
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from core.models import ItemsBank, GenerationRun
+
+logger = logging.getLogger("WriteBehind")
+
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0"))
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000"))
+# Attempts per batch before it is written record by record; waits double from WRITE_BEHIND_RETRY_BACKOFF s
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "4"))
+WRITE_BEHIND_RETRY_BACKOFF = float(os.getenv("WRITE_BEHIND_RETRY_BACKOFF", "0.5"))
+# Records that cannot be written (queue full, DB down past the retries) are appended here as JSON lines, one file per process
+WRITE_BEHIND_DEAD_LETTER_DIR = os.getenv("WRITE_BEHIND_DEAD_LETTER_DIR", "data/write_behind_dead_letter")
+
+
+class WriteBehindQueue:
+    """Asynchronous persistence of generation results.
+
+    Request handlers only enqueue a record (no DB work on the request path);
+    a worker thread batches records into multi-row INSERTs on items_bank and
+    generation_runs every WRITE_BEHIND_FLUSH_INTERVAL seconds or
+    WRITE_BEHIND_BATCH_SIZE records. stop() drains the queue before returning.
+
+    A failed batch is retried with exponential backoff; after
+    WRITE_BEHIND_MAX_RETRIES attempts its records are written one by one and
+    the ones that still fail are spilled to a dead-letter JSONL file, as are
+    records that arrive while the queue is full. Nothing is lost silently.
+    """
+
+    def __init__(self, batch_size=WRITE_BEHIND_BATCH_SIZE, flush_interval=WRITE_BEHIND_FLUSH_INTERVAL, max_queue=WRITE_BEHIND_MAX_QUEUE,
+                 max_retries=WRITE_BEHIND_MAX_RETRIES, retry_backoff=WRITE_BEHIND_RETRY_BACKOFF, dead_letter_dir=WRITE_BEHIND_DEAD_LETTER_DIR):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.dead_letter_path = os.path.join(dead_letter_dir, f"{os.getpid()}.jsonl")
+        self._dead_letter_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._session_factory = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.retries = 0
+        self.dead_lettered = 0
+
+    def enqueue(self, run: dict, item: dict = None):
+        """run: generation_runs row; item: items_bank row or None (nothing to bank)."""
+        try:
+            self._queue.put_nowait((run, item))
+            self.enqueued += 1
+        except queue.Full:
+            # Never block a request on persistence; keep the record on disk instead
+            logger.warning("Write-behind queue full, spilling generation record to the dead-letter log.")
+            self._dead_letter([(run, item)], "queue full")
+
+    def _insert(self, batch):
+        runs = [run for run, _ in batch]
+        items = [item for _, item in batch if item is not None]
+        db = self._session_factory()
+        try:
+            # Items first: generation_runs.item_id points at them
+            if items:
+                # (form_id, form_slot) is unique: an item for a slot that is already
+                # filled is kept as a plain attempt (form_slot NULL) instead of failing the batch
+                stmt = pg_insert(ItemsBank.__table__).on_conflict_do_nothing(
+                    index_elements=["form_id", "form_slot"], index_where=ItemsBank.form_slot.isnot(None)
+                ).returning(ItemsBank.id)
+                inserted = set(db.execute(stmt, items).scalars().all())
+                clashed = [{**item, "form_slot": None} for item in items if item["id"] not in inserted]
+                if clashed:
+                    db.execute(insert(ItemsBank.__table__), clashed)
+            db.execute(insert(GenerationRun.__table__), runs)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write(self, batch):
+        for attempt in range(self.max_retries):
+            try:
+                self._insert(batch)
+                self.written += len(batch)
+                return
+            except Exception as e:
+                self.failed_batches += 1
+                logger.error(f"Write-behind flush of {len(batch)} records failed (attempt {attempt + 1}/{self.max_retries}): {e}")
+            if attempt + 1 < self.max_retries:
+                self.retries += 1
+                # Still wake up for stop(): shutdown goes straight to the per-record pass
+                self._stop.wait(self.retry_backoff * 2 ** attempt)
+        # One bad record must not sink the others
+        for record in batch:
+            try:
+                self._insert([record])
+                self.written += 1
+            except Exception as e:
+                self._dead_letter([record], str(e))
+
+    def _dead_letter(self, records, reason):
+        try:
+            with self._dead_letter_lock:
+                os.makedirs(os.path.dirname(self.dead_letter_path) or ".", exist_ok=True)
+                with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                    for run, item in records:
+                        f.write(json.dumps({"reason": reason, "run": run, "item": item}, ensure_ascii=False, default=str) + "\n")
+                self.dead_lettered += len(records)
+        except Exception as e:
+            self.dropped += len(records)
+            logger.error(f"Could not write {len(records)} records to {self.dead_letter_path}, dropping them: {e}")
+
+    def _drain(self, block_first=True):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if block_first and timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+        return len(batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._drain()
+        # Shutdown: flush whatever is left
+        while self._drain(block_first=False):
+            pass
+
+    def flush(self, timeout: float = 10.0):
+        """Blocks until every record enqueued so far is written (or timeout)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self._queue.unfinished_tasks == 0
+
+    def start(self, session_factory):
+        if self._thread is not None:
+            return
+        self._session_factory = session_factory
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        logger.info(f"Write-behind queue drained ({self.written} records written, {self._queue.qsize()} left).")
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "retries": self.retries,
+            "failed_batches": self.failed_batches,
+            "dead_lettered": self.dead_lettered,
+            "dead_letter_path": self.dead_letter_path,
+            "dropped": self.dropped,
+        }
+
+
+write_behind = WriteBehindQueue()
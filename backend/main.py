@@ -1,8 +1,31 @@
+import time
+_BOOT = time.perf_counter()  # before any other import: the startup report includes import time
+
 import os
-from fastapi import FastAPI
+import asyncio
+import logging
+from functools import partial
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from routers import generation, documents, etl
+import threading
+from routers import generation, documents, etl, items, forms
+from core import events, metrics, item_validator
+from core.database import SessionLocal, engine, get_async_engine, dispose_engines
+from core.embeddings import embed_text
+from core.generation_service import LLM_API_KEY, get_client
+from core.vector_index import similarity_index
+from core.skill_index import skill_index
+from core.distractor_retrieval import distractor_retriever
+from core.pgvector_indexes import vector_index_manager
+from core.context_packer import context_packer, load_encoding
+from core.item_pool import item_pool
+from core.write_behind import write_behind
+from core.warmup import warmup, warm_pool, warm_async_pool
+
+# The API process owns the logging setup (library modules only create loggers); the ETL CLI does its own
+logging.basicConfig(level=logging.INFO)
 
 # Create tables if they don't exist
 # Base.metadata.create_all(bind=engine)
@@ -15,14 +38,101 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # /documents pagination
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    timings, token = metrics.start_request_timings()
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.end_request_timings(token)
+    elapsed = time.perf_counter() - start
+    # Route template, not the raw path, to keep label cardinality bounded
+    route = request.scope.get("route")
+    metrics.http_request_seconds.observe(
+        elapsed, method=request.method, route=route.path if route else "unmatched", status=response.status_code
+    )
+    if metrics.METRICS_TIMING_HEADER:
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings, elapsed)
+    return response
+
 app.include_router(generation.router)
 app.include_router(documents.router)
 app.include_router(etl.router)
+app.include_router(items.router)
+app.include_router(forms.router)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Warm-up, in order: /readyz turns 200 once every step has run
+warmup.add("db_pool", partial(warm_pool, engine))
+warmup.add_async("async_db_pool", lambda: warm_async_pool(get_async_engine()))
+warmup.add("embedder", lambda: embed_text("warm-up"))
+# tiktoken may fetch its vocabulary over the network; do it here, not on the first prompt
+warmup.add("tokenizer", load_encoding, required=False)
+# Optional: databases created before the vector_indexes table fall back to the env settings
+warmup.add("vector_index_state", vector_index_manager.load_state, required=False)
+warmup.add("similarity_index", partial(similarity_index.load_or_build, SessionLocal))
+# Distractor precompute reads the refreshed skill index
+warmup.add("skill_index", partial(skill_index.refresh, SessionLocal))
+warmup.add("distractors", lambda: distractor_retriever.precompute(SessionLocal, skill_index.entries))
+# Imports the LLM SDK now rather than on the first generation; optional (no key in dev)
+warmup.add("llm_client", lambda: get_client() if LLM_API_KEY else None, required=False)
+warmup.record_imports(_BOOT)
+
+@app.on_event("startup")
+async def start_warmup():
+    # Order matters: distractor precompute reads the refreshed skill index
+    events.subscribe(events.ETL_COMMITTED, similarity_index.on_etl_commit(SessionLocal))
+    events.subscribe(events.ETL_COMMITTED, context_packer.on_etl_commit)
+    events.subscribe(events.ETL_COMMITTED, skill_index.on_etl_commit(SessionLocal))
+    events.subscribe(events.ETL_COMMITTED, distractor_retriever.on_etl_commit(SessionLocal, skill_index))
+    # Rebuild after bulk loads (debounced)
+    events.subscribe(events.ETL_COMMITTED, vector_index_manager.on_etl_commit(SessionLocal))
+    # Query SQL must follow indexes rebuilt by other workers or the CLI
+    events.subscribe(events.VECTOR_INDEX_REBUILT, vector_index_manager.on_index_rebuilt(SessionLocal))
+    warmup.start(loop=asyncio.get_running_loop())
+
+@app.on_event("startup")
+def start_background_workers():
+    write_behind.start(SessionLocal)
+    item_pool.start(SessionLocal)
+    # ETL commits made by other workers (or the ETL CLI) reach this worker's caches and indexes
+    events.remote_events.start(engine)
+    # Items banked before validation existed (or while it was off) get checked once
+    threading.Thread(target=item_validator.safe_backfill, args=(SessionLocal,), daemon=True).start()
+    # Indexes built on empty tables (or with other settings) are rebuilt once
+    threading.Thread(target=vector_index_manager.safe_maintain, args=(SessionLocal,), daemon=True).start()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    # Pool first (it produces records), then drain the write-behind queue, then close connections
+    events.remote_events.stop()
+    item_pool.stop()
+    write_behind.stop()
+    item_validator.shutdown()
+    vector_index_manager.shutdown()
+    await dispose_engines()
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/healthz", include_in_schema=False)
+def healthz():
+    """Liveness: the process is up and serving, warm or not."""
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+def readyz():
+    """Readiness: 200 once warm-up has finished, 503 with step progress until then."""
+    report = warmup.report()
+    return JSONResponse({"status": "ready" if report["ready"] else "warming", **report},
+                        status_code=200 if report["ready"] else 503)
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to ICFES RAG System API v2. Visit /static/index.html for UI."}
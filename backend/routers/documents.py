@@ -1,101 +1,311 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from core.database import get_db
+import json
+import uuid
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, text, case, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
+from core import events
+from core.database import get_async_db, AsyncSessionLocal
 from core.models import RagDocument
+from core.hashing import content_hash, minhash_signature, lsh_bands, estimated_jaccard
 from typing import List, Optional
 
+STREAM_BATCH_SIZE = 1000
+
 router = APIRouter(
     prefix="/documents",
     tags=["documents"]
 )
 
+SNIPPET_LENGTH = 200
+MAX_PAGE_SIZE = 5000
+
+def _list_query(doc_type=None, skill=None, source_file=None, after=None):
+    """Projection of the list columns only; the snippet is cut in SQL, so neither
+    the full content nor the embedding ever leaves the database."""
+    snippet = case(
+        (func.char_length(RagDocument.content) > SNIPPET_LENGTH,
+         func.left(RagDocument.content, SNIPPET_LENGTH) + "..."),
+        else_=RagDocument.content
+    ).label("snippet")
+    query = select(
+        RagDocument.id, RagDocument.doc_type, RagDocument.skill, RagDocument.topic,
+        RagDocument.difficulty_band, RagDocument.source_file, snippet
+    )
+    if doc_type:
+        query = query.where(RagDocument.doc_type == doc_type)
+    if skill:
+        query = query.where(RagDocument.skill == skill)
+    if source_file:
+        query = query.where(RagDocument.source_file == source_file)
+    if after:
+        # Keyset pagination: cost does not depend on how deep the page is
+        query = query.where(RagDocument.id > after)
+    return query.order_by(RagDocument.id)
+
+def _list_row(row):
+    return {
+        "id": str(row.id),
+        "doc_type": row.doc_type,
+        "skill": row.skill,
+        "topic": row.topic,
+        "difficulty_band": row.difficulty_band,
+        "source_file": row.source_file,
+        "snippet": row.snippet
+    }
+
+async def _stream_ndjson(doc_type, skill, source_file, after):
+    # Own session: the request-scoped one may be closed before streaming ends
+    async with AsyncSessionLocal() as db:
+        rows = await db.stream(
+            _list_query(doc_type, skill, source_file, after).execution_options(yield_per=STREAM_BATCH_SIZE)
+        )
+        async for row in rows:
+            yield json.dumps(_list_row(row), ensure_ascii=False) + "\n"
+
 @router.get("/")
-def get_documents(doc_type: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(RagDocument)
+async def get_documents(
+    response: Response,
+    doc_type: Optional[str] = None,
+    skill: Optional[str] = None,
+    source_file: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[uuid.UUID] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Lists documents, `limit` per page ordered by id.
+
+    The next page starts at the `X-Next-Cursor` response header (pass it as `after`).
+    `format=ndjson` streams every matching document through a server-side cursor
+    instead, for exports of any size.
+    """
+    if format == "ndjson":
+        return StreamingResponse(
+            _stream_ndjson(doc_type, skill, source_file, after),
+            media_type="application/x-ndjson"
+        )
+
+    rows = (await db.execute(_list_query(doc_type, skill, source_file, after).limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+    return [_list_row(row) for row in rows]
+
+@router.get("/count")
+async def count_documents(doc_type: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    query = select(func.count(RagDocument.id))
     if doc_type:
-        query = query.filter(RagDocument.doc_type == doc_type)
-    
-    # Limit content length for list view to avoid huge payload
-    documents = query.all()
-    
-    # We return a simplified version for the list
-    results = []
-    for doc in documents:
-        results.append({
-            "id": str(doc.id),
-            "doc_type": doc.doc_type,
-            "skill": doc.skill,
-            "topic": doc.topic,
-            "difficulty_band": doc.difficulty_band,
-            "source_file": doc.source_file,
-            "snippet": doc.content[:200] + "..." if len(doc.content) > 200 else doc.content
-        })
-    return results
+        query = query.where(RagDocument.doc_type == doc_type)
+    return {"doc_type": doc_type, "count": await db.scalar(query)}
 
 @router.get("/{doc_id}")
-def get_document_detail(doc_id: str, db: Session = Depends(get_db)):
-    doc = db.query(RagDocument).filter(RagDocument.id == doc_id).first()
+async def get_document_detail(doc_id: uuid.UUID, include_embedding: bool = False, db: AsyncSession = Depends(get_async_db)):
+    query = select(RagDocument).options(defer(RagDocument.minhash), defer(RagDocument.lsh_bands))
+    if not include_embedding:
+        query = query.options(defer(RagDocument.embedding))
+    doc = await db.scalar(query.where(RagDocument.id == doc_id))
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
-    return doc
+    detail = {
+        "id": str(doc.id),
+        "doc_type": doc.doc_type,
+        "exam": doc.exam,
+        "skill": doc.skill,
+        "topic": doc.topic,
+        "difficulty_band": doc.difficulty_band,
+        "content": doc.content,
+        "metadata": doc.metadata_,
+        "source_file": doc.source_file,
+        "content_hash": doc.content_hash
+    }
+    if include_embedding:
+        detail["embedding"] = doc.embedding
+    return detail
 
 @router.get("/duplicates/check")
-def check_duplicates(db: Session = Depends(get_db)):
-    """Finds documents with identical content."""
-    from sqlalchemy import func
-    
+async def check_duplicates(db: AsyncSession = Depends(get_async_db)):
+    """Finds documents with identical content (grouped on the indexed content_hash)."""
     # helper to find duplicates
-    subquery = db.query(
-        RagDocument.content,
+    subquery = select(
+        RagDocument.content_hash,
         func.count(RagDocument.id).label('count')
-    ).group_by(RagDocument.content).having(func.count(RagDocument.id) > 1).subquery()
+    ).where(RagDocument.content_hash.isnot(None)).group_by(RagDocument.content_hash).having(func.count(RagDocument.id) > 1).subquery()
     
-    duplicates = db.query(RagDocument).join(
-        subquery, RagDocument.content == subquery.c.content
-    ).order_by(RagDocument.content).all()
+    duplicates = (await db.execute(select(
+        RagDocument.id, RagDocument.doc_type, RagDocument.content_hash,
+        func.left(RagDocument.content, 50).label('preview')
+    ).join(
+        subquery, RagDocument.content_hash == subquery.c.content_hash
+    ).order_by(RagDocument.content_hash))).all()
     
-    # Group by content for response
+    # Group by content hash for response
     result = {}
     for doc in duplicates:
-        preview = doc.content[:50] + "..."
-        if preview not in result:
-            result[preview] = {"count": 0, "ids": [], "doc_type": doc.doc_type}
-        result[preview]["count"] += 1
-        result[preview]["ids"].append(str(doc.id))
+        if doc.content_hash not in result:
+            result[doc.content_hash] = {"count": 0, "ids": [], "doc_type": doc.doc_type, "preview": doc.preview + "..."}
+        result[doc.content_hash]["count"] += 1
+        result[doc.content_hash]["ids"].append(str(doc.id))
+
+    unindexed = await db.scalar(select(func.count(RagDocument.id)).where(RagDocument.content_hash.is_(None)))
         
-    return {"duplicate_groups": len(result), "total_duplicates_items": len(duplicates), "details": result}
+    return {
+        "duplicate_groups": len(result),
+        "total_duplicates_items": len(duplicates),
+        "unindexed_documents": unindexed, # run POST /documents/duplicates/reindex to include them
+        "details": result
+    }
+
+def _candidate_pairs(buckets):
+    candidate_pairs = set()
+    for (ids,) in buckets:
+        ids = sorted(ids, key=str)
+        for i in range(len(ids)):
+            for j in range(i + 1, len(ids)):
+                candidate_pairs.add((ids[i], ids[j]))
+    return candidate_pairs
+
+def _near_duplicate_groups(candidate_pairs, docs, threshold):
+    """Connected components of the candidate pairs whose estimated Jaccard is >= threshold."""
+    # Union-find over pairs above the threshold
+    parent = {}
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    scores = {}
+    for a, b in candidate_pairs:
+        score = estimated_jaccard(docs[a].minhash, docs[b].minhash)
+        if score >= threshold:
+            scores[(a, b)] = score
+            parent[find(a)] = find(b)
+
+    components = {}
+    for doc_id in parent:
+        components.setdefault(find(doc_id), []).append(doc_id)
+    min_scores = {}
+    for (a, _), score in scores.items():
+        root = find(a)
+        min_scores[root] = min(score, min_scores.get(root, score))
+
+    groups = []
+    for root, members in components.items():
+        groups.append({
+            "count": len(members),
+            "min_similarity": round(min_scores[root], 3),
+            "documents": [
+                {"id": str(m), "doc_type": docs[m].doc_type, "preview": docs[m].preview}
+                for m in sorted(members, key=str)
+            ]
+        })
+    groups.sort(key=lambda g: g["count"], reverse=True)
+    return groups
+
+@router.get("/duplicates/near")
+async def check_near_duplicates(threshold: float = Query(0.8, ge=0.0, le=1.0), doc_type: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    """Finds paraphrased documents via the MinHash/LSH signatures stored at ingest.
+
+    Candidates are documents sharing an LSH band key; a pair is kept when its
+    estimated Jaccard similarity (over character shingles) is >= threshold.
+    Groups are the connected components of the kept pairs.
+    """
+    band_filter = "AND doc_type = :doc_type" if doc_type else ""
+    buckets = (await db.execute(text(f"""
+        SELECT array_agg(id) AS ids
+        FROM (
+            SELECT id, unnest(lsh_bands) AS band
+            FROM rag_documents
+            WHERE lsh_bands IS NOT NULL {band_filter}
+        ) b
+        GROUP BY band
+        HAVING count(*) > 1
+    """), {"doc_type": doc_type})).all()
+
+    # Pair expansion and union-find are CPU-bound: keep them off the event loop
+    candidate_pairs = await run_in_threadpool(_candidate_pairs, buckets)
+    if not candidate_pairs:
+        return {"threshold": threshold, "near_duplicate_groups": 0, "groups": []}
+
+    candidate_ids = {doc_id for pair in candidate_pairs for doc_id in pair}
+    docs = {
+        row.id: row for row in (await db.execute(select(
+            RagDocument.id, RagDocument.doc_type, RagDocument.minhash,
+            func.left(RagDocument.content, 80).label('preview')
+        ).where(RagDocument.id.in_(candidate_ids)))).all()
+    }
+    groups = await run_in_threadpool(_near_duplicate_groups, candidate_pairs, docs, threshold)
+
+    return {"threshold": threshold, "near_duplicate_groups": len(groups), "groups": groups}
+
+def _signature_params(rows):
+    params = []
+    for doc_id, content in rows:
+        signature = minhash_signature(content)
+        params.append({
+            "id": doc_id,
+            "content_hash": content_hash(content),
+            "minhash": signature.tolist(),
+            "lsh_bands": lsh_bands(signature)
+        })
+    return params
+
+@router.post("/duplicates/reindex")
+async def reindex_duplicates(batch_size: int = Query(500, ge=1, le=5000), db: AsyncSession = Depends(get_async_db)):
+    """Backfills content_hash and MinHash/LSH columns for documents loaded before they existed."""
+    updated = 0
+    while True:
+        rows = (await db.execute(select(RagDocument.id, RagDocument.content).where(
+            (RagDocument.content_hash.is_(None)) | (RagDocument.minhash.is_(None))
+        ).limit(batch_size))).all()
+        if not rows:
+            break
+
+        # MinHash is CPU work; keep it off the event loop
+        params = await run_in_threadpool(_signature_params, rows)
+        await db.execute(text("""
+            UPDATE rag_documents
+            SET content_hash = :content_hash, minhash = :minhash, lsh_bands = :lsh_bands
+            WHERE id = :id
+        """), params)
+        await db.commit()
+        updated += len(params)
+
+    return {"reindexed_count": updated}
 
 @router.delete("/duplicates/clean")
-def clean_duplicates(db: Session = Depends(get_db)):
-    """Deletes all duplicates, keeping one instance per content group."""
-    from sqlalchemy import func
-    
-    # 1. Identify IDs to keep (e.g. min ID for each content group)
-    subquery = db.query(
-        func.min(RagDocument.id).label('keep_id'),
-        RagDocument.content
-    ).group_by(RagDocument.content).subquery()
-    
-    # 2. Find IDs that represent duplicates (NOT in the keep list)
-    # This is a bit complex in pure ORM delete, simpler to fetch IDs to delete
-    
-    # Get all IDs
-    all_docs = db.query(RagDocument.id, RagDocument.content).all()
-    seen = set()
-    to_delete = []
-    
-    for doc_id, content in all_docs:
-        # Use content hash or direct string
-        if content in seen:
-            to_delete.append(doc_id)
-        else:
-            seen.add(content)
-            
-    if not to_delete:
+async def clean_duplicates(db: AsyncSession = Depends(get_async_db)):
+    """Deletes all duplicates, keeping one instance per content group.
+
+    Works on content_hash in a single statement; the kept row is the one with
+    an ETL doc_key when there is one, so later re-uploads keep upserting it.
+    """
+    result = await db.execute(text("""
+        DELETE FROM rag_documents d
+        USING (
+            SELECT id, row_number() OVER (
+                PARTITION BY content_hash ORDER BY (doc_key IS NULL), id
+            ) AS rn
+            FROM rag_documents
+            WHERE content_hash IS NOT NULL
+        ) ranked
+        WHERE d.id = ranked.id AND ranked.rn > 1
+    """))
+    deleted = result.rowcount
+    if deleted:
+        # Other workers refresh too, once the deletion commits
+        await db.execute(events.NOTIFY_SQL, events.notify_params(events.ETL_COMMITTED, source_file=None, documents_changed=True))
+    await db.commit()
+
+    if deleted:
+        # Same listeners as an ETL commit: skill index, context packs, distractor cache
+        await run_in_threadpool(events.publish, events.ETL_COMMITTED, source_file=None, documents_changed=True)
+
+    if not deleted:
         return {"deleted_count": 0, "message": "No duplicates found"}
-        
-    # Delete them
-    db.query(RagDocument).filter(RagDocument.id.in_(to_delete)).delete(synchronize_session=False)
-    db.commit()
     
-    return {"deleted_count": len(to_delete), "message": f"Cleaned {len(to_delete)} duplicate documents."}
+    return {"deleted_count": deleted, "message": f"Cleaned {deleted} duplicate documents."}
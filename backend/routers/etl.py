@@ -1,38 +1,126 @@
 import shutil
 import os
 import tempfile
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from etl.etl_rag_builder import process_csv
+from typing import Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Query
+from core import jobs
+from core.database import SessionLocal
+from core.pgvector_indexes import vector_index_manager, TABLES, METHODS, QUANTIZATIONS
 
 router = APIRouter(
     prefix="/etl",
     tags=["etl"]
 )
 
+def run_csv_job(job_id: str, tmp_path: str, filename: str):
+    """Background task: chunked ETL over the saved upload, then cleanup."""
+    # The ETL (and pandas) is imported by the requests that use it, not at app startup
+    from etl.etl_rag_builder import process_csv_stream
+
+    jobs.start_job(job_id)
+    try:
+        result = process_csv_stream(tmp_path, source_filename=filename, job_id=job_id)
+        # "partial": some chunks failed and were skipped (see the job's errors)
+        status = {"error": "failed", "partial": "partial"}.get(result.get("status"), "succeeded")
+        jobs.finish_job(job_id, status, result)
+    except Exception as e:
+        jobs.add_error(job_id, str(e))
+        jobs.finish_job(job_id, "failed")
+    finally:
+        os.remove(tmp_path)
+
 @router.post("/upload_csv")
-async def upload_csv(file: UploadFile = File(...)):
+async def upload_csv(background_tasks: BackgroundTasks, file: UploadFile = File(...), stream: bool = False):
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Only .csv files are allowed.")
-    
+
     # Save to a temp file
     # We use a temp file in a location we know or just system temp
     # Since we are in docker, /tmp is fine.
-    
+
     try:
         with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp:
             shutil.copyfileobj(file.file, tmp)
             tmp_path = tmp.name
-            
+
+        if stream:
+            # Chunked ingestion in the background; poll /etl/jobs/{id} for progress
+            job = jobs.create_job("csv_ingestion", filename=file.filename)
+            background_tasks.add_task(run_csv_job, job["id"], tmp_path, file.filename)
+            return {"job_id": job["id"], "status": job["status"], "status_url": f"/etl/jobs/{job['id']}"}
+
         # Run ETL
+        from etl.etl_rag_builder import process_csv
         result = process_csv(tmp_path, source_filename=file.filename)
-        
+
         # Cleanup
         os.remove(tmp_path)
-        
+
         if result.get("status") == "error":
             raise HTTPException(status_code=500, detail=result.get("message"))
-            
+
         return result
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs")
+def get_jobs():
+    return jobs.list_jobs()
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def run_vector_index_job(job_id: str, force: bool, method: Optional[str], quantization: Optional[str], use_env: bool = False):
+    """Background task: rebuild the stale (or, with force, all) pgvector indexes."""
+    jobs.start_job(job_id)
+    try:
+        results = vector_index_manager.maintain(SessionLocal, force=force, method=method, quantization=quantization,
+                                                job_id=job_id, use_env=use_env)
+        failed = any("error" in r for r in results)
+        jobs.finish_job(job_id, "failed" if failed else "succeeded", {"tables": results})
+    except Exception as e:
+        jobs.add_error(job_id, str(e))
+        jobs.finish_job(job_id, "failed")
+
+@router.get("/vector-index")
+def get_vector_index_report():
+    """Rows, table and index size, index definition and last build settings per table."""
+    return vector_index_manager.report(SessionLocal)
+
+@router.get("/vector-index/recall")
+def get_vector_index_recall(
+    table: str = Query("rag_documents", pattern=f"^({'|'.join(TABLES)})$"),
+    sample: int = Query(20, ge=1, le=500),
+    k: int = Query(10, ge=1, le=100),
+    probes: Optional[int] = Query(None, ge=1)
+):
+    """recall@k of the ANN search against an exact scan, plus p50 latency of both."""
+    return vector_index_manager.measure_recall(SessionLocal, table=table, sample=sample, k=k, probes=probes)
+
+@router.post("/vector-index/rebuild")
+def rebuild_vector_index(
+    background_tasks: BackgroundTasks,
+    force: bool = False,
+    method: Optional[str] = Query(None, pattern=f"^({'|'.join(METHODS)})$"),
+    quantization: Optional[str] = Query(None, pattern=f"^({'|'.join(QUANTIZATIONS)})$"),
+    use_env: bool = False
+):
+    """Rebuilds the pgvector indexes in the background (CREATE INDEX CONCURRENTLY + swap).
+
+    Without `force` only stale indexes are rebuilt. `method`/`quantization`
+    override the env settings (implies force) and stay as the desired setting,
+    so later maintenance keeps them; `use_env=true` goes back to the env vars.
+    """
+    if use_env and (method or quantization):
+        raise HTTPException(status_code=400, detail="use_env cannot be combined with method/quantization")
+    force = force or use_env or bool(method or quantization)
+    job = jobs.create_job("vector_index_rebuild", force=force, method=method, quantization=quantization, use_env=use_env)
+    background_tasks.add_task(run_vector_index_job, job["id"], force, method, quantization, use_env)
+    return {"job_id": job["id"], "status": job["status"], "status_url": f"/etl/jobs/{job['id']}"}
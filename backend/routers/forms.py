@@ -0,0 +1,73 @@
+import uuid
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query
+from pydantic import BaseModel, Field
+from typing import Optional, List
+from core.database import SessionLocal
+from core.form_assembly import form_assembler
+from core import jobs
+
+router = APIRouter(
+    prefix="/forms",
+    tags=["forms"]
+)
+
+class BlueprintSection(BaseModel):
+    skill: str
+    difficulty: str
+    count: int = Field(..., ge=1, le=500)
+    topic: Optional[str] = None
+
+class Blueprint(BaseModel):
+    exam: str
+    name: Optional[str] = None
+    sections: List[BlueprintSection] = Field(..., min_length=1)
+
+def run_form_job(job_id: str, form_id: str):
+    """Background task: assemble (or resume) one form."""
+    jobs.start_job(job_id)
+    try:
+        result = form_assembler.assemble(SessionLocal, form_id, job_id=job_id)
+        jobs.finish_job(job_id, "succeeded" if result["status"] == "complete" else "incomplete", result)
+    except Exception as e:
+        jobs.add_error(job_id, str(e))
+        jobs.finish_job(job_id, "failed")
+
+def _start(background_tasks: BackgroundTasks, form_id: str, n_slots: int):
+    job = jobs.create_job("form_assembly", form_id=form_id, n_slots=n_slots)
+    background_tasks.add_task(run_form_job, job["id"], form_id)
+    return {"form_id": form_id, "n_slots": n_slots, "job_id": job["id"], "status_url": f"/etl/jobs/{job['id']}"}
+
+@router.post("/")
+def assemble_form(blueprint: Blueprint, background_tasks: BackgroundTasks):
+    """Creates a form from a blueprint and assembles it in the background.
+
+    Progress (filled slots, empty-slot errors) is at /etl/jobs/{job_id}; the
+    form and its items at /forms/{form_id}.
+    """
+    try:
+        form = form_assembler.create(SessionLocal, blueprint.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _start(background_tasks, form["id"], form["n_slots"])
+
+@router.post("/{form_id}/resume")
+def resume_form(form_id: uuid.UUID, background_tasks: BackgroundTasks):
+    """Fills the slots still empty after a crash or an incomplete run."""
+    form = form_assembler.get(SessionLocal, form_id)
+    if form is None:
+        raise HTTPException(status_code=404, detail="Form not found")
+    if form["assembling"]:
+        raise HTTPException(status_code=409, detail="Form is already being assembled")
+    return _start(background_tasks, form["id"], form["n_slots"])
+
+@router.get("/")
+def list_forms(limit: int = Query(50, ge=1, le=500)):
+    return form_assembler.list_forms(SessionLocal, limit=limit)
+
+@router.get("/{form_id}")
+def get_form(form_id: uuid.UUID):
+    """Form status and summary plus its accepted items in slot order."""
+    form = form_assembler.get(SessionLocal, form_id)
+    if form is None:
+        raise HTTPException(status_code=404, detail="Form not found")
+    return form
@@ -1,8 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from core.database import get_db
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+import os
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from core.database import get_async_db, SessionLocal
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List
+from core.models import SimilarityItem
+from core.embeddings import embed_texts
+from core.vector_index import similarity_index
+from core.skill_index import skill_index
+from core.distractor_retrieval import distractor_retriever
+from core.item_pool import item_pool
+from core.write_behind import write_behind
+from core.llm_scheduler import llm_scheduler
+from core import item_validator, jobs
+
+# Cosine score at or above which a candidate counts as a near copy of a restricted item
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.85"))
 
 router = APIRouter(
     prefix="/generation",
@@ -14,24 +31,225 @@ class GenerateRequest(BaseModel):
     skill: str
     difficulty: str
     topic: Optional[str] = None
-    n_items: int = 1
+    n_items: int = Field(1, ge=1, le=50)
+    max_concurrency: Optional[int] = Field(None, ge=1, le=32)
+    fresh: bool = False # skip the pre-generated pool and always call the LLM
 
 from core.generation_service import GenerationService
 
+def _use_pool(request: GenerateRequest) -> bool:
+    # Pool items are generated without a topic, so they cannot serve a topic request
+    return not request.fresh and not request.topic
+
+def _pooled_item(claimed):
+    return {**claimed["item"], "served_from_pool": True, "item_id": claimed["id"]}
+
+def _generate_fresh(request: GenerateRequest, missing: int):
+    """LLM path; blocking, so it runs in the threadpool on its own sync session."""
+    with SessionLocal() as db:
+        service = GenerationService(db)
+        if request.n_items > 1:
+            # Batch mode: items are generated concurrently from one shared context
+            return service.generate_items(
+                exam=request.exam,
+                skill=request.skill,
+                difficulty=request.difficulty,
+                n_items=missing,
+                max_concurrency=request.max_concurrency,
+                topic=request.topic
+            )
+        return service.generate_item(
+            exam=request.exam,
+            skill=request.skill,
+            difficulty=request.difficulty,
+            topic=request.topic
+        )
+
 @router.post("/generate")
-def generate_questions(request: GenerateRequest, db: Session = Depends(get_db)):
-    service = GenerationService(db)
-    result = service.generate_item(
-        exam=request.exam,
-        skill=request.skill,
-        difficulty=request.difficulty
+async def generate_questions(request: GenerateRequest, db: AsyncSession = Depends(get_async_db)):
+    # Serve ready items from the pre-generated pool first (milliseconds instead of an LLM call)
+    pooled = []
+    if _use_pool(request):
+        pooled = [_pooled_item(c) for c in await item_pool.claim_async(
+            db, request.exam, request.skill, request.difficulty, n=request.n_items
+        )]
+    missing = request.n_items - len(pooled)
+
+    if request.n_items > 1:
+        batch = {"n_items": 0, "n_succeeded": 0, "items": [], "errors": []}
+        if missing:
+            batch = await run_in_threadpool(_generate_fresh, request, missing)
+        return {
+            "n_items": request.n_items,
+            "n_succeeded": len(pooled) + batch["n_succeeded"],
+            "n_from_pool": len(pooled),
+            "items": pooled + batch["items"],
+            "errors": [{**e, "index": e["index"] + len(pooled)} for e in batch["errors"]]
+        }
+
+    if pooled:
+        return pooled[0]
+
+    return await run_in_threadpool(_generate_fresh, request, missing)
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+def _stream_events(request: GenerateRequest, pooled):
+    """Sync generator (Starlette iterates it in the threadpool): SSE frames for one item."""
+    yield _sse("start", {"exam": request.exam, "skill": request.skill, "difficulty": request.difficulty})
+    if pooled:
+        item = pooled[0]
+        for key in ("stimulus", "question_stem", "options", "correct_option"):
+            if key in item:
+                yield _sse("field", {"path": key, "value": item[key]})
+        yield _sse("item", {**item, "issues": []})
+    else:
+        with SessionLocal() as db:
+            for event, data in GenerationService(db).stream_item(request.exam, request.skill, request.difficulty, topic=request.topic):
+                yield _sse(event, data)
+    yield _sse("done", {})
+
+@router.post("/generate/stream")
+async def generate_question_stream(request: GenerateRequest, db: AsyncSession = Depends(get_async_db)):
+    """Server-Sent Events version of /generate for a single item.
+
+    Events: `start` right away, `token` for every LLM chunk, `field` as soon as
+    stimulus, question_stem or an option is complete (path like `options.A`),
+    `item` with the final object and its `issues`, then `done`.
+    """
+    pooled = []
+    if _use_pool(request):
+        pooled = [_pooled_item(c) for c in await item_pool.claim_async(
+            db, request.exam, request.skill, request.difficulty, n=1
+        )]
+    return StreamingResponse(
+        _stream_events(request, pooled),
+        media_type="text/event-stream",
+        # No proxy buffering, otherwise the first bytes wait for the whole item
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
-    return result
+
+@router.get("/pool")
+def pool_stats():
+    """Pool depth per (exam, skill, difficulty) and refill rate."""
+    return item_pool.stats()
+
+@router.get("/write-behind")
+def write_behind_stats():
+    """Persistence queue for generated items and generation_runs."""
+    return write_behind.stats()
+
+@router.get("/llm")
+def llm_scheduler_stats():
+    """LLM scheduler: budgets left, queue, in-flight calls, retries and circuit breaker state."""
+    return llm_scheduler.stats()
+
+@router.post("/pool/targets")
+def add_pool_target(exam: str, skill: str, difficulty: str):
+    """Starts keeping ready items for a key before anyone requests it."""
+    item_pool.pin(exam, skill, difficulty)
+    return {"tracked": True, "target_depth": item_pool.target_depth}
+
+@router.get("/skills/search")
+def search_skills(q: str, limit: int = Query(5, ge=1, le=50)):
+    """Ranked skill-card matches (exact > prefix > substring > fuzzy) from the in-memory index."""
+    return [
+        {k: v for k, v in match.items() if k not in ("content", "metadata")}
+        for match in skill_index.search(q, limit=limit)
+    ]
+
+@router.get("/skills/index")
+def skill_index_stats():
+    return skill_index.stats()
+
+@router.get("/distractors/stats")
+def distractor_stats():
+    return distractor_retriever.stats()
 
 @router.post("/validate")
 def validate_question(question: Dict[str, Any]):
-    return {"valid": True, "issues": []}
+    """Rule-based checks on one item; `valid` is false when any issue is an error."""
+    issues = item_validator.validate_item(question)
+    return {"valid": not item_validator.has_errors(issues), "issues": issues}
+
+class ValidateBatchRequest(BaseModel):
+    items: List[Dict[str, Any]] = Field(..., min_length=1, max_length=20000)
+
+@router.post("/validate/batch")
+async def validate_questions(request: ValidateBatchRequest):
+    """Validates many items at once (large batches run on a process pool). Results keep the input order."""
+    results = await run_in_threadpool(item_validator.validate_many, request.items)
+    report = [{"index": i, "valid": not item_validator.has_errors(issues), "issues": issues} for i, issues in enumerate(results)]
+    return {
+        "n_items": len(report),
+        "n_valid": sum(r["valid"] for r in report),
+        "results": report
+    }
+
+def run_validation_backfill(job_id: str, reject: bool = True):
+    jobs.start_job(job_id)
+    try:
+        jobs.finish_job(job_id, "succeeded", item_validator.backfill(SessionLocal, job_id=job_id, reject=reject))
+    except Exception as e:
+        jobs.add_error(job_id, str(e))
+        jobs.finish_job(job_id, "failed")
+
+@router.post("/validate/bank")
+def validate_bank(background_tasks: BackgroundTasks, reject: bool = True):
+    """Validates the items_bank rows that have no validation_issues yet; poll /etl/jobs/{id}.
+
+    reject=true moves drafts with errors to 'rejected'; false only records the issues.
+    """
+    job = jobs.create_job("items_validation")
+    background_tasks.add_task(run_validation_backfill, job["id"], reject)
+    return {"job_id": job["id"], "status": job["status"], "status_url": f"/etl/jobs/{job['id']}"}
+
+class SimilarityBatchRequest(BaseModel):
+    contents: List[str] = Field(..., min_length=1, max_length=1000)
+    k: int = Field(5, ge=1, le=50)
+
+def _search_similar(contents: List[str], k: int):
+    return similarity_index.search(embed_texts(contents), k=k)
+
+async def _similarity_report(db: AsyncSession, contents: List[str], k: int):
+    """Embeds the candidates and searches the in-process index over similarity_items."""
+    if not similarity_index.ready:
+        raise HTTPException(status_code=503, detail="Similarity index is still loading.")
+
+    # Embedding + search are numpy work; keep them off the event loop
+    results = await run_in_threadpool(_search_similar, contents, k)
+
+    # One query for the snippets of every match
+    hashes = {key for matches in results for key, _ in matches}
+    snippets = {}
+    if hashes:
+        snippets = dict((await db.execute(select(SimilarityItem.content_hash, SimilarityItem.content_snippet).where(
+            SimilarityItem.content_hash.in_(hashes)
+        ))).all())
+
+    reports = []
+    for matches in results:
+        max_similarity = matches[0][1] if matches else 0.0
+        reports.append({
+            "is_original": max_similarity < SIMILARITY_THRESHOLD,
+            "max_similarity": round(max_similarity, 4),
+            "matches": [
+                {"content_hash": key, "score": round(score, 4), "snippet": snippets.get(key)}
+                for key, score in matches
+            ]
+        })
+    return reports
 
 @router.post("/similarity-check")
-def check_similarity(content: str):
-    return {"is_original": True, "max_similarity": 0.05}
+async def check_similarity(content: str, k: int = Query(5, ge=1, le=50), db: AsyncSession = Depends(get_async_db)):
+    return (await _similarity_report(db, [content], k))[0]
+
+@router.post("/similarity-check/batch")
+async def check_similarity_batch(request: SimilarityBatchRequest, db: AsyncSession = Depends(get_async_db)):
+    reports = await _similarity_report(db, request.contents, request.k)
+    return {
+        "threshold": SIMILARITY_THRESHOLD,
+        "n_flagged": sum(1 for r in reports if not r["is_original"]),
+        "results": reports
+    }
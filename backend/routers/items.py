@@ -0,0 +1,67 @@
+import uuid
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from core.database import SessionLocal
+from core import item_export
+
+router = APIRouter(
+    prefix="/items",
+    tags=["items"]
+)
+
+@router.get("/export")
+def export_items(
+    format: str = Query("jsonl", pattern="^(jsonl|parquet)$"),
+    exam: Optional[str] = None,
+    skill: Optional[str] = None,
+    difficulty: Optional[str] = None,
+    status: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    form_id: Optional[uuid.UUID] = None,
+    since: Optional[str] = Query(None, pattern=r"^[\w.-]{1,64}$")
+):
+    """Streams items_bank as JSONL or Parquet (chunked, read through a server-side cursor).
+
+    `since=<name>` exports only rows newer than that consumer's watermark and
+    moves it forward once the whole file has been sent. The watermark is bound
+    to the filters of its first export, and `status` cannot be used with it.
+    """
+    try:
+        item_export.check_format(format)
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    if since:
+        # Checked before streaming starts, so the client gets a 400 and not a broken 200
+        filters = {"exam": exam, "skill": skill, "difficulty": difficulty, "status": status,
+                   "created_from": created_from, "created_to": created_to, "form_id": form_id}
+        with SessionLocal() as db:
+            try:
+                item_export.check_incremental(db, since, filters)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+    chunks = item_export.export(
+        format, since=since, exam=exam, skill=skill, difficulty=difficulty, status=status,
+        created_from=created_from, created_to=created_to, form_id=form_id
+    )
+    return StreamingResponse(
+        chunks,
+        media_type=item_export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="items_bank.{format}"'}
+    )
+
+@router.get("/export/watermarks")
+def get_export_watermarks():
+    """Incremental export consumers and the last row each one received."""
+    with SessionLocal() as db:
+        return item_export.list_watermarks(db)
+
+@router.delete("/export/watermarks/{name}")
+def reset_export_watermark(name: str):
+    """Forgets a consumer's watermark; its next `since` export starts from the beginning."""
+    with SessionLocal() as db:
+        if not item_export.delete_watermark(db, name):
+            raise HTTPException(status_code=404, detail="Watermark not found")
+    return {"deleted": name}
@@ -0,0 +1,85 @@
+from core.context_packer import ContextPacker, count_tokens
+
+CARD = {
+    "skill": "Argumentación",
+    "content": "\n".join([
+        "Skill: Argumentación",
+        "",
+        "Topics: Constitución, Participación ciudadana, Economía",
+        "",
+        "Common Misconceptions:",
+        "- Confundir opinión con argumento",
+        "- confundir  opinión con argumento",
+        "- Confundir una opinión con argumento",
+        "- Creer que toda fuente es confiable",
+        "",
+        "Required Steps:",
+        "- Identificar la tesis",
+        "- Evaluar la evidencia",
+    ]),
+    "metadata": {"misconception_counts": {"Creer que toda fuente es confiable": 5, "Confundir opinión con argumento": 2}},
+}
+PATTERNS = [
+    {"content": "Distractor Pattern: Generalización\n\nExamples of Logic:\n- Todos los casos son iguales\n- Siempre ocurre así"},
+    {"content": "Distractor Pattern: Falsa causa\n\nExamples of Logic:\n- Ocurrió después, luego es la causa"},
+]
+
+
+def _pack(budget, topic=None, distractors=PATTERNS):
+    return ContextPacker()._pack(CARD, distractors, topic, budget)
+
+
+def test_everything_fits_in_a_large_budget():
+    packed = _pack(10_000)
+    assert packed["dropped"] == {}
+    assert packed["tokens"] <= 10_000
+    assert packed["skill_card"].startswith("Skill: Argumentación")
+    assert "Pattern: Generalización\n  - Todos los casos son iguales\n  - Siempre ocurre así" in packed["distractors"]
+    assert "Pattern: Falsa causa" in packed["distractors"]
+
+
+def test_duplicates_are_dropped_and_counts_rank_first():
+    lines = _pack(10_000)["skill_card"].splitlines()
+    misconceptions = [l for l in lines[lines.index("Common Misconceptions:") + 1:lines.index("Required Steps:")] if l]
+    # Case/spacing duplicate and the near-duplicate paraphrase are gone; the most frequent comes first
+    assert misconceptions == ["- Creer que toda fuente es confiable", "- Confundir opinión con argumento"]
+
+
+def test_requested_topic_comes_first():
+    packed = _pack(10_000, topic="Economía")
+    assert "Topics: Economía, " in packed["skill_card"]
+
+
+def test_budget_is_respected_and_sections_share_it():
+    full = _pack(10_000)["tokens"]
+    budget = count_tokens("Skill: Argumentación") + (full - count_tokens("Skill: Argumentación")) // 2
+    packed = _pack(budget)
+    assert packed["tokens"] <= budget
+    assert sum(packed["dropped"].values()) > 0
+    # Round-robin: no section is starved while later ones are filled
+    assert "Topics:" in packed["skill_card"]
+    assert "Common Misconceptions:" in packed["skill_card"]
+    assert "Required Steps:" in packed["skill_card"]
+    assert "Pattern:" in packed["distractors"]
+
+
+def test_examples_only_follow_their_kept_pattern():
+    header = count_tokens("Skill: Argumentación")
+    packed = _pack(header)  # room for the header only
+    assert packed["distractors"] == ""
+    assert packed["skill_card"] == "Skill: Argumentación"
+    assert packed["dropped"]["examples"] == 3
+
+
+def test_no_card_and_no_distractors():
+    packed = ContextPacker()._pack(None, [], None, 100)
+    assert packed == {"skill_card": "Skill: ", "distractors": "", "tokens": count_tokens("Skill: "), "dropped": {}}
+
+
+def test_pack_caches_per_key_and_budget():
+    packer = ContextPacker(budget=500)
+    first = packer.pack(CARD, PATTERNS, cache_key="card-1")
+    assert packer.pack(CARD, [], cache_key="card-1") is first
+    assert packer.pack(CARD, PATTERNS, cache_key="card-1", budget=50) is not first
+    packer.clear()
+    assert packer.pack(CARD, [], cache_key="card-1") is not first
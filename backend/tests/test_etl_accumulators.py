@@ -0,0 +1,106 @@
+import io
+
+import pandas as pd
+
+from etl.etl_rag_builder import DistractorAccumulator, SkillAccumulator, melt_distractors
+
+CSV = """item_id,skill,topic,difficulty,required_steps,common_misconception,distractor_pattern_a,distractor_rationale_a,distractor_pattern_b,distractor_rationale_b
+1,Argumentación,Constitución,Media,Leer el texto,Confundir opinión con argumento,Lectura literal,Repite el texto,Generalización,Extiende el caso
+2,Argumentación,Constitución,Alta,Leer el texto,Confundir opinión con argumento,Lectura literal,Repite el texto,,Sin patrón
+3,Argumentación,Elecciones,Media,Comparar fuentes,Ignorar el contexto,Lectura literal,Copia una frase,Generalización,Extiende el caso
+4,Multiperspectivismo,Conflicto,Baja,Identificar actores,Tomar un solo punto de vista,Anacronismo,Usa ideas de otra época,Generalización,Toma un ejemplo por la regla
+5,,Sin skill,Media,Nada,Nada,Lectura literal,Fila sin skill,,
+6,Argumentación,Constitución,Media,Leer el texto,Confundir opinión con argumento,Lectura literal,Repite el texto,Generalización,Extiende el caso
+7,Argumentación,Constitución,Media,Leer el texto,Ignorar el contexto,Lectura literal,Parafrasea mal,Generalización,Extiende el caso
+"""
+
+
+def _frame():
+    return pd.read_csv(io.StringIO(CSV))
+
+
+def _chunks(size):
+    return pd.read_csv(io.StringIO(CSV), chunksize=size)
+
+
+def test_melt_is_row_major_and_drops_incomplete_pairs():
+    long_df = melt_distractors(_frame().head(2))
+    assert list(long_df.itertuples(index=False, name=None)) == [
+        ("Lectura literal", "Repite el texto"),
+        ("Generalización", "Extiende el caso"),
+        ("Lectura literal", "Repite el texto"),  # row 2, slot b has no pattern
+    ]
+
+
+def test_melt_skips_slots_without_both_columns():
+    df = pd.DataFrame({"distractor_pattern_a": ["P"], "distractor_rationale_a": ["R"], "distractor_pattern_c": ["Q"]})
+    assert list(melt_distractors(df).itertuples(index=False, name=None)) == [("P", "R")]
+    assert melt_distractors(pd.DataFrame({"skill": ["x"]})).empty
+
+
+def test_distractor_accumulator_keeps_first_unique_rationales_across_chunks():
+    accumulator = DistractorAccumulator(max_examples=2)
+    for chunk in _chunks(2):
+        accumulator.update(chunk)
+
+    assert list(accumulator.patterns) == ["Lectura literal", "Generalización", "Anacronismo"]
+    assert list(accumulator.patterns["Lectura literal"]) == ["Repite el texto", "Copia una frase"]  # capped at 2
+    assert list(accumulator.patterns["Generalización"]) == ["Extiende el caso", "Toma un ejemplo por la regla"]
+    name, content = next(accumulator.documents())
+    assert name == "Lectura literal"
+    assert content == "Distractor Pattern: Lectura literal\n\nExamples of Logic:\n- Repite el texto\n- Copia una frase"
+
+
+def test_distractor_accumulator_chunked_matches_whole_file():
+    whole = DistractorAccumulator()
+    whole.update(_frame())
+    chunked = DistractorAccumulator()
+    for chunk in _chunks(3):
+        chunked.update(chunk)
+    assert list(chunked.documents()) == list(whole.documents())
+
+
+def test_skill_accumulator_counts_values_and_skips_rows_without_skill():
+    accumulator = SkillAccumulator()
+    accumulator.update(_frame())
+
+    assert sorted(accumulator.skills) == ["Argumentación", "Multiperspectivismo"]
+    entry = accumulator.skills["Argumentación"]
+    assert entry["topics"] == {"Constitución": 4, "Elecciones": 1}
+    assert entry["difficulties"] == {"Media": 4, "Alta": 1}
+    assert entry["misconceptions"] == {"Confundir opinión con argumento": 3, "Ignorar el contexto": 2}
+    assert entry["sample_item_ids"] == [1, 2, 3, 6, 7]
+
+
+def test_skill_accumulator_chunked_matches_whole_file():
+    whole = SkillAccumulator()
+    whole.update(_frame())
+    chunked = SkillAccumulator()
+    for chunk in _chunks(2):
+        chunked.update(chunk)
+    assert list(chunked.documents()) == list(whole.documents())
+
+
+def test_skill_card_document_layout_and_metadata():
+    accumulator = SkillAccumulator()
+    accumulator.update(_frame())
+    skill, content, metadata = next(accumulator.documents())
+
+    assert skill == "Argumentación"
+    assert content == (
+        "Skill: Argumentación\n\nTopics: Constitución, Elecciones\n\n"
+        "Common Misconceptions:\n- Confundir opinión con argumento\n- Ignorar el contexto\n\n"
+        "Required Steps:\n- Leer el texto\n- Comparar fuentes"
+    )
+    assert metadata["misconception_counts"] == {"Confundir opinión con argumento": 3, "Ignorar el contexto": 2}
+    assert metadata["step_counts"] == {"Leer el texto": 4, "Comparar fuentes": 1}
+    assert metadata["sample_item_ids"] == [1, 2, 3, 6, 7]
+
+
+def test_sample_item_ids_stop_at_the_cap_across_chunks():
+    rows = "\n".join(f"{i},S,T,Media,P,M" for i in range(1, 9))
+    accumulator = SkillAccumulator()
+    for chunk in pd.read_csv(io.StringIO("item_id,skill,topic,difficulty,required_steps,common_misconception\n" + rows), chunksize=3):
+        accumulator.update(chunk)
+    assert accumulator.skills["S"]["sample_item_ids"] == [1, 2, 3, 4, 5]
+    assert accumulator.skills["S"]["topics"] == {"T": 8}
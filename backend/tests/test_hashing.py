@@ -0,0 +1,52 @@
+import numpy as np
+
+from core.hashing import (
+    LSH_BANDS, MINHASH_NUM_PERM, content_hash, estimated_jaccard, lsh_bands, minhash_signature, shingles,
+)
+
+TEXT = ("La Constitución Política de 1991 reconoce y protege la diversidad étnica y cultural "
+        "de la nación colombiana, y establece la participación ciudadana como principio.")
+PARAPHRASE = TEXT.replace("reconoce y protege", "reconoce y ampara")
+UNRELATED = "El área de un triángulo rectángulo es la mitad del producto de sus catetos."
+
+
+def _jaccard(a, b):
+    sa, sb = shingles(a), shingles(b)
+    return len(sa & sb) / len(sa | sb)
+
+
+def test_content_hash_ignores_whitespace_and_unicode_form():
+    decomposed = "Constitución  de\n1991 "
+    assert content_hash(decomposed) == content_hash("Constitución de 1991")
+    assert content_hash("a") != content_hash("b")
+
+
+def test_signature_is_deterministic():
+    sig = minhash_signature(TEXT)
+    assert sig.shape == (MINHASH_NUM_PERM,)
+    assert np.array_equal(sig, minhash_signature(TEXT))
+    assert estimated_jaccard(sig, minhash_signature(TEXT)) == 1.0
+
+
+def test_estimate_tracks_true_jaccard():
+    for other in (PARAPHRASE, UNRELATED):
+        estimate = estimated_jaccard(minhash_signature(TEXT), minhash_signature(other))
+        assert abs(estimate - _jaccard(TEXT, other)) < 0.15
+
+
+def test_near_duplicates_share_a_band_and_unrelated_texts_do_not():
+    bands = set(lsh_bands(minhash_signature(TEXT)))
+    assert len(bands) == LSH_BANDS
+    assert bands & set(lsh_bands(minhash_signature(PARAPHRASE)))
+    assert not bands & set(lsh_bands(minhash_signature(UNRELATED)))
+
+
+def test_case_and_spacing_do_not_change_the_signature():
+    assert np.array_equal(minhash_signature(TEXT), minhash_signature("  " + TEXT.upper().replace(" ", "   ")))
+
+
+def test_empty_text():
+    assert shingles("") == set()
+    empty = minhash_signature("")
+    assert np.array_equal(empty, minhash_signature("   "))
+    assert estimated_jaccard(empty, minhash_signature(TEXT)) == 0.0
@@ -0,0 +1,136 @@
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from core import item_export
+from core.item_export import check_incremental, export, export_query, watermark_filters
+
+T0 = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+NOW = datetime(2024, 5, 2, 12, 0, tzinfo=timezone.utc)
+
+
+def _row(minutes, **fields):
+    return SimpleNamespace(
+        id=uuid.UUID(int=minutes), exam="Sociales", skill="Argumentación", difficulty="Media", status="draft",
+        created_at=T0 + timedelta(minutes=minutes), served_at=None, validation_issues=[],
+        question_content={"question_stem": f"Pregunta {minutes}"}, **fields,
+    )
+
+
+class FakeResult(list):
+    def first(self):
+        return self[0] if self else None
+
+    def scalar(self):
+        return self[0]
+
+    def close(self):
+        pass
+
+
+class FakeDB:
+    """Answers the statements export() runs; records the item query and watermark writes."""
+
+    def __init__(self, rows=(), watermark=None, filters=None):
+        self.rows = list(rows)
+        self.watermark = watermark
+        self.filters = filters
+        self.queries = []
+        self.watermark_writes = []
+        self.commits = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        sql = str(statement)
+        if "SELECT filters FROM export_watermarks" in sql:
+            return FakeResult([SimpleNamespace(filters=self.filters)] if self.watermark else [])
+        if "SELECT last_created_at, last_id FROM export_watermarks" in sql:
+            return FakeResult([SimpleNamespace(last_created_at=self.watermark[0], last_id=self.watermark[1])] if self.watermark else [])
+        if "make_interval" in sql:
+            return FakeResult([NOW - timedelta(seconds=params["s"])])
+        if "INSERT INTO export_watermarks" in sql:
+            self.watermark_writes.append(params)
+            return FakeResult()
+        self.queries.append(statement.compile(dialect=postgresql.dialect()))
+        return FakeResult(self.rows)
+
+    def commit(self):
+        self.commits += 1
+
+
+def _jsonl(chunks):
+    return [json.loads(line) for line in b"".join(chunks).decode("utf-8").splitlines()]
+
+
+def test_watermark_filters_are_normalized():
+    assert watermark_filters({"skill": "Argumentación", "exam": None, "created_from": T0, "form_id": uuid.UUID(int=1)}) == {
+        "created_from": T0.isoformat(), "form_id": str(uuid.UUID(int=1)), "skill": "Argumentación",
+    }
+
+
+def test_since_rejects_mutable_filters():
+    with pytest.raises(ValueError, match="status"):
+        check_incremental(FakeDB(), "nightly", {"status": "draft"})
+
+
+def test_since_rejects_a_watermark_created_with_other_filters():
+    db = FakeDB(watermark=(T0, uuid.UUID(int=1)), filters={"exam": "Sociales"})
+    with pytest.raises(ValueError, match="nightly"):
+        check_incremental(db, "nightly", {"exam": "Matemáticas"})
+    check_incremental(db, "nightly", {"exam": "Sociales", "skill": None})  # same filters
+
+
+def test_legacy_watermark_and_new_names_accept_any_filters():
+    check_incremental(FakeDB(watermark=(T0, uuid.UUID(int=1)), filters=None), "old", {"exam": "Sociales"})
+    check_incremental(FakeDB(), "new", {"exam": "Sociales"})
+
+
+def test_export_query_resumes_after_the_watermark_and_stops_at_the_settle_window():
+    compiled = export_query(exam="Sociales", after=(T0, uuid.UUID(int=7)), until=NOW).compile(dialect=postgresql.dialect())
+    sql = str(compiled)
+    assert "(items_bank.created_at, items_bank.id) > (" in sql
+    assert sql.rstrip().endswith("ORDER BY items_bank.created_at, items_bank.id")
+    assert set(compiled.params.values()) >= {"Sociales", T0, uuid.UUID(int=7), NOW}
+
+
+def test_incremental_export_moves_the_watermark_to_the_last_row():
+    rows = [_row(1), _row(2), _row(3)]
+    db = FakeDB(rows=rows, watermark=(T0, uuid.UUID(int=0)), filters={"exam": "Sociales"})
+    report = {}
+    records = _jsonl(export("jsonl", since="nightly", batch_size=2, session_factory=lambda: db, report=report, exam="Sociales"))
+
+    assert [r["id"] for r in records] == [str(r.id) for r in rows]
+    params = db.queries[0].params
+    # Rows newer than NOW() - EXPORT_SETTLE_SECONDS may still be in the write-behind queue
+    assert NOW - timedelta(seconds=item_export.EXPORT_SETTLE_SECONDS) in params.values()
+    assert uuid.UUID(int=0) in params.values()  # resumes after the stored watermark
+
+    (write,) = db.watermark_writes
+    assert (write["created_at"], write["id"], write["rows"]) == (rows[-1].created_at, rows[-1].id, 3)
+    assert json.loads(write["filters"]) == {"exam": "Sociales"}
+    assert report["watermark"] == {"created_at": rows[-1].created_at.isoformat(), "id": str(rows[-1].id)}
+
+
+def test_interrupted_export_leaves_the_watermark_alone():
+    db = FakeDB(rows=[_row(1), _row(2), _row(3)])
+    chunks = export("jsonl", since="nightly", batch_size=1, session_factory=lambda: db)
+    next(chunks)
+    chunks.close()  # client went away after the first chunk
+    assert db.watermark_writes == []
+    assert db.commits == 0
+
+
+def test_export_without_since_has_no_settle_window_or_watermark():
+    db = FakeDB(rows=[_row(1)])
+    assert len(_jsonl(export("jsonl", session_factory=lambda: db))) == 1
+    assert NOW - timedelta(seconds=item_export.EXPORT_SETTLE_SECONDS) not in db.queries[0].params.values()
+    assert db.watermark_writes == []
@@ -0,0 +1,95 @@
+import copy
+
+from core.item_validator import ERROR, WARNING, has_errors, validate_item, validate_many
+
+GOOD = {
+    "stimulus": "En 1991 Colombia adoptó una nueva Constitución que amplió los mecanismos de participación.",
+    "question_stem": "¿Qué buscaba principalmente la nueva Constitución?",
+    "options": {
+        "A": "Ampliar la participación ciudadana",
+        "B": "Restringir el voto a los propietarios",
+        "C": "Eliminar la separación de poderes",
+        "D": "Centralizar todo el gasto público",
+    },
+    "correct_option": "A",
+    "rationale": "El texto menciona los mecanismos de participación.",
+    "distractor_rationales": {"B": "No se menciona.", "C": "Contradice el texto.", "D": "No se menciona."},
+}
+
+
+def _item(**changes):
+    item = copy.deepcopy(GOOD)
+    for key, value in changes.items():
+        if value is None:
+            item.pop(key, None)
+        else:
+            item[key] = value
+    return item
+
+
+def _codes(issues, severity=None):
+    return {i["code"] for i in issues if severity is None or i["severity"] == severity}
+
+
+def test_well_formed_item_has_no_issues():
+    assert validate_item(GOOD) == []
+
+
+def test_not_an_object():
+    assert _codes(validate_item("texto")) == {"not_an_object"}
+
+
+def test_missing_fields_are_errors():
+    issues = validate_item(_item(stimulus=None, correct_option=None))
+    assert has_errors(issues)
+    assert {i["field"] for i in issues if i["code"] == "missing_field"} == {"stimulus", "correct_option"}
+
+
+def test_option_problems():
+    options = dict(GOOD["options"], C="  ", D="ampliar la participación, ciudadana!", E="Otra")
+    codes = _codes(validate_item(_item(options=options)), ERROR)
+    assert {"empty_option", "duplicate_option", "unexpected_option"} <= codes
+    assert "missing_option" in _codes(validate_item(_item(options={"A": "x", "B": "y", "C": "z"})), ERROR)
+    assert "invalid_options" in _codes(validate_item(_item(options=["A", "B"])), ERROR)
+
+
+def test_correct_option_must_be_a_present_key():
+    assert "invalid_correct_option" in _codes(validate_item(_item(correct_option="E")), ERROR)
+    assert validate_item(_item(correct_option=" a ")) == []
+
+
+def test_answer_leaked_into_stem():
+    leak = _item(question_stem="¿Por qué la Constitución buscaba ampliar la participación ciudadana?")
+    assert "answer_in_stem" in _codes(validate_item(leak), ERROR)
+
+
+def test_length_cues_are_warnings():
+    options = dict(GOOD["options"], A=GOOD["options"]["A"] + ", fortalecer la descentralización territorial y proteger los derechos fundamentales")
+    issues = validate_item(_item(options=options))
+    assert {"unbalanced_options", "longest_is_correct"} <= _codes(issues, WARNING)
+    assert not has_errors(issues)
+
+
+def test_missing_distractor_rationale_by_letter_is_an_error():
+    issues = validate_item(_item(distractor_rationales={"B": "No se menciona.", "C": "Contradice el texto."}))
+    assert [(i["code"], i["severity"]) for i in issues] == [("missing_distractor_rationale", ERROR)]
+    assert "D" in issues[0]["message"]
+
+
+def test_legacy_rationale_keys_are_only_counted_as_a_warning():
+    legacy = _item(distractor_rationales={"wrong_option_1": "No se menciona.", "wrong_option_2": "Contradice el texto."})
+    issues = validate_item(legacy)
+    assert [(i["code"], i["severity"]) for i in issues] == [("missing_distractor_rationale", WARNING)]
+    assert not has_errors(issues)
+    legacy["distractor_rationales"]["wrong_option_3"] = "No se menciona."
+    assert validate_item(legacy) == []
+
+
+def test_missing_rationale_is_a_warning():
+    issues = validate_item(_item(rationale=" "))
+    assert _codes(issues) == {"missing_rationale"} and not has_errors(issues)
+
+
+def test_validate_many_matches_validate_item_inline():
+    items = [GOOD, _item(correct_option="E"), "texto"]
+    assert validate_many(items, parallel=False) == [validate_item(item) for item in items]
@@ -0,0 +1,62 @@
+import json
+
+from core.json_stream import IncrementalJSONParser
+
+ITEM = {
+    "stimulus": "Texto con \"comillas\", llaves {} y corchetes [] dentro de una cadena.",
+    "question_stem": "¿Cuál es la idea principal?",
+    "options": {"A": "Uno", "B": "Dos", "C": "Tres", "D": "Cuatro"},
+    "correct_option": "B",
+    "difficulty_score": 0.75,
+    "verified": True,
+    "tags": ["lectura", None],
+}
+
+
+def _feed_all(parser, text, size):
+    events = []
+    for start in range(0, len(text), size):
+        events.extend(parser.feed(text[start:start + size]))
+    return events
+
+
+def test_every_chunking_yields_the_same_events():
+    text = json.dumps(ITEM, ensure_ascii=False)
+    expected = _feed_all(IncrementalJSONParser(), text, len(text))
+    for size in (1, 2, 3, 7, 64):
+        assert _feed_all(IncrementalJSONParser(), text, size) == expected
+
+
+def test_fields_are_reported_as_they_complete():
+    parser = IncrementalJSONParser()
+    text = json.dumps(ITEM, ensure_ascii=False)
+    cut = text.index('"options"')
+    first = dict(parser.feed(text[:cut]))
+    assert first == {("stimulus",): ITEM["stimulus"], ("question_stem",): ITEM["question_stem"]}
+    rest = parser.feed(text[cut:])
+    assert (("options", "A"), "Uno") in rest
+    assert (("options",), ITEM["options"]) in rest
+    assert (("difficulty_score",), 0.75) in rest
+    assert (("verified",), True) in rest
+    assert (("tags", 1), None) in rest
+    assert rest[-1] == ((), ITEM)
+    assert parser.done and parser.root == ITEM
+
+
+def test_preamble_and_trailing_text_are_ignored():
+    parser = IncrementalJSONParser()
+    events = parser.feed('Aquí está el ítem:\n```json\n{"a": 1}\n```\nEspero que sirva.')
+    assert events == [(("a",), 1), ((), {"a": 1})]
+    assert parser.feed('{"b": 2}') == []
+
+
+def test_max_depth_limits_reported_paths():
+    parser = IncrementalJSONParser(max_depth=1)
+    events = parser.feed('{"options": {"A": "x"}, "n": [1, 2]}')
+    assert [path for path, _ in events] == [("options",), ("n",), ()]
+
+
+def test_incomplete_document_has_no_root():
+    parser = IncrementalJSONParser()
+    parser.feed('{"stimulus": "abc", "options": {"A": "x"')
+    assert parser.root is None and not parser.done
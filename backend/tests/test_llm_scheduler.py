@@ -0,0 +1,176 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from core.llm_scheduler import (
+    PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, CircuitBreaker, CircuitOpenError, LLMScheduler, TokenBucket, _retry_after,
+)
+
+
+class Clock:
+    def __init__(self, t=1000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+    def advance(self, seconds):
+        self.t += seconds
+
+
+def _rate_limited(headers):
+    request = httpx.Request("POST", "https://llm.test/v1/chat/completions")
+    return openai.RateLimitError("rate limited", response=httpx.Response(429, headers=headers, request=request), body=None)
+
+
+class FakeClient:
+    """client.chat.completions.with_raw_response.create(); raises the queued errors first."""
+
+    def __init__(self, errors=(), headers=None, total_tokens=100):
+        self.errors = list(errors)
+        self.headers = headers or {}
+        self.total_tokens = total_tokens
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(with_raw_response=SimpleNamespace(create=self._create)))
+
+    def _create(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        response = SimpleNamespace(usage=SimpleNamespace(total_tokens=self.total_tokens))
+        return SimpleNamespace(headers=self.headers, parse=lambda: response)
+
+
+MESSAGES = [{"role": "user", "content": "hola"}]
+
+
+def test_token_bucket_refills_at_its_rate():
+    clock = Clock()
+    bucket = TokenBucket(60, clock)  # 1 per second
+    bucket.take(60)
+    assert bucket.wait_time(1, clock()) == pytest.approx(1.0)
+    clock.advance(0.5)
+    assert bucket.wait_time(1, clock()) == pytest.approx(0.5)
+    clock.advance(120)
+    assert bucket.wait_time(60, clock()) == 0.0
+    assert bucket.level == 60  # never above capacity
+
+
+def test_breaker_opens_after_consecutive_failures_and_probes_after_cooldown():
+    clock = Clock()
+    breaker = CircuitBreaker(failures=3, cooldown=30, clock=clock)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.advance(30)
+    breaker.before_call()  # the probe
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # one probe at a time
+    breaker.success()
+    assert breaker.state == "closed"
+    assert breaker.trips == 1
+
+
+def test_failed_probe_reopens_the_breaker():
+    clock = Clock()
+    breaker = CircuitBreaker(failures=1, cooldown=10, clock=clock)
+    breaker.before_call()
+    breaker.failure()
+    clock.advance(10)
+    breaker.before_call()
+    breaker.failure()
+    assert breaker.state == "open"
+    clock.advance(5)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_retry_after_prefers_milliseconds_header():
+    assert _retry_after(_rate_limited({"retry-after-ms": "1500", "retry-after": "9"})) == pytest.approx(1.5)
+    assert _retry_after(_rate_limited({"retry-after": "2"})) == 2.0
+    assert _retry_after(_rate_limited({"retry-after": "soon"})) is None
+    assert _retry_after(ValueError("no response")) is None
+
+
+def test_budget_is_split_across_workers():
+    scheduler = LLMScheduler(rpm=30, tpm=12000, workers=3, clock=Clock())
+    assert scheduler.requests.capacity == 10
+    assert scheduler.tokens.capacity == 4000
+
+
+def test_provider_headers_cap_the_buckets_before_the_next_reservation():
+    clock = Clock()
+    scheduler = LLMScheduler(rpm=60, tpm=60000, clock=clock, sleep=lambda s: None)
+    client = FakeClient(headers={"x-ratelimit-remaining-requests": "0", "x-ratelimit-remaining-tokens": "500"})
+    scheduler.chat(client, messages=MESSAGES)
+
+    with scheduler._cond:
+        scheduler._apply_provider_caps(clock())
+        # Other workers used the key: no request left until the bucket refills (1/s)
+        assert scheduler._wait_time(1, clock()) == pytest.approx(1.0)
+        assert scheduler.tokens.level <= 500
+
+
+def test_rate_limit_pauses_the_queue_and_retries_after_retry_after():
+    clock = Clock()
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock.advance(seconds)
+
+    scheduler = LLMScheduler(rpm=60, tpm=60000, clock=clock, sleep=sleep)
+    client = FakeClient(errors=[_rate_limited({"retry-after": "2"})])
+    scheduler.chat(client, messages=MESSAGES)
+
+    assert client.calls == 2
+    assert sleeps[0] >= 2.0
+    assert scheduler.paused_until == pytest.approx(1002.0)
+    stats = scheduler.stats()
+    assert (stats["rate_limited"], stats["retries"], stats["succeeded"], stats["failed"]) == (1, 1, 1, 0)
+    assert stats["in_flight"] == 0
+    assert scheduler.breaker.state == "closed"  # a 429 is a budget signal, not an outage
+
+
+def test_open_breaker_fails_fast_without_calling_the_provider():
+    scheduler = LLMScheduler(clock=Clock())
+    scheduler.breaker = CircuitBreaker(failures=1, cooldown=30, clock=scheduler.clock)
+    scheduler.breaker.failure()
+    client = FakeClient()
+    with pytest.raises(CircuitOpenError):
+        scheduler.chat(client, messages=MESSAGES)
+    assert client.calls == 0
+    assert scheduler.stats()["rejected_open"] == 1
+
+
+def test_waiting_calls_are_admitted_by_priority():
+    scheduler = LLMScheduler(rpm=600, tpm=600000, max_in_flight=1, clock=Clock())
+    scheduler._admit(10, PRIORITY_INTERACTIVE)  # holds the only slot
+    admitted = []
+
+    def wait_for_slot(priority):
+        scheduler._admit(10, priority)
+        admitted.append(priority)
+        scheduler._release()
+
+    threads = [threading.Thread(target=wait_for_slot, args=(p,)) for p in (PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE)]
+    threads[0].start()
+    while len(scheduler._waiting) < 1:
+        time.sleep(0.001)
+    threads[1].start()
+    while len(scheduler._waiting) < 2:
+        time.sleep(0.001)
+
+    scheduler._release()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert admitted == [PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND]
@@ -0,0 +1,92 @@
+import json
+import struct
+import uuid
+
+import numpy as np
+import pytest
+
+from core.embeddings import from_pgvector_binary
+from core.pg_copy import HEADER, TRAILER, encode_rows, vector_binary
+
+
+def _tuples(payload):
+    """Splits a binary COPY payload into tuples of raw field bytes (None for NULL)."""
+    assert payload.startswith(HEADER) and payload.endswith(TRAILER)
+    body, pos, rows = payload[len(HEADER):-len(TRAILER)], 0, []
+    while pos < len(body):
+        (count,), pos = struct.unpack_from("!h", body, pos), pos + 2
+        fields = []
+        for _ in range(count):
+            (size,), pos = struct.unpack_from("!i", body, pos), pos + 4
+            if size == -1:
+                fields.append(None)
+            else:
+                fields.append(body[pos:pos + size])
+                pos += size
+        rows.append(fields)
+    return rows
+
+
+def _array(data):
+    ndim, has_nulls, oid = struct.unpack_from("!iii", data)
+    if ndim == 0:
+        return oid, []
+    length, lower = struct.unpack_from("!ii", data, 12)
+    assert (ndim, lower) == (1, 1)
+    pos, values = 20, []
+    for _ in range(length):
+        (size,) = struct.unpack_from("!i", data, pos)
+        pos += 4
+        if size == -1:
+            values.append(None)
+        else:
+            values.append(data[pos:pos + size])
+            pos += size
+    assert bool(has_nulls) == (None in values)
+    return oid, values
+
+
+def test_empty_payload_is_header_and_trailer():
+    assert encode_rows([], ["text"]) == HEADER + TRAILER
+    assert HEADER == b"PGCOPY\n\xff\r\n\x00" + b"\x00" * 8
+
+
+def test_scalar_fields():
+    doc_id = uuid.uuid4()
+    rows = _tuples(encode_rows(
+        [("Argumentación", {"skill": "Lectura", "n": 2}, doc_id, -5), (None, '{"a": 1}', str(doc_id), 2 ** 40)],
+        ["text", "jsonb", "uuid", "int8"],
+    ))
+    assert len(rows) == 2
+    text, jsonb, raw_uuid, int8 = rows[0]
+    assert text.decode("utf-8") == "Argumentación"
+    assert jsonb[0] == 1 and json.loads(jsonb[1:]) == {"skill": "Lectura", "n": 2}
+    assert uuid.UUID(bytes=raw_uuid) == doc_id
+    assert struct.unpack("!q", int8) == (-5,)
+    assert rows[1][0] is None
+    assert rows[1][1] == b'\x01{"a": 1}'
+    assert rows[1][2] == doc_id.bytes
+    assert struct.unpack("!q", rows[1][3]) == (2 ** 40,)
+
+
+def test_arrays():
+    (ints, texts, empty), = _tuples(encode_rows([([1, -2], ["0:ab", None], [])], ["int8[]", "text[]", "text[]"]))
+    oid, values = _array(ints)
+    assert oid == 20 and [struct.unpack("!q", v)[0] for v in values] == [1, -2]
+    oid, values = _array(texts)
+    assert oid == 25 and values == [b"0:ab", None]
+    assert _array(empty) == (25, [])
+
+
+def test_vector_matches_pgvector_wire_format():
+    vec = np.array([0.5, -1.25, 3.0], dtype=np.float32)
+    data = vector_binary(vec)
+    assert struct.unpack_from("!hh", data) == (3, 0)
+    assert np.array_equal(from_pgvector_binary(data), vec)
+    (field,), = _tuples(encode_rows([(vec,)], ["vector"]))
+    assert field == data
+
+
+def test_unknown_kind():
+    with pytest.raises(KeyError):
+        encode_rows([(1,)], ["float4"])
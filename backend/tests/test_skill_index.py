@@ -0,0 +1,95 @@
+import threading
+
+from core.skill_index import FUZZY_MIN_SCORE, MATCH_SCORES, SkillCardIndex, normalize_skill
+
+SKILLS = [
+    "Argumentación", "Argumentación en textos", "Contraargumentación", "Argumentar",
+    "Multiperspectivismo", "Pensamiento sistémico",
+]
+
+
+def _index(skills=SKILLS):
+    index = SkillCardIndex()
+    index.load([(n, skill, f"Skill: {skill}", "skills.csv", None) for n, skill in enumerate(skills)])
+    return index
+
+
+def _matches(results):
+    return [(r["skill"], r["match"]) for r in results]
+
+
+def test_normalize_skill_drops_case_accents_and_spacing():
+    assert normalize_skill("  Pensamiento   SISTÉMICO ") == "pensamiento sistemico"
+    assert normalize_skill(None) == ""
+
+
+def test_ranking_is_exact_then_prefix_then_substring_then_fuzzy():
+    results = _index().search("ARGUMENTACIÓN", limit=10)
+    assert _matches(results) == [
+        ("Argumentación", "exact"),
+        ("Argumentación en textos", "prefix"),
+        ("Contraargumentación", "substring"),
+        ("Argumentar", "fuzzy"),
+    ]
+    scores = [r["score"] for r in results]
+    assert scores[:3] == [MATCH_SCORES["exact"], MATCH_SCORES["prefix"], MATCH_SCORES["substring"]]
+    assert FUZZY_MIN_SCORE * MATCH_SCORES["substring"] <= scores[3] < MATCH_SCORES["substring"]
+
+
+def test_limit_and_best_keep_the_top_ranked_card():
+    index = _index()
+    assert _matches(index.search("argumentacion", limit=2)) == [("Argumentación", "exact"), ("Argumentación en textos", "prefix")]
+    assert index.best("argumentacion")["skill"] == "Argumentación"
+    assert index.best("zzz") is None
+
+
+def test_ties_break_on_normalized_name():
+    index = _index(["Lectura crítica", "Lectura inferencial", "Lectura literal"])
+    assert [r["skill"] for r in index.search("lectura", limit=5)] == ["Lectura crítica", "Lectura inferencial", "Lectura literal"]
+
+
+def test_short_queries_find_substrings_inside_words():
+    # "rg" shares no padded trigram with "argumentacion"; only the plain scan finds it
+    results = _index().search("rg", limit=10)
+    assert {skill for skill, match in _matches(results) if match == "substring"} == {
+        "Argumentación", "Argumentación en textos", "Contraargumentación", "Argumentar",
+    }
+    assert _matches(_index().search("mu")) == [("Multiperspectivismo", "prefix")]
+
+
+def test_repeated_queries_are_served_from_the_cache():
+    index = _index()
+    first = index.search("sistemico")
+    assert index.search("Sistémico") is first
+    counters = index.stats()["counters"]
+    assert (counters["cache_misses"], counters["cache_hits"], counters["substring"]) == (1, 1, 1)
+
+
+def test_reload_swaps_the_snapshot_and_drops_cached_results():
+    index = _index()
+    assert index.search("argumentar")[0]["match"] == "exact"
+    index.load([(1, "Argumentar", "nuevo", "skills.csv", None)])
+    (result,) = index.search("argumentar")
+    assert result["content"] == "nuevo"
+
+
+def test_counters_are_exact_under_concurrent_searches():
+    index = _index()
+    queries = ["argumentacion", "mu", "zzz", "sistemico"]
+
+    def search_many():
+        for _ in range(500):
+            for query in queries:
+                index.search(query)
+
+    threads = [threading.Thread(target=search_many) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = index.stats()
+    assert stats["lookups"] == 8 * 500 * len(queries)
+    counters = stats["counters"]
+    assert counters["cache_hits"] + counters["cache_misses"] == stats["lookups"]
+    assert counters["not_found"] == 8 * 500
@@ -1,3 +1,8 @@
+-- Schema of the ICFES RAG database.
+-- Postgres runs this file only when the data volume is first initialised. Every
+-- statement is idempotent (IF NOT EXISTS), so existing databases are migrated by
+-- running it again (see README, "Actualizar una base existente").
+
 -- Enable pgvector extension
 CREATE EXTENSION IF NOT EXISTS vector;
 
@@ -12,12 +17,30 @@ CREATE TABLE IF NOT EXISTS rag_documents (
     content TEXT NOT NULL,
     metadata JSONB DEFAULT '{}'::jsonb,
     source_file TEXT,
+    doc_key TEXT, -- '<doc_type>:<skill|pattern>', identity used by ETL upserts (source_file is only an attribute)
+    content_hash TEXT, -- SHA-256 of normalized content, skips re-embedding unchanged documents
+    minhash BIGINT[], -- MinHash signature (128 permutations) for near-duplicate detection
+    lsh_bands TEXT[], -- LSH band keys of the signature; shared key => near-duplicate candidate
     embedding VECTOR(1536) -- Adjust dimension based on embedding model (e.g., OpenAI text-embedding-ada-002 is 1536)
 );
 
--- Index for faster vector similarity search
-CREATE INDEX IF NOT EXISTS rag_documents_embedding_idx ON rag_documents USING ivfflat (embedding vector_cosine_ops)
-WITH (lists = 100);
+-- Idempotent ETL (databases created before these columns existed)
+ALTER TABLE rag_documents ADD COLUMN IF NOT EXISTS doc_key TEXT;
+ALTER TABLE rag_documents ADD COLUMN IF NOT EXISTS content_hash TEXT;
+ALTER TABLE rag_documents ADD COLUMN IF NOT EXISTS minhash BIGINT[];
+ALTER TABLE rag_documents ADD COLUMN IF NOT EXISTS lsh_bands TEXT[];
+CREATE UNIQUE INDEX IF NOT EXISTS rag_documents_doc_key_idx ON rag_documents (doc_key);
+
+-- Keyset pagination of /documents per doc_type
+CREATE INDEX IF NOT EXISTS rag_documents_doc_type_id_idx ON rag_documents (doc_type, id);
+
+-- Duplicate detection without scanning content
+CREATE INDEX IF NOT EXISTS rag_documents_content_hash_idx ON rag_documents (content_hash);
+CREATE INDEX IF NOT EXISTS rag_documents_lsh_bands_idx ON rag_documents USING gin (lsh_bands);
+
+-- The ANN index on embeddings (rag_documents_embedding_idx) is not created here: an
+-- ivfflat index built on an empty table has meaningless centroids. The API builds it
+-- after bulk loads, sized to the row count (backend/core/pgvector_indexes.py).
 
 -- Table for storing generated items
 CREATE TABLE IF NOT EXISTS items_bank (
@@ -27,8 +50,57 @@ CREATE TABLE IF NOT EXISTS items_bank (
     difficulty TEXT,
     question_content JSONB NOT NULL, -- Stores the full JSON of the question
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-    status TEXT DEFAULT 'draft' -- 'draft', 'approved', 'rejected'
+    status TEXT DEFAULT 'draft', -- 'draft', 'approved', 'rejected'
+    served_at TIMESTAMP WITH TIME ZONE, -- NULL while the item waits in the generation pool
+    validation_issues JSONB, -- rule-based validator findings, NULL until validated
+    form_id UUID, -- forms row when assembled from a blueprint
+    form_slot INTEGER -- position in the form; NULL for rejected attempts
+);
+
+ALTER TABLE items_bank ADD COLUMN IF NOT EXISTS served_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE items_bank ADD COLUMN IF NOT EXISTS validation_issues JSONB;
+ALTER TABLE items_bank ADD COLUMN IF NOT EXISTS form_id UUID;
+ALTER TABLE items_bank ADD COLUMN IF NOT EXISTS form_slot INTEGER;
+
+-- One accepted item per form position, whatever worker produced it
+CREATE UNIQUE INDEX IF NOT EXISTS items_bank_form_slot_key ON items_bank (form_id, form_slot) WHERE form_slot IS NOT NULL;
+
+-- Pool lookups: ready items per (exam, skill, difficulty), oldest first
+CREATE INDEX IF NOT EXISTS items_bank_pool_idx ON items_bank (exam, skill, difficulty, created_at)
+WHERE status = 'draft' AND served_at IS NULL;
+
+-- Validation backfill: rows banked before the validator ran on them
+CREATE INDEX IF NOT EXISTS items_bank_unvalidated_idx ON items_bank (id) WHERE validation_issues IS NULL;
+
+-- Exports walk the bank in (created_at, id) order and resume from a watermark
+CREATE INDEX IF NOT EXISTS items_bank_created_id_idx ON items_bank (created_at, id);
+
+-- Form assembly: filled slots per form (resume reads them back)
+CREATE INDEX IF NOT EXISTS items_bank_form_idx ON items_bank (form_id, form_slot) WHERE form_id IS NOT NULL;
+
+-- Exam forms assembled from a blueprint (counts per skill and difficulty)
+CREATE TABLE IF NOT EXISTS forms (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    name TEXT,
+    exam TEXT,
+    blueprint JSONB NOT NULL,
+    n_slots INTEGER,
+    status TEXT DEFAULT 'assembling', -- 'assembling', 'complete', 'incomplete', 'failed'
+    summary JSONB,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+-- Last row handed to each incremental export consumer
+CREATE TABLE IF NOT EXISTS export_watermarks (
+    name TEXT PRIMARY KEY,
+    last_created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_id UUID NOT NULL,
+    rows_exported BIGINT DEFAULT 0,
+    filters JSONB, -- filters the watermark was created with; later exports must match
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
+ALTER TABLE export_watermarks ADD COLUMN IF NOT EXISTS filters JSONB;
 
 -- Table for similarity checks (storing embeddings of generated or restricted items)
 CREATE TABLE IF NOT EXISTS similarity_items (
@@ -39,13 +111,49 @@ CREATE TABLE IF NOT EXISTS similarity_items (
     source TEXT -- 'generated', 'historical_restricted'
 );
 
-CREATE INDEX IF NOT EXISTS similarity_items_embedding_idx ON similarity_items USING ivfflat (embedding vector_cosine_ops)
-WITH (lists = 100);
+CREATE UNIQUE INDEX IF NOT EXISTS similarity_items_content_hash_idx ON similarity_items (content_hash);
+
+-- similarity_items_embedding_idx is built after loads as well (backend/core/pgvector_indexes.py)
+
+-- Settings of the last build of each managed ANN index
+CREATE TABLE IF NOT EXISTS vector_indexes (
+    table_name TEXT PRIMARY KEY,
+    index_name TEXT NOT NULL,
+    method TEXT NOT NULL, -- 'ivfflat', 'hnsw', or 'exact' (too few rows, no index)
+    quantization TEXT NOT NULL, -- 'none', 'halfvec', 'binary'
+    params JSONB DEFAULT '{}'::jsonb, -- lists, or m / ef_construction
+    rows_at_build BIGINT DEFAULT 0,
+    build_seconds DOUBLE PRECISION,
+    built_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    desired_method TEXT, -- override from a rebuild request (endpoint/CLI); NULL = VECTOR_INDEX_METHOD
+    desired_quantization TEXT -- NULL = VECTOR_INDEX_QUANTIZATION
+);
+ALTER TABLE vector_indexes ADD COLUMN IF NOT EXISTS desired_method TEXT;
+ALTER TABLE vector_indexes ADD COLUMN IF NOT EXISTS desired_quantization TEXT;
 
 -- Table to log generation runs
 CREATE TABLE IF NOT EXISTS generation_runs (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     prompt_used TEXT,
     parameters JSONB,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    item_id UUID, -- items_bank row, NULL when generation failed
+    exam TEXT,
+    skill TEXT,
+    difficulty TEXT,
+    output JSONB,
+    status TEXT, -- 'ok', 'fallback', 'unparsed'
+    error TEXT,
+    duration_ms DOUBLE PRECISION
 );
+
+ALTER TABLE generation_runs ADD COLUMN IF NOT EXISTS item_id UUID;
+ALTER TABLE generation_runs ADD COLUMN IF NOT EXISTS exam TEXT;
+ALTER TABLE generation_runs ADD COLUMN IF NOT EXISTS skill TEXT;
+ALTER TABLE generation_runs ADD COLUMN IF NOT EXISTS difficulty TEXT;
+ALTER TABLE generation_runs ADD COLUMN IF NOT EXISTS output JSONB;
+ALTER TABLE generation_runs ADD COLUMN IF NOT EXISTS status TEXT;
+ALTER TABLE generation_runs ADD COLUMN IF NOT EXISTS error TEXT;
+ALTER TABLE generation_runs ADD COLUMN IF NOT EXISTS duration_ms DOUBLE PRECISION;
+
+CREATE INDEX IF NOT EXISTS generation_runs_created_at_idx ON generation_runs (created_at);